@@ -0,0 +1,129 @@
+"""
+Cost of parsing an incoming Activity and checking the channel's JWT
+
+Parsing: the recorded Teams payloads in teams_activities.json (personal
+and channel messages, a conversationUpdate, a typing Activity) are decoded
+and their fields extracted the legacy way (json.loads, then the .get()
+chains of the handlers, including the caller identity and dedup key) and
+with parse_activity() (orjson when installed, into a __slots__ Activity,
+type-checking the nested objects).
+
+Validation: tokens signed like the channel's (RS256, generated key) are
+checked by JwtValidator against a loaded key set, once with a new token
+per request (signature verified every time) and once with the token the
+channel reuses until it expires (verified once, then cached). Needs
+PyJWT[crypto].
+
+Usage: python benchmarks/bench_activity.py [--iterations 20000]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core import activity as activity_module
+from bot_core.activity import parse_activity
+from bot_core.auth import BOT_FRAMEWORK_ISSUER, JwtValidator
+
+PAYLOADS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "teams_activities.json")
+APP_ID = "4f9d1c2e-8a7b-4e3f-9c6d-5b2a1e8f7d6c"
+KID = "bench-key"
+
+
+def run_ready(coroutine):
+    """Run a coroutine that completes without suspending"""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError("the coroutine suspended")
+
+
+def legacy_parse(data):
+    """Decode and read the fields the way the handlers did before parse_activity()"""
+    body = json.loads(data)
+    from_user = body.get("from", {})
+    channel_data = body.get("channelData", {})
+    teams_user = channel_data.get("teamsUser", {})
+    conversation = body.get("conversation", {})
+    activity_id = body.get("id")
+    return (
+        body.get("type", ""),
+        body.get("text", ""),
+        body.get("serviceUrl", ""),
+        conversation.get("id", ""),
+        channel_data.get("tenant", {}).get("id") or teams_user.get("tenantId"),
+        teams_user.get("userPrincipalName"),
+        from_user.get("id"),
+        from_user.get("name"),
+        [member.get("id") for member in body.get("membersAdded", [])],
+        body.get("recipient", {}).get("id"),
+        from_user.get("aadObjectId") or from_user.get("id") or "",
+        channel_data.get("tenant", {}).get("id") or teams_user.get("tenantId") or conversation.get("tenantId") or "",
+        f"{conversation.get('id', '')}|{activity_id}" if activity_id else None
+    )
+
+
+def per_call_us(function, arguments, iterations):
+    count = len(arguments)
+    start = time.perf_counter()
+    for i in range(iterations):
+        function(arguments[i % count])
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def signing_key():
+    import jwt
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update(kid=KID, use="sig", endorsements=["msteams"])
+    return private_key, {"keys": [public_jwk]}
+
+
+def channel_token(private_key, service_url, n=0):
+    import jwt
+
+    now = int(time.time())
+    claims = {"iss": BOT_FRAMEWORK_ISSUER, "aud": APP_ID, "serviceurl": service_url, "nbf": now - 60,
+              "exp": now + 3600, "jti": str(n)}
+    return "Bearer " + jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": KID})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(PAYLOADS_PATH, encoding="utf-8") as f:
+        payloads = [json.dumps(activity).encode() for activity in json.load(f)]
+    decoder = "orjson" if activity_module._loads is not json.loads else "json"
+    print(f"{len(payloads)} recorded payloads, {sum(map(len, payloads)) // len(payloads)} bytes on average")
+    for name, parse in (("legacy json + .get() chains", legacy_parse), (f"parse_activity ({decoder})", parse_activity)):
+        print(f"  {name:30s}{per_call_us(parse, payloads, args.iterations):7.2f} us/activity")
+
+    private_key, jwks = signing_key()
+    activity = parse_activity(payloads[0])
+    validator = JwtValidator(APP_ID)
+    validator.load_keys(jwks)
+    # The keys are loaded, so validate() never awaits: drive the coroutine by hand, without a loop per call
+    validate = lambda authorization: run_ready(validator.validate(authorization, activity))
+
+    iterations = max(1, args.iterations // 20)
+    fresh_tokens = [channel_token(private_key, activity.service_url, n) for n in range(iterations)]
+    validator.cache_size = 0
+    print("JWT validation (RS256, 2048-bit key)")
+    print(f"  new token per request         {per_call_us(validate, fresh_tokens, iterations):7.2f} us/request")
+    validator.cache_size = 1024
+    print(f"  reused token (cached)         {per_call_us(validate, fresh_tokens[:1], args.iterations):7.2f} us/request")
+    print(f"  {validator.snapshot()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Attachment reading: download, text extraction and chunked summaries at growing file sizes
+
+Writes a plain-text file and a DOCX of each `--sizes` megabytes into a
+temporary directory, serves them from a local HTTP server and reads each
+one through AttachmentReader as a Teams file download link. The LLM
+is a coroutine that waits `--llm-latency` seconds and returns a sentence,
+so the numbers are the reader's own plus the simulated summary calls.
+Prints the wall time and the peak Python memory (tracemalloc) per file;
+the peak should stay about the same whatever the size, since only the
+chunks in flight are held (`--max-chunks` bounds how much is read).
+
+Usage: python benchmarks/bench_attachments.py [--sizes 1,10,50] [--llm-latency 0.2] [--max-chunks 20]
+"""
+
+import argparse
+import asyncio
+import functools
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zipfile
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core.activity import Activity, Attachment
+from bot_core.attachments import FILE_DOWNLOAD_INFO, AttachmentReader
+from bot_core.http_clients import close_clients
+
+WORDS = ("a költségvetés negyedéves jelentés projekt határidő csapat ügyfél szerződés kockázat bevétel "
+         "kiadás terv mérföldkő beszállító jóváhagyás felülvizsgálat ajánlat számla riport").split()
+WORD_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the reader stopped downloading (max_bytes)
+
+
+def paragraphs(megabytes, rng):
+    """Random paragraphs of about `megabytes` MB of UTF-8 text"""
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        paragraph = " ".join(rng.choices(WORDS, k=rng.randint(20, 120))) + "."
+        size += len(paragraph.encode()) + 1
+        yield paragraph
+
+
+def write_text(path, megabytes, rng):
+    with open(path, "w", encoding="utf-8") as f:
+        for paragraph in paragraphs(megabytes, rng):
+            f.write(paragraph + "\n")
+
+
+def write_docx(path, megabytes, rng):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive, \
+            archive.open("word/document.xml", "w") as xml:
+        xml.write(f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{WORD_NS}"><w:body>'.encode())
+        for paragraph in paragraphs(megabytes, rng):
+            xml.write(f"<w:p><w:r><w:t>{paragraph}</w:t></w:r></w:p>".encode())
+        xml.write(b"</w:body></w:document>")
+
+
+def summarizer(latency):
+    async def summarize(messages):
+        await asyncio.sleep(latency)
+        return "A rész a projekt költségvetéséről és határidőiről szól."
+    return summarize
+
+
+async def read_all(reader, directory, base_url, files):
+    # One event loop throughout: the pooled download client is bound to it
+    for name in files:
+        attachment = Attachment(FILE_DOWNLOAD_INFO, base_url + name, name,
+                                {"downloadUrl": base_url + name, "fileType": name.rsplit(".", 1)[-1]})
+        activity = Activity(type="message", service_url="https://smba.trafficmanager.net/emea/",
+                            attachments=(attachment,))
+        file_bytes = os.path.getsize(os.path.join(directory, name))
+        tracemalloc.start()
+        started = time.perf_counter()
+        document, = await reader.read(activity)
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"  {name:12s} {file_bytes / 1e6:7.1f}MB on the wire  {elapsed * 1000:7.0f}ms  "
+              f"peak={peak / 1e6:5.2f}MB  prompt={len(document)} chars")
+    await close_clients()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1,10,50", help="file sizes in MB, comma separated")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--max-chunks", type=int, default=20)
+    parser.add_argument("--summary-concurrency", type=int, default=4)
+    args = parser.parse_args()
+    sizes = [float(size) for size in args.sizes.split(",")]
+
+    directory = tempfile.mkdtemp(prefix="bench_attachments_")
+    rng = random.Random(1)
+    files = []
+    for size in sizes:
+        for extension, write in (("txt", write_text), ("docx", write_docx)):
+            name = f"{size:g}mb.{extension}"
+            write(os.path.join(directory, name), size, rng)
+            files.append(name)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/"
+    reader = AttachmentReader(None, summarizer(args.llm_latency), max_bytes=max(sizes) * 2 * 1024 * 1024,
+                              max_chunks=args.max_chunks, summary_concurrency=args.summary_concurrency)
+
+    print(f"llm latency {args.llm_latency * 1000:.0f}ms, max_chunks={args.max_chunks}, "
+          f"summary_concurrency={args.summary_concurrency}")
+    asyncio.run(read_all(reader, directory, base_url, files))
+    print(f"  {reader.snapshot()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
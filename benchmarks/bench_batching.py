@@ -0,0 +1,96 @@
+"""
+Ollama throughput in tokens/s: serialized vs unbounded vs micro-batched calls
+
+The mock Ollama host simulates a GPU with `--num-parallel` sequences per
+batch (see MockOllamaEngine in mock_servers.py). Every decode step admitting
+new requests stalls for `--prefill-ms`. Poisson arrivals at `--rps` are sent
+three ways:
+  serialized   one request at a time (MicroBatcher with parallelism 1)
+  unbounded    every request at once, queueing inside Ollama
+  batched      MicroBatcher at the host's parallelism with a `--window-ms` window
+Reported: generated tokens/s, prompt evaluations (prefill stalls) and
+latency percentiles.
+
+Usage: python benchmarks/bench_batching.py [--rps 4] [--requests 60] [--num-parallel 4]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bot_core.batching import MicroBatcher
+from mock_servers import start_mock_server
+
+REPLY = " ".join(["A", "következő", "sprint", "review", "csütörtökön", "tíz", "órakor", "lesz."] * 8)
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return f"p50={pick(50):7.1f}ms p95={pick(95):7.1f}ms"
+
+
+async def run(label, client, server, batcher, args):
+    rng = random.Random(1)
+    engine = server.engine
+    generated, prefills = engine.generated, engine.prefills
+    latencies = []
+
+    async def request(delay):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        async with batcher.slot() if batcher else contextlib.nullcontext():
+            response = await client.post(f"{server.url}/api/chat", json={
+                "model": "llama3", "messages": [{"role": "user", "content": "Mikor lesz a sprint review?"}], "stream": False
+            })
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+    arrivals, at = [], 0.0
+    for _ in range(args.requests):
+        at += rng.expovariate(args.rps)
+        arrivals.append(at)
+    start = time.perf_counter()
+    await asyncio.gather(*(request(delay) for delay in arrivals))
+    elapsed = time.perf_counter() - start
+    tokens = engine.generated - generated
+    print(f"{label:<11} {tokens / elapsed:7.1f} tokens/s  prefills={engine.prefills - prefills:4d}  "
+          f"{percentiles(latencies)}  ({elapsed:.1f}s)")
+    if batcher:
+        print(f"            {batcher.snapshot()}")
+        batcher.close()
+
+
+async def main_async(args):
+    server = start_mock_server(latency=0, chunk_latency=args.step_ms / 1000, reply=REPLY,
+                               ollama_parallel=args.num_parallel, prefill_latency=args.prefill_ms / 1000)
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=1000), timeout=600) as client:
+        await run("serialized", client, server, MicroBatcher(parallelism=1, window=0), args)
+        await run("unbounded", client, server, None, args)
+        await run("batched", client, server,
+                  MicroBatcher(parallelism=args.num_parallel, window=args.window_ms / 1000), args)
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rps", type=float, default=4)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--num-parallel", type=int, default=4)
+    parser.add_argument("--step-ms", type=float, default=10)
+    parser.add_argument("--prefill-ms", type=float, default=60)
+    parser.add_argument("--window-ms", type=float, default=20)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Proactive fan-out against a throttling Bot Connector
+
+Posts one activity to each of --conversations conversations on a mock
+Connector that answers 429 (Retry-After: 1) above --limit calls per
+second. Compares a naive fan-out (everything at once, no retry, as
+send_activity_to_conversation did) with OutboundSender.broadcast at its
+default bot-wide limits (40/s plus a burst of 10).
+
+Usage: python benchmarks/bench_broadcast.py [--conversations 1000] [--limit 50]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bot_core.outbound import OutboundSender
+from mock_servers import start_mock_server
+
+ACTIVITY = {"type": "message", "text": "Karbantartás ma 18:00-kor"}
+
+
+async def run(args):
+    server = start_mock_server(latency=0.02, connector_limit=args.limit)
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=200)) as client:
+        async def request(method, url, activity):
+            response = await client.request(method, url, json=activity, timeout=30)
+            response.raise_for_status()
+            return response
+
+        urls = [f"{server.url}/v3/conversations/conv-{i}/activities" for i in range(args.conversations)]
+        semaphore = asyncio.Semaphore(200)
+
+        async def naive(url):
+            async with semaphore:
+                try:
+                    await request("POST", url, ACTIVITY)
+                    return True
+                except httpx.HTTPError:
+                    return False
+
+        start = time.perf_counter()
+        delivered = sum(await asyncio.gather(*(naive(url) for url in urls)))
+        print(f"naive fan-out  delivered={delivered:5d}/{len(urls)}  429s={server.hits.get('throttled', 0):5d}  {time.perf_counter() - start:6.1f}s")
+
+        await asyncio.sleep(1.1)
+        server.hits.clear()
+        sender = OutboundSender(request)
+        start = time.perf_counter()
+        result = await sender.broadcast(
+            (("POST", url, ACTIVITY, url.split("/")[-2]) for url in urls), concurrency=50
+        )
+        print(f"OutboundSender delivered={result['sent']:5d}/{len(urls)}  429s={server.hits.get('throttled', 0):5d}  "
+              f"{time.perf_counter() - start:6.1f}s  {sender.snapshot()}")
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Announcement burst: identical questions with and without request coalescing
+
+`--requests` users ask one of `--questions` questions (the first ones far
+more often) within `--window` seconds, all in fresh conversations, so
+their prompts are identical per question. The mock Ollama host takes
+`--latency` seconds per reply and, like a real one, only runs `--parallel`
+requests at a time. The burst is sent straight to the host, then through
+SingleFlight.
+
+Usage: python benchmarks/bench_coalescing.py [--requests 60] [--window 2]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bot_core.coalescing import SingleFlight, prompt_key
+from mock_servers import start_mock_server
+
+SYSTEM_PROMPT = "Te egy barátságos Teams bot vagy. Válaszolj röviden és segítőkészen magyarul."
+QUESTIONS = [
+    "Mikor lesz az új irodaház átadása?",
+    "Hol lehet parkolni az új irodánál?",
+    "Változik a munkaidő a költözés után?",
+    "Kell új belépőkártyát igényelni?",
+    "Lesz büfé az új épületben?",
+]
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return f"p50={pick(50):7.1f}ms p95={pick(95):7.1f}ms max={ordered[-1] * 1000:7.1f}ms"
+
+
+async def run(label, ask, args, server):
+    rng = random.Random(1)
+    hits_before = server.hits.get("/api/chat", 0)
+    latencies = []
+
+    async def user(delay, question):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        await ask([{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": question}])
+        latencies.append(time.perf_counter() - start)
+
+    weights = [1 / (rank + 1) for rank in range(args.questions)]
+    await asyncio.gather(*(
+        user(rng.uniform(0, args.window), rng.choices(QUESTIONS[:args.questions], weights)[0])
+        for _ in range(args.requests)
+    ))
+    calls = server.hits.get("/api/chat", 0) - hits_before
+    print(f"{label:<12} {percentiles(latencies)}  upstream calls={calls}/{args.requests}")
+
+
+async def main_async(args):
+    server = start_mock_server(latency=args.latency, chunk_latency=0)
+    ollama_slots = asyncio.Semaphore(args.parallel)
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=100)) as client:
+        async def chat(messages):
+            async with ollama_slots:
+                response = await client.post(f"{server.url}/api/chat",
+                                             json={"model": "llama3", "messages": messages, "stream": False}, timeout=120)
+            response.raise_for_status()
+            return response.json()["message"]["content"]
+
+        await run("direct", chat, args, server)
+
+        coalescer = SingleFlight()
+        await run("coalesced", lambda messages: coalescer.do(prompt_key(messages, "llama3"), lambda: chat(messages)),
+                  args, server)
+        print(coalescer.snapshot())
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--questions", type=int, default=5, choices=range(1, len(QUESTIONS) + 1))
+    parser.add_argument("--window", type=float, default=2.0)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--parallel", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Cost of the bot engine itself per Activity, called in-process without an HTTP server
+
+Imports function_app.py (--host functions: BotEngine on asyncio) or
+app_simple.py (--host flask: the same engine on a ThreadedBot's loop thread,
+called from a thread pool like gunicorn's request threads) configured for the
+mock upstreams and feeds load-test message Activities straight into
+bot_engine.handle(): no listener, no HTTP parsing, no client. The mocks
+run in a child process and answer after --upstream-latency (default 0), so
+the CPU time per Activity is the engine's own: dedup, admission, history
+and context building, the provider call and the Connector post. With
+--llm echo no LLM is configured and the reply is an echo.
+
+--profile prints the functions with the most cumulative time (cProfile).
+It sees the thread it runs on: the event loop for --host functions; for
+--host flask the engine runs on the bot's loop thread, so the profile shows
+the request threads' waiting and little of the engine.
+
+Usage:
+  python benchmarks/bench_engine.py --host functions --requests 2000 --concurrency 16
+  python benchmarks/bench_engine.py --host flask --llm echo --profile
+"""
+
+import argparse
+import asyncio
+import cProfile
+import collections
+import json
+import logging
+import multiprocessing
+import os
+import pstats
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from load_test import APP_ID, TENANT_ID, ActivityFactory, env_values, free_port, percentile
+from mock_servers import start_mock_server
+
+
+def serve_mocks(port, latency):
+    start_mock_server(port=port, latency=latency, chunk_latency=0).serve_forever()
+
+
+def start_mocks(latency):
+    """The mock upstreams in a child process, so their CPU time is not the engine's"""
+    port = free_port()
+    process = multiprocessing.Process(target=serve_mocks, args=(port, latency), daemon=True)
+    process.start()
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.post(f"{url}/x/oauth2/v2.0/token", timeout=1)
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    raise SystemExit("mock upstreams did not start")
+
+
+def load_engine(args, mock_url):
+    """Import the host module configured for the mocks and return it"""
+    env = {
+        "MicrosoftAppId": APP_ID,
+        "MicrosoftAppPassword": "bench-engine-secret",
+        "MicrosoftAppTenantId": TENANT_ID,
+        "BOT_TOKEN_ENDPOINT": mock_url + "/{tenant_id}/oauth2/v2.0/token",
+        "LLM_PROVIDER": "llama3" if args.llm == "ollama" else "none",
+        "LLAMA3_API_URL": mock_url,
+        "LOG_LEVEL": "WARNING",
+        # Measure the engine, not the Teams rate limit or the per-user quotas
+        "OUTBOUND_GLOBAL_RATE": "1000000",
+        "OUTBOUND_GLOBAL_BURST": "100000",
+        "OUTBOUND_CONVERSATION_RATE": "1000000",
+        "OUTBOUND_CONVERSATION_BURST": "100000",
+        "ADMISSION_USER_RATE_PER_MINUTE": "100000000",
+        "ADMISSION_USER_BURST": "100000",
+        "ADMISSION_TENANT_RATE_PER_MINUTE": "100000000",
+        "ADMISSION_TENANT_BURST": "100000",
+        **dict(item.split("=", 1) for item in args.env)
+    }
+    os.environ.update(env)
+    if args.host == "flask":
+        # app_simple.py (re)loads its settings file over the environment
+        settings = os.path.join(tempfile.mkdtemp(prefix="bench_engine_"), "local.settings.json")
+        with open(settings, "w") as f:
+            json.dump({"IsEncrypted": False, "Values": env_values(env)}, f)
+        os.environ["SETTINGS_FILE"] = settings
+        import app_simple as host
+    else:
+        import function_app as host
+    logging.getLogger().setLevel(logging.WARNING)
+    return host
+
+
+class Measurement:
+    """Wall and CPU time, and replies posted, of the measured Activities (optionally under cProfile)"""
+
+    def __init__(self, engine, profile):
+        self.engine = engine
+        self.profiler = cProfile.Profile() if profile else None
+
+    def __enter__(self):
+        self.sent = self.engine.connector.outbound.stats["sent"]
+        self.cpu, self.wall = time.process_time(), time.perf_counter()
+        if self.profiler:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profiler:
+            self.profiler.disable()
+        self.cpu, self.wall = time.process_time() - self.cpu, time.perf_counter() - self.wall
+        self.sent = self.engine.connector.outbound.stats["sent"] - self.sent
+
+
+async def drive_async(engine, activities, concurrency):
+    samples = []
+    activities = iter(activities)
+
+    async def worker():
+        for activity in activities:
+            start = time.perf_counter()
+            response = await engine.handle(activity)
+            samples.append((time.perf_counter() - start, response.status_code))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def drive_threads(bot, engine, activities, concurrency):
+    def one(activity):
+        start = time.perf_counter()
+        response = bot.run(engine.handle(activity))
+        return time.perf_counter() - start, response.status_code
+
+    if concurrency == 1:
+        return [one(activity) for activity in activities]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, activities))
+
+
+async def measure_async(engine, warmup, activities, concurrency, measurement):
+    # One event loop throughout: the pooled clients and token refresh timers are bound to it
+    await drive_async(engine, warmup, concurrency)
+    with measurement:
+        return await drive_async(engine, activities, concurrency)
+
+
+def measure(args, host, warmup, activities, measurement):
+    engine, concurrency = host.bot_engine, args.concurrency
+    if args.host == "functions":
+        return asyncio.run(measure_async(engine, warmup, activities, concurrency, measurement))
+    # The Flask host's engine lives on the ThreadedBot loop thread; threads wait on it like gunicorn's
+    drive_threads(host.bot, engine, warmup, concurrency)
+    with measurement:
+        return drive_threads(host.bot, engine, activities, concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", choices=["functions", "flask"], default="functions")
+    parser.add_argument("--llm", choices=["ollama", "echo"], default="ollama", help="mock Ollama or no LLM")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="seconds every mock call waits")
+    parser.add_argument("--profile", action="store_true", help="print the top functions by cumulative time")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra host setting")
+    args = parser.parse_args()
+
+    mocks, mock_url = start_mocks(args.upstream_latency)
+    host = load_engine(args, mock_url)
+    factory = ActivityFactory(f"{mock_url}/", args.conversations)
+
+    warmup = [factory() for _ in range(args.warmup)]
+    activities = [factory() for _ in range(args.requests)]
+    measurement = Measurement(host.bot_engine, args.profile)
+    samples = measure(args, host, warmup, activities, measurement)
+    mocks.terminate()
+
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    statuses = collections.Counter(status for _, status in samples)
+    print(f"{args.host} engine, llm={args.llm}, {args.requests} activities, concurrency={args.concurrency}, "
+          f"upstream latency {args.upstream_latency * 1000:.0f}ms")
+    print(f"  throughput   {args.requests / measurement.wall:8.1f} activities/s")
+    print(f"  cpu          {measurement.cpu / args.requests * 1000:8.3f} ms/activity")
+    print(f"  latency      p50={percentile(latencies, 50):.2f}ms p99={percentile(latencies, 99):.2f}ms")
+    print(f"  statuses     {dict(statuses)}  replies posted: {measurement.sent}")
+    if measurement.profiler:
+        print()
+        pstats.Stats(measurement.profiler).sort_stats("cumulative").print_stats(args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Conversation history stores: memory footprint and latency
+
+Fills each store with --conversations conversations of --turns user/bot
+turns, then reads every conversation back. Reports per-call latency
+percentiles, and either the Python heap (tracemalloc) or the database size.
+"legacy" is the previous module-level dict with list slicing; "memory LRU/10"
+caps the store at a tenth of the conversations to show eviction.
+
+Usage: python benchmarks/bench_history.py [--conversations 100000] [--turns 6]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core.history import MemoryHistoryStore, SqliteHistoryStore
+
+
+class LegacyHistory:
+    """The previous implementation, for comparison"""
+
+    def __init__(self):
+        self._conversation_history = {}
+
+    def get(self, conversation_id):
+        return self._conversation_history.get(conversation_id, [])
+
+    def extend(self, conversation_id, messages):
+        for message in messages:
+            if conversation_id not in self._conversation_history:
+                self._conversation_history[conversation_id] = []
+            self._conversation_history[conversation_id].append(message)
+            if len(self._conversation_history[conversation_id]) > 10:
+                self._conversation_history[conversation_id] = self._conversation_history[conversation_id][-10:]
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1e6
+    return f"p50={pick(50):6.1f}us p99={pick(99):7.1f}us"
+
+
+def fill(store, conversations, turns, append_times=None):
+    for turn in range(turns):
+        for i in range(conversations):
+            messages = [
+                {"role": "user", "content": f"Kérdés {turn} a(z) {i}. beszélgetésben"},
+                {"role": "assistant", "content": f"Válasz {turn} a(z) {i}. beszélgetésben"},
+            ]
+            start = time.perf_counter()
+            store.extend(f"conversation-{i}", messages)
+            if append_times is not None:
+                append_times.append(time.perf_counter() - start)
+
+
+def run(name, make_store, conversations, turns):
+    store = make_store()
+    append_times = []
+    fill(store, conversations, turns, append_times)
+    get_times = []
+    for i in range(conversations):
+        start = time.perf_counter()
+        store.get(f"conversation-{i}")
+        get_times.append(time.perf_counter() - start)
+
+    if isinstance(store, SqliteHistoryStore):
+        size = f"db={os.path.getsize(store.path) / 2**20:7.1f}MiB"
+    else:
+        # Separate pass: tracemalloc would distort the latencies above
+        del store
+        tracemalloc.start()
+        store = make_store()
+        fill(store, conversations, turns)
+        size = f"heap={tracemalloc.get_traced_memory()[0] / 2**20:7.1f}MiB"
+        tracemalloc.stop()
+
+    print(f"{name:<13} {size}  append {percentiles(append_times)}  get {percentiles(get_times)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=6)
+    parser.add_argument("--skip-sqlite", action="store_true")
+    args = parser.parse_args()
+
+    print(f"conversations={args.conversations} turns={args.turns}")
+    run("legacy", LegacyHistory, args.conversations, args.turns)
+    run("memory", lambda: MemoryHistoryStore(max_conversations=args.conversations), args.conversations, args.turns)
+    run("memory LRU/10", lambda: MemoryHistoryStore(max_conversations=args.conversations // 10), args.conversations, args.turns)
+    if not args.skip_sqlite:
+        path = os.path.join(tempfile.mkdtemp(), "bench_history.db")
+        run("sqlite", lambda: SqliteHistoryStore(path, max_conversations=args.conversations), args.conversations, args.turns)
+
+
+if __name__ == "__main__":
+    main()
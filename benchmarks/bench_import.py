@@ -0,0 +1,154 @@
+"""
+Import time of function_app.py, the part of an Azure Functions cold start the code controls
+
+Imports the module `--runs` times in fresh interpreters with
+`python -X importtime` (after one unmeasured run that compiles the .pyc
+files) and reports the median total and its heaviest direct imports. The
+provider is configured (dummy endpoints, nothing is contacted), so the
+import takes the same path as in production. Modules listed in `--lazy`
+must be loaded on first use, not at import time; one that shows up counts
+as a regression.
+
+--json writes the results (with the git commit) for CI; with --baseline the
+run is compared with an earlier result file and the exit status is 1 if
+the median import time grew by more than --max-regression or a lazy module
+is imported eagerly.
+
+Usage:
+  python benchmarks/bench_import.py [--runs 7] [--provider azure]
+  python benchmarks/bench_import.py --json new.json --baseline main.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROVIDER_ENV = {
+    "azure": {
+        "LLM_PROVIDER": "azure",
+        "AZURE_OPENAI_ENDPOINT": "https://bench-import.openai.azure.com",
+        "AZURE_OPENAI_API_KEY": "bench-import-key",
+    },
+    "llama3": {
+        "LLM_PROVIDER": "llama3",
+        "LLAMA3_API_URL": "http://127.0.0.1:11434",
+    },
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def import_times(module, env):
+    """One fresh import: [(imported module, depth, cumulative ms)] from -X importtime, children before parents"""
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{process.stderr[-4000:]}")
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        stripped = name.lstrip()
+        times.append((stripped, (len(name) - len(stripped) - 1) // 2, int(cumulative) / 1000))
+    return times
+
+
+def direct_imports(times, module):
+    """{module imported by `module` itself: cumulative ms}"""
+    end = next(index for index, (name, depth, _) in enumerate(times) if name == module and depth == 0)
+    start = end
+    while start > 0 and times[start - 1][1] > 0:
+        start -= 1
+    return {name: ms for name, depth, ms in times[start:end] if depth == 1}
+
+
+def run(args):
+    env = dict(os.environ, **PROVIDER_ENV[args.provider], LOG_LEVEL="WARNING")
+    import_times(args.module, env)
+    runs = [import_times(args.module, env) for _ in range(args.runs)]
+
+    totals = [next(ms for name, depth, ms in times if name == args.module and depth == 0) for times in runs]
+    direct = [direct_imports(times, args.module) for times in runs]
+    imports = {name: round(statistics.median(found.get(name, 0.0) for found in direct), 1) for name in direct[0]}
+    heaviest = dict(sorted(imports.items(), key=lambda item: -item[1])[:args.top])
+    lazy = [name.strip() for name in args.lazy.split(",") if name.strip()]
+    imported = [{name.split(".")[0] for name, _, _ in times} for times in runs]
+    return {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "module": args.module,
+        "provider": args.provider,
+        "runs": args.runs,
+        "import_ms": {
+            "median": round(statistics.median(totals), 1),
+            "min": round(min(totals), 1),
+            "max": round(max(totals), 1),
+        },
+        "heaviest_imports_ms": heaviest,
+        "eager": [name for name in lazy if any(name in names for names in imported)],
+    }
+
+
+def print_result(result):
+    total = result["import_ms"]
+    print(f"import {result['module']} ({result['provider']}): median={total['median']}ms "
+          f"min={total['min']}ms max={total['max']}ms over {result['runs']} runs")
+    print("  heaviest direct imports (cumulative):")
+    for name, ms in result["heaviest_imports_ms"].items():
+        print(f"    {name:<32} {ms:8.1f}ms")
+    print(f"  lazy modules imported eagerly: {', '.join(result['eager']) or 'none'}")
+
+
+def compare(result, baseline, max_regression):
+    """Print the change of the median import time; returns the names of what regressed"""
+    regressed = [f"eager import of {name}" for name in result["eager"]]
+    old, new = baseline["import_ms"]["median"], result["import_ms"]["median"]
+    change = (new - old) / old
+    worse = change > max_regression
+    if worse:
+        regressed.append("import_ms.median")
+    print(f"\nvs baseline {baseline.get('commit')} ({baseline.get('time')}):")
+    print(f"  import_ms.median {old:>10} -> {new:<10} {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="function_app")
+    parser.add_argument("--provider", choices=sorted(PROVIDER_ENV), default="azure")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--top", type=int, default=10, help="direct imports to list")
+    parser.add_argument("--lazy", default="openai,tiktoken,numpy,redis,opentelemetry,requests,jwt,cryptography",
+                        help="comma-separated modules that must not be imported at import time")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    result = run(args)
+    print_result(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(result, json.load(f), args.max_regression)
+        if regressed:
+            raise SystemExit(f"Regression in {', '.join(regressed)}")
+
+
+if __name__ == "__main__":
+    main()
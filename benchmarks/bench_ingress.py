@@ -0,0 +1,74 @@
+"""
+Ingress latency benchmark for the background work queue
+
+Submits a burst of Activities to a WorkQueue whose handler simulates a slow
+LLM call, and reports how long submit() takes (the part the HTTP handler
+waits for before returning 202).
+
+Usage: python benchmarks/bench_ingress.py [--burst 2000] [--workers 4]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core.work_queue import WorkQueue, create_backend
+
+
+def make_activity(i):
+    return {
+        "type": "message",
+        "id": f"activity-{i}",
+        "text": f"Hello bot #{i}",
+        "serviceUrl": "https://smba.trafficmanager.net/emea/",
+        "conversation": {"id": f"conversation-{i % 50}"},
+        "from": {"id": f"user-{i % 200}", "name": "Benchmark User"},
+    }
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def run(kind, burst, workers, handler_delay):
+    path = os.path.join(tempfile.mkdtemp(), "bench_queue.db")
+    backend = create_backend(kind, maxsize=burst, sqlite_path=path)
+    work_queue = WorkQueue(backend, lambda payload: asyncio.sleep(handler_delay), workers=workers)
+    work_queue.start()
+
+    latencies = []
+    rejected = 0
+    for i in range(burst):
+        start = time.perf_counter()
+        if not await work_queue.submit(make_activity(i)):
+            rejected += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    await work_queue.drain(timeout=1)
+    print(
+        f"{kind:<7} burst={burst} p50={statistics.median(latencies):.3f}ms "
+        f"p95={percentile(latencies, 95):.3f}ms p99={percentile(latencies, 99):.3f}ms "
+        f"max={max(latencies):.3f}ms rejected={rejected}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--burst", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--handler-delay", type=float, default=2.0, help="simulated LLM latency in seconds")
+    args = parser.parse_args()
+
+    for kind in ("memory", "sqlite"):
+        asyncio.run(run(kind, args.burst, args.workers, args.handler_delay))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Logging overhead per request: eager f-string lines vs structured events
+
+Replays the log calls one message Activity used to make in function_app.py
+(about a dozen eager f-string logging.info lines with the full text, UPN
+and reply) against the structured events that replace them, with the
+logger at INFO and at WARNING. Records go through a real formatter into a
+discarded stream, so the numbers include formatting, not the I/O.
+
+Usage: python benchmarks/bench_logging.py [--requests 20000]
+"""
+
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core.structured_log import LogPolicy, StructuredLogger
+
+BODY = {
+    "type": "message",
+    "id": "1712345678901",
+    "text": "Szia! Mikor lesz a következő sprint review és ki tartja?" * 3,
+    "from": {"id": "29:1abcDEF", "name": "Kovács Anna", "aadObjectId": "0a1b2c3d-1111-2222-3333-444455556666"},
+    "conversation": {"id": "a:1xyzConversationId"},
+    "serviceUrl": "https://smba.trafficmanager.net/emea/",
+    "channelData": {
+        "tenant": {"id": "5363c28c-cdab-42ce-86c6-1b35f030504b"},
+        "teamsUser": {"userPrincipalName": "anna.kovacs@grepton.hu", "tenantId": "5363c28c-cdab-42ce-86c6-1b35f030504b"}
+    }
+}
+REPLY = "A következő sprint review csütörtökön 10 órakor lesz, Péter tartja. " * 4
+
+
+class NullStream(io.TextIOBase):
+    def write(self, text):
+        return len(text)
+
+
+def legacy_request(logger):
+    """The log calls of one message as function_app.py made them before"""
+    body = BODY
+    logger.info('=== Bot message received from Teams ===')
+    logger.info(f'Activity type: {body.get("type", "")}')
+    from_user = body.get("from", {})
+    channel_data = body.get("channelData", {})
+    teams_user_info = channel_data.get("teamsUser", {})
+    logger.info(f'User message: "{body.get("text", "")}"')
+    logger.info(f'User Name: {from_user.get("name", "Unknown")}')
+    logger.info(f'Teams User ID: {from_user.get("id", "N/A")}')
+    logger.info(f'AAD Object ID: {from_user.get("aadObjectId", None)}')
+    logger.info(f'User Principal Name (UPN/Email): {teams_user_info.get("userPrincipalName", None)}')
+    logger.info(f'Tenant ID: {channel_data.get("tenant", {}).get("id", None)}')
+    logger.info(f'Conversation ID: {body.get("conversation", {}).get("id", "")}')
+    logger.info(f'Service URL: {body.get("serviceUrl", "")}')
+    logger.info(f'User Domain: {teams_user_info.get("userPrincipalName", "").split("@")[1]}')
+    logger.info("User is from Grepton domain")
+    logger.info(f"Sending to LLM: {body.get('text', '')}")
+    logger.info(f"LLM response: {REPLY[:100]}...")
+    logger.info(f'Sending response: "{REPLY}"')
+    logger.info(f"Activity sent successfully to {body.get('conversation', {}).get('id', '')}")
+    logger.info("Response sent successfully via Bot Framework API")
+
+
+def structured_request(log):
+    """The structured events function_app.py logs for the same message"""
+    body = BODY
+    from_user = body.get("from", {})
+    channel_data = body.get("channelData", {})
+    teams_user = channel_data.get("teamsUser", {})
+    upn = teams_user.get("userPrincipalName")
+    conversation_id = body.get("conversation", {}).get("id")
+    log.info(
+        "activity_received",
+        activity_id=body.get("id"),
+        conversation_id=conversation_id,
+        tenant_id=channel_data.get("tenant", {}).get("id"),
+        domain=upn.split("@")[1] if upn and "@" in upn else None,
+        user_id=from_user.get("id"),
+        aad_object_id=from_user.get("aadObjectId"),
+        upn=upn,
+        user_name=from_user.get("name"),
+        text=body.get("text", "")
+    )
+    log.debug("llm_request", conversation_id=conversation_id, text=body.get("text", ""))
+    log.debug("llm_reply", conversation_id=conversation_id, reply=REPLY)
+    log.debug("activity_sent", conversation_id=conversation_id)
+    log.info("reply_sent", conversation_id=conversation_id, success=True, reply=REPLY)
+
+
+def measure(call, target, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        call(target)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler(NullStream())
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    logger = logging.getLogger("bench_logging")
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    cases = [
+        ("f-strings", legacy_request, logger),
+        ("structured", structured_request, StructuredLogger("bench_logging", LogPolicy())),
+        ("structured+limit", structured_request,
+         StructuredLogger("bench_logging", LogPolicy(rate_limits={logging.INFO: 20, logging.DEBUG: 20})))
+    ]
+    for level in (logging.INFO, logging.WARNING):
+        logger.setLevel(level)
+        for label, call, target in cases:
+            lines = io.StringIO()
+            handler.setStream(lines)
+            call(target)
+            emitted = lines.getvalue().count("\n")
+            handler.setStream(NullStream())
+            per_request = measure(call, target, args.requests)
+            print(f"{logging.getLevelName(level):<8} {label:<17} {per_request:7.2f} us/request  "
+                  f"{emitted:2d} lines/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Proactive notifications: registry writes, recipient selection and a resumable broadcast to --recipients users
+
+Records one Activity for each of --users personal conversations (two
+tenants, a few UPN domains) into a ConversationRegistry in a temporary
+directory, twice: the repeat costs no write. Then a Notifier with the
+real Connector (token and Connector calls to the mock upstreams, which
+answer 429 above --limit calls per second like Teams) sends a message to
+the first --recipients of them at the default outbound limits (40/s plus
+a burst of 10). After --interrupt seconds the runner is stopped and a new
+Notifier, as a restarted process would, resumes the job; every recipient
+should get the message exactly once.
+
+Usage: python benchmarks/bench_notify.py [--users 20000] [--recipients 10000] [--limit 50] [--interrupt 20]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core.activity import Activity
+from bot_core.connector import Connector
+from bot_core.http_clients import close_clients
+from bot_core.notify import Notifier
+from bot_core.structured_log import LogPolicy, StructuredLogger, parse_level_map
+from mock_servers import start_mock_server
+
+TENANTS = ("5363c28c-cdab-42ce-86c6-1b35f030504b", "0b1f7c1e-6d2a-4a8e-9f51-3c7d2e9a4b60")
+DOMAINS = ("grepton.hu", "grepton.com", "partner.hu")
+API_KEY = "bench-notify-key"
+
+
+def activity(n):
+    return Activity(type="message", id=str(n), service_url="https://smba.trafficmanager.net/emea/", channel_id="msteams",
+                    conversation_id=f"a:1bench-notify-conversation-{n}", conversation_type="personal",
+                    from_id=f"29:1bench-user-{n}", aad_object_id=str(uuid.UUID(int=n)), tenant_id=TENANTS[n % 2],
+                    upn=f"user.{n}@{DOMAINS[n % 3]}")
+
+
+def notifier(server, path, concurrency):
+    connector = Connector("bench-app", "secret", TENANTS[0], token_endpoint=f"{server.url}/{{tenant_id}}/oauth2/v2.0/token")
+    # The Connector posts to the conversations' service URL; point it at the mock
+    connector.outbound.request = lambda method, url, activity: connector._call(
+        method, url.replace("https://smba.trafficmanager.net/emea/", f"{server.url}/"), activity)
+    return Notifier(connector, path, api_key=API_KEY, concurrency=concurrency,
+                    log=StructuredLogger("bench_notify", LogPolicy(rate_limits=parse_level_map("INFO:5,WARNING:5"))))
+
+
+async def wait_for(notify, job_id, until, report_every=10.0):
+    """Poll a job's progress until `until(progress)`, printing it now and then"""
+    last = 0.0
+    while True:
+        progress = (await notify.progress(job_id, f"Bearer {API_KEY}")).body
+        if until(progress):
+            return progress
+        if time.monotonic() - last >= report_every:
+            last = time.monotonic()
+            print(f"  {progress['status']:8s} sent={progress['sent']:6d} failed={progress['failed']:4d} "
+                  f"pending={progress['pending']:6d} eta={progress['eta_seconds'] or '-'}s")
+        await asyncio.sleep(0.2)
+
+
+async def run(args):
+    directory = tempfile.mkdtemp(prefix="bench_notify_")
+    path = os.path.join(directory, "notify.db")
+    server = start_mock_server(latency=0.02, connector_limit=args.limit)
+
+    first = notifier(server, path, args.concurrency)
+    registry = first.registry
+    for label in ("first write", "unchanged"):
+        start = time.perf_counter()
+        for n in range(args.users):
+            registry.record(activity(n))
+        elapsed = time.perf_counter() - start
+        print(f"record {args.users} conversations ({label}): {elapsed / args.users * 1e6:6.1f}us each")
+    print(f"registry file {sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1e6:.1f}MB "
+          f"(with WAL), {len(registry)} conversations")
+    for selector in ({"tenant": TENANTS[0]}, {"domain": "GREPTON.HU"}, {"tenant": TENANTS[1], "domain": "partner.hu"},
+                     {"users": [str(uuid.UUID(int=n)) for n in range(0, args.users, 4)]}):
+        start = time.perf_counter()
+        rows = registry.select(**selector)
+        name = ", ".join(f"{key}={value if key != 'users' else len(value)}" for key, value in selector.items())
+        print(f"select {name}: {len(rows)} conversations in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    users = [str(uuid.UUID(int=n)) for n in range(args.recipients)]
+    body = json.dumps({"text": "Karbantartás ma 18:00-kor, kb. 10 percig nem leszek elérhető.", "users": users})
+    started = time.monotonic()
+    response = await first.handle_request("application/json", body.encode(), f"Bearer {API_KEY}")
+    job_id = response.body["job_id"]
+    print(f"job {job_id[:8]} for {response.body['total']} recipients created in "
+          f"{(time.monotonic() - started) * 1000:.0f}ms (status {response.status_code})")
+
+    if args.interrupt:
+        progress = await wait_for(first, job_id, lambda p: time.monotonic() - started >= args.interrupt or p["status"] == "done")
+        first.close()
+        progress = await wait_for(first, job_id, lambda p: p["status"] != "running")
+        print(f"  stopped after {time.monotonic() - started:.0f}s: sent={progress['sent']} pending={progress['pending']}")
+        resumed = notifier(server, path, args.concurrency)
+        resumed.start()
+    else:
+        resumed = first
+    progress = await wait_for(resumed, job_id, lambda p: p["status"] == "done")
+    elapsed = time.monotonic() - started
+    throttled = server.hits.get("throttled", 0)
+    posts = sum(count for path_, count in server.hits.items() if path_.startswith("/v3/conversations/")) - throttled
+    print(f"done in {elapsed:.0f}s ({progress['total'] / elapsed:.1f}/s): sent={progress['sent']} failed={progress['failed']}, "
+          f"Connector posts={posts} (429s={throttled}), "
+          f"resumed={resumed.stats['resumed']} {resumed.connector.outbound.snapshot()}")
+    resumed.close()
+    await close_clients()
+    server.shutdown()
+    shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000, help="conversations in the registry")
+    parser.add_argument("--recipients", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=50, help="Connector calls per second before 429s")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--interrupt", type=float, default=20, help="seconds before the first runner stops (0 = never)")
+    args = parser.parse_args()
+    # One warning per throttled send otherwise; the 429s are counted at the end
+    logging.getLogger("bot_core.outbound").setLevel(logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
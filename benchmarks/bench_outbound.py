@@ -0,0 +1,86 @@
+"""
+Outbound pipeline throughput: blocking requests vs pooled async httpx
+
+Replays message Activities through function_app's bot engine (process_message)
+(Ollama call + Connector post) against local mock servers, and through an
+equivalent of the previous implementation that called requests.post from
+inside the async handler. Reports requests per second for each.
+
+Usage: python benchmarks/bench_outbound.py [--requests 200] [--concurrency 50] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_servers import start_mock_server
+
+
+def make_activity(i, service_url):
+    return {
+        "type": "message",
+        "id": f"activity-{i}",
+        "text": f"Hello bot #{i}",
+        "serviceUrl": service_url,
+        "conversation": {"id": f"conversation-{i}"},
+        "from": {"id": f"user-{i}", "name": "Benchmark User"},
+    }
+
+
+async def legacy_process_message_activity(body, llama3_url):
+    """The pre-async pipeline: blocking requests.post calls on the event loop"""
+    import requests
+
+    payload = {"model": "llama3", "messages": [{"role": "user", "content": body["text"]}], "stream": False}
+    reply = requests.post(f"{llama3_url}/api/chat", json=payload, timeout=30).json()["message"]["content"]
+    api_url = f"{body['serviceUrl']}v3/conversations/{body['conversation']['id']}/activities"
+    requests.post(api_url, json={"type": "message", "text": reply}, headers={"Authorization": "Bearer mock-token"})
+
+
+async def drive(process, total, concurrency, service_url):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            await process(make_activity(i, service_url))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock upstream latency in seconds")
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency)
+    service_url = f"{server.url}/"
+    os.environ["LLM_PROVIDER"] = "llama3"
+    os.environ["LLAMA3_API_URL"] = server.url
+    os.environ["BOT_TOKEN_ENDPOINT"] = server.url + "/{tenant_id}/oauth2/v2.0/token"
+
+    import function_app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    before = asyncio.run(drive(
+        lambda body: legacy_process_message_activity(body, server.url),
+        args.requests, args.concurrency, service_url
+    ))
+    after = asyncio.run(drive(function_app.bot_engine.process_message, args.requests, args.concurrency, service_url))
+
+    print(f"requests={args.requests} concurrency={args.concurrency} upstream_latency={args.latency * 1000:.0f}ms")
+    print(f"before (blocking requests): {before:8.1f} req/s")
+    print(f"after  (async httpx):       {after:8.1f} req/s  ({after / before:.1f}x)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Per-call overhead of building an AzureOpenAI client vs reusing it
+
+Measures (1) client construction alone: AzureOpenAI(...) per message, as
+app_simple.py used to do, vs ProviderRegistry.get() with an unchanged
+config; and (2) full chat calls against the local mock Azure OpenAI
+endpoint with a fresh client per call vs the registry client. The mock is
+plain HTTP, so TLS handshakes, which the reused pool also saves, are not
+included.
+
+Usage: python benchmarks/bench_provider_registry.py [--calls 200]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import AzureOpenAI
+
+from bot_core.provider_registry import ProviderRegistry
+from mock_servers import start_mock_server
+
+API_VERSION = "2024-12-01-preview"
+
+
+def timed(fn, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=0, chunk_latency=0)
+    config = (server.url, "mock-key", API_VERSION)
+    registry = ProviderRegistry({"azure": lambda endpoint, key, version: AzureOpenAI(
+        azure_endpoint=endpoint, api_key=key, api_version=version
+    )})
+    messages = [{"role": "user", "content": "Szia!"}]
+
+    def new_client():
+        return AzureOpenAI(azure_endpoint=config[0], api_key=config[1], api_version=config[2])
+
+    def chat(client):
+        client.chat.completions.create(model="gpt-4o-mini", messages=messages, max_tokens=500)
+
+    build_new = timed(new_client, args.calls)
+    build_reused = timed(lambda: registry.get("azure", config), args.calls)
+    call_new = timed(lambda: chat(new_client()), args.calls)
+    call_reused = timed(lambda: chat(registry.get("azure", config)), args.calls)
+
+    print(f"client per call:  construct {build_new:7.3f}ms  chat {call_new:7.3f}ms (median)")
+    print(f"registry client:  construct {build_reused:7.3f}ms  chat {call_reused:7.3f}ms (median)")
+    print(f"overhead removed per message: {call_new - call_reused:.3f}ms (clients built: {registry.builds})")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Document retrieval latency: vector, BM25 and hybrid top-k search over a memory-mapped index
+
+Builds a synthetic index (`--chunks` chunks of random words, random
+`--dim`-dimensional embeddings) in a temporary directory with the real
+build_index(), opens it with load_document_index() as the bot does, and
+times `--queries` searches of each kind. The LLM round trip is not
+included; the target is a few milliseconds per search.
+
+Usage: python benchmarks/bench_rag.py [--chunks 20000] [--dim 768] [--k 4]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from bot_core.rag import build_index, load_document_index
+
+WORDS = ("bot teams azure token connector endpoint üzenet válasz beszélgetés felhasználó deploy "
+         "függvény tenant manifest csatorna hitelesítés napló hiba kérés sor gunicorn ollama modell "
+         "dokumentáció beállítás titok jelszó tunnel port webhook értesítés csapat projekt").split()
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return f"p50={pick(50):6.2f}ms p99={pick(99):6.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    vectors = np.random.default_rng(1)
+    directory = tempfile.mkdtemp(prefix="bench_rag_")
+    with open(os.path.join(directory, "docs.md"), "w", encoding="utf-8") as f:
+        for number in range(args.chunks):
+            f.write(f"# Szakasz {number}\n\n{' '.join(rng.choices(WORDS, k=120))}\n\n")
+    started = time.perf_counter()
+    meta = build_index([os.path.join(directory, "docs.md")], os.path.join(directory, "index"),
+                       embed=lambda texts: vectors.standard_normal((len(texts), args.dim)), model="bench")
+    print(f"built {meta['chunks']} chunks x {args.dim} dims in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    index = load_document_index(os.path.join(directory, "index"), "bench")
+    print(f"loaded in {(time.perf_counter() - started) * 1000:.1f}ms (memory-mapped)")
+
+    queries = [(" ".join(rng.choices(WORDS, k=8)), vectors.standard_normal(args.dim)) for _ in range(args.queries)]
+    for label, kwargs in (("vector", lambda text, vector: {"vector": vector}),
+                          ("bm25", lambda text, vector: {"text": text}),
+                          ("hybrid", lambda text, vector: {"text": text, "vector": vector})):
+        latencies = []
+        for text, vector in queries:
+            start = time.perf_counter()
+            index.search(k=args.k, **kwargs(text, vector))
+            latencies.append(time.perf_counter() - start)
+        print(f"{label:<7} {percentiles(latencies)}")
+
+
+if __name__ == "__main__":
+    main()
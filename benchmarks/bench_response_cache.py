@@ -0,0 +1,73 @@
+"""
+Response cache lookup latency
+
+Fills a ResponseCache with --entries answered questions and measures the
+lookup time of exact hits and of semantic hits (vector search over the
+whole index). Embeddings come from a local deterministic function, so the
+numbers exclude the embedding call itself.
+
+Usage: python benchmarks/bench_response_cache.py [--entries 1000] [--dim 1536]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from bot_core.response_cache import ResponseCache
+
+SYSTEM = {"role": "system", "content": "Te egy barátságos Teams bot vagy. Válaszolj röviden és segítőkészen magyarul."}
+
+
+def make_embed(dim):
+    async def embed(text):
+        # Questions "... #n" and "... #n kérlek" share a seed, so they end up nearly identical
+        seed = int(text.split("#")[1].split()[0])
+        vector = np.random.default_rng(seed).standard_normal(dim)
+        if "kérlek" in text:
+            vector += np.random.default_rng(seed + 10**9).standard_normal(dim) * 0.05
+        return vector
+    return embed
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return f"p50={pick(50):.3f}ms p99={pick(99):.3f}ms"
+
+
+async def run(entries, dim, lookups):
+    cache = ResponseCache(max_entries=entries, embed=make_embed(dim), similarity=0.9)
+    for i in range(entries):
+        messages = [SYSTEM, {"role": "user", "content": f"Gyakori kérdés #{i}"}]
+        _, ticket = await cache.lookup(messages, "gpt-4o-mini")
+        cache.store(ticket, f"Válasz #{i}")
+
+    for label, suffix in (("exact", ""), ("semantic", " kérlek")):
+        samples = []
+        for i in range(lookups):
+            messages = [SYSTEM, {"role": "user", "content": f"Gyakori kérdés #{i % entries}{suffix}"}]
+            start = time.perf_counter()
+            reply, _ = await cache.lookup(messages, "gpt-4o-mini")
+            samples.append(time.perf_counter() - start)
+            assert reply == f"Válasz #{i % entries}", (label, reply)
+        print(f"{label:<8} entries={entries} dim={dim} {percentiles(samples)}")
+    print(cache.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--entries", type=int, default=1000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--lookups", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.entries, args.dim, args.lookups))
+
+
+if __name__ == "__main__":
+    main()
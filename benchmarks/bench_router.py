@@ -0,0 +1,108 @@
+"""
+Tail latency and availability: single Ollama host vs LLMRouter
+
+Three mock Ollama hosts whose chat requests stall for `--slow-latency`
+seconds `--slow-ratio` of the time; the third also fails 10% of its
+requests. The first (and fastest) host starts failing every request
+halfway through the run. The same load is sent to that host alone (LLM_PROVIDER=llama3) and to
+the router over all three (LLM_BACKENDS=...).
+
+Usage: python benchmarks/bench_router.py [--requests 400] [--concurrency 8]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bot_core.llm_router import Backend, LLMRouter
+from mock_servers import start_mock_server
+
+MESSAGES = [{"role": "user", "content": "Szia!"}]
+
+
+def ollama_backend(client, server):
+    async def chat(messages):
+        response = await client.post(f"{server.url}/api/chat", json={"model": "llama3", "messages": messages, "stream": False}, timeout=30)
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+    return Backend(server.url, "llama3", chat, kind="ollama")
+
+
+def fail(server):
+    server.error_ratio = 1.0
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return f"p50={pick(50):7.1f}ms p95={pick(95):7.1f}ms p99={pick(99):7.1f}ms"
+
+
+async def run(label, chat, requests, concurrency, on_halfway=None):
+    latencies, errors = [], 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            if i == requests // 2 and on_halfway:
+                on_halfway()
+            start = time.perf_counter()
+            try:
+                await chat(MESSAGES)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    print(f"{label:<14} {percentiles(latencies)}  errors={errors}/{requests}")
+
+
+async def main_async(args):
+    def hosts():
+        return [
+            start_mock_server(latency=0.05, chunk_latency=0, slow_ratio=args.slow_ratio, slow_latency=args.slow_latency, seed=1),
+            start_mock_server(latency=0.06, chunk_latency=0, slow_ratio=args.slow_ratio, slow_latency=args.slow_latency, seed=2),
+            start_mock_server(latency=0.08, chunk_latency=0, slow_ratio=args.slow_ratio, slow_latency=args.slow_latency,
+                              error_ratio=0.1, seed=3),
+        ]
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=100)) as client:
+        servers = hosts()
+        single = ollama_backend(client, servers[0])
+        await run("single host", single.chat, args.requests, args.concurrency, on_halfway=lambda: fail(servers[0]))
+        for server in servers:
+            stop(server)
+
+        servers = hosts()
+        router = LLMRouter([ollama_backend(client, server) for server in servers], hedge_min_delay=args.hedge_min_ms / 1000)
+        await run("router", router.chat, args.requests, args.concurrency, on_halfway=lambda: fail(servers[0]))
+        for server in servers:
+            stop(server)
+        print(router.snapshot())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--slow-ratio", type=float, default=0.02)
+    parser.add_argument("--slow-latency", type=float, default=1.5)
+    parser.add_argument("--hedge-min-ms", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
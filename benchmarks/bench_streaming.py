@@ -0,0 +1,81 @@
+"""
+Time to first visible text: buffered vs streaming replies
+
+Runs one message through function_app's bot engine (process_message) against a
+mock Ollama that emits a word every --chunk-latency seconds, with
+LLM_STREAMING off and on, and reports when the first message text was
+posted to the Connector and when the reply was complete.
+
+Usage: python benchmarks/bench_streaming.py [--words 60] [--chunk-latency 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_servers import start_mock_server
+
+
+async def measure(function_app, service_url, streaming):
+    engine = function_app.bot_engine
+    engine.stream = function_app.bot.assistant.stream if streaming else None
+    first_text = []
+    post = engine.connector.post
+
+    async def timed_post(url, conversation_id, activity):
+        if activity.get("type") == "message" and not first_text:
+            first_text.append(time.perf_counter())
+        return await post(url, conversation_id, activity)
+
+    engine.connector.post = timed_post
+    body = {
+        "type": "message",
+        "text": "Mesélj valamit!",
+        "serviceUrl": service_url,
+        "conversation": {"id": f"bench-streaming-{streaming}"},
+        "from": {"id": "user-1", "name": "Benchmark User"},
+    }
+    start = time.perf_counter()
+    try:
+        await engine.process_message(body)
+    finally:
+        del engine.connector.post
+    return (first_text[0] - start) * 1000, (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--words", type=int, default=60)
+    parser.add_argument("--chunk-latency", type=float, default=0.05, help="seconds between streamed words")
+    parser.add_argument("--interval-ms", type=int, default=1000, help="STREAM_UPDATE_INTERVAL_MS")
+    args = parser.parse_args()
+
+    reply = " ".join(f"szó{i}" for i in range(args.words))
+    server = start_mock_server(latency=0.01, chunk_latency=args.chunk_latency, reply=reply)
+    os.environ.update(
+        LLM_PROVIDER="llama3",
+        LLAMA3_API_URL=server.url,
+        BOT_TOKEN_ENDPOINT=server.url + "/{tenant_id}/oauth2/v2.0/token",
+        STREAM_UPDATE_INTERVAL_MS=str(args.interval_ms)
+    )
+
+    import function_app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    async def run():
+        for streaming in (False, True):
+            first, total = await measure(function_app, f"{server.url}/", streaming)
+            label = "streaming" if streaming else "buffered "
+            print(f"{label} first visible text: {first:8.1f}ms  complete: {total:8.1f}ms")
+
+    asyncio.run(run())
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Token endpoint calls and caller wait when the bot token expires under load
+
+--callers concurrent requests ask for a token right after the cached one
+expired (legacy cache: an unlocked dict with a fixed 3300s lifetime) and
+right after it entered the refresh window (AsyncTokenManager). The mock
+token endpoint answers after --latency seconds.
+
+Usage: python benchmarks/bench_token.py [--callers 200] [--latency 0.2]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from bot_core.token_manager import AsyncTokenManager
+from mock_servers import start_mock_server
+
+TOKEN_PATH = "/tenant/oauth2/v2.0/token"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000
+    return f"p50={pick(50):7.1f}ms p99={pick(99):7.1f}ms"
+
+
+async def timed_callers(get_token, callers):
+    async def one():
+        start = time.perf_counter()
+        await get_token()
+        return time.perf_counter() - start
+    return await asyncio.gather(*(one() for _ in range(callers)))
+
+
+async def run(args):
+    server = start_mock_server(latency=args.latency)
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=1000)) as client:
+        async def fetch(tenant_id, scope):
+            response = await client.post(f"{server.url}{TOKEN_PATH}", data={"scope": scope}, timeout=30)
+            response.raise_for_status()
+            return response.json()
+
+        # Legacy: check-then-fetch without a lock
+        cache = {"token": None, "expires_at": 0}
+
+        async def legacy_get():
+            now = time.time()
+            if cache["token"] and now < cache["expires_at"]:
+                return cache["token"]
+            token_data = await fetch("tenant", "scope")
+            cache["token"] = token_data["access_token"]
+            cache["expires_at"] = now + 3300
+            return cache["token"]
+
+        samples = await timed_callers(legacy_get, args.callers)
+        print(f"legacy cache   token calls={server.hits.get(TOKEN_PATH, 0):4d}  caller wait {percentiles(samples)}")
+
+        server.hits.clear()
+        clock = FakeClock()
+        manager = AsyncTokenManager(fetch, clock=clock)
+        await manager.get("tenant")
+        clock.now += 3599 - 200  # inside the refresh window, not yet expired
+        samples = await timed_callers(lambda: manager.get("tenant"), args.callers)
+        await asyncio.sleep(args.latency * 2)
+        print(f"token manager  token calls={server.hits.get(TOKEN_PATH, 0):4d}  caller wait {percentiles(samples)}  (incl. startup fetch)")
+        manager.close()
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--callers", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Transcript log: append throughput, last-N replay latency and cold-open time at growing log sizes
+
+Appends `--turns` user/bot turns spread over `--conversations`
+conversations to a TranscriptLog in a temporary directory (segments of
+`--segment-mb`), then measures tail(conversation, N) on the open log,
+closes it, and times opening it again as a new instance would (loading
+the .idx files) followed by the first replay of a random conversation.
+Finally the sealed segments are compacted. The replay cost should not
+grow with the log: N record reads through mmap.
+
+Usage: python benchmarks/bench_transcript.py [--turns 200000] [--conversations 10000] [--last 20]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_core.transcript import TranscriptLog
+
+WORDS = ("szia hogyan tudom beállítani a bot tokent teams csatornában köszönöm működik hiba üzenet "
+         "válasz azure függvény napló deploy holnap meeting jegyzet összefoglaló kérlek").split()
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda pct: ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1e6
+    return f"p50={pick(50):7.1f}us p99={pick(99):7.1f}us"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200000)
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--last", type=int, default=20, help="messages replayed per conversation")
+    parser.add_argument("--segment-mb", type=int, default=16)
+    parser.add_argument("--replays", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    directory = tempfile.mkdtemp(prefix="bench_transcript_")
+    options = dict(segment_bytes=args.segment_mb * 1024 * 1024, compact_segments=0)
+    texts = [" ".join(rng.choices(WORDS, k=rng.randint(5, 60))) for _ in range(1000)]
+    conversations = [f"a:1{number:08d}-teams-conversation" for number in range(args.conversations)]
+    pick = lambda: conversations[rng.randrange(len(conversations))]
+
+    log = TranscriptLog(directory, **options)
+    started = time.perf_counter()
+    for _ in range(args.turns):
+        log.extend(pick(), [{"role": "user", "content": rng.choice(texts), "tokens": 20},
+                            {"role": "assistant", "content": rng.choice(texts), "tokens": 40}])
+    elapsed = time.perf_counter() - started
+    size = log.snapshot()["bytes"]
+    print(f"appended {args.turns} turns ({size / 1e6:.0f}MB, {log.snapshot()['segments']} segments) "
+          f"in {elapsed:.1f}s: {args.turns / elapsed:,.0f} turns/s, {elapsed / args.turns * 1e6:.1f}us/turn")
+
+    samples = []
+    for _ in range(args.replays):
+        conversation_id = pick()
+        start = time.perf_counter()
+        log.tail(conversation_id, args.last)
+        samples.append(time.perf_counter() - start)
+    print(f"tail({args.last}) on the open log     {percentiles(samples)}")
+    log.close()
+
+    start = time.perf_counter()
+    log = TranscriptLog(directory, **options)
+    opened = time.perf_counter() - start
+    start = time.perf_counter()
+    restored = log.tail(pick(), args.last)
+    first = time.perf_counter() - start
+    print(f"cold open {opened * 1000:.1f}ms ({log.snapshot()['segments'] - 1} segments), first tail({args.last}) "
+          f"{first * 1e6:.0f}us ({len(restored)} messages)")
+    samples = []
+    for _ in range(args.replays):
+        conversation_id = pick()
+        start = time.perf_counter()
+        log.tail(conversation_id, args.last)
+        samples.append(time.perf_counter() - start)
+    print(f"tail({args.last}) after reopening     {percentiles(samples)}")
+
+    start = time.perf_counter()
+    log.compact()
+    print(f"compaction of {log.stats['compacted_records']} records: {time.perf_counter() - start:.1f}s, "
+          f"{log.snapshot()['segments']} segments left")
+    log.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Minimal HTTP server for function_app.py, for load tests without Functions Core Tools
+
+Serves the HTTP-triggered functions on one asyncio event loop, the way the
+Python worker runs async functions: /api/messages, /api/chat, /api/health,
+/api/metrics and /api/notify[/<job id>]; with WARMUP_SCHEDULE set, the warm-up timer's start-up
+run happens before the port opens. Keep-alive HTTP/1.1 with Content-Length bodies only;
+this is a benchmark harness, not a web server.
+
+Usage: python benchmarks/function_host.py --port 7071
+(configure the bot through environment variables before starting it)
+"""
+
+import argparse
+import asyncio
+import inspect
+import os
+import sys
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import azure.functions as func
+
+import function_app
+
+ROUTES = {
+    "/api/messages": function_app.messages,
+    "/api/chat": function_app.chat,
+    "/api/health": function_app.health_check,
+    "/api/metrics": function_app.metrics,
+    "/api/notify": function_app.notify,
+}
+
+# Routes with a trailing {parameter}: prefix -> (function, parameter name)
+PARAMETER_ROUTES = {
+    "/api/notify/": (function_app.notify, "job_id"),
+}
+
+
+async def read_request(reader):
+    """Parse one request; returns (method, path, headers, body) or None when the client closed"""
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip()] = value.strip()
+    length = int(headers.get("Content-Length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, target, headers, body
+
+
+async def dispatch(method, target, headers, body):
+    path, _, query = target.partition("?")
+    handler = ROUTES.get(path)
+    route_params = {}
+    for prefix, (function, name) in PARAMETER_ROUTES.items():
+        if handler is None and path.startswith(prefix) and "/" not in path[len(prefix):]:
+            handler, route_params = function, {name: path[len(prefix):]}
+    if handler is None:
+        return func.HttpResponse(status_code=404)
+    request = func.HttpRequest(method, f"http://localhost{target}", headers=headers, params=dict(parse_qsl(query)),
+                               route_params=route_params, body=body)
+    response = handler(request)
+    return await response if inspect.isawaitable(response) else response
+
+
+async def serve_client(reader, writer):
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            try:
+                response = await dispatch(*request)
+            except Exception as e:
+                response = func.HttpResponse(str(e), status_code=500)
+            payload = response.get_body() or b""
+            status = HTTPStatus(response.status_code)
+            lines = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Length: {len(payload)}"]
+            content_type = response.headers.get("Content-Type") or response.mimetype
+            if content_type:
+                lines.append(f"Content-Type: {content_type}")
+            lines += [f"{name}: {value}" for name, value in response.headers.items()
+                      if name.lower() not in ("content-length", "content-type")]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main_async(port):
+    if function_app.WARMUP_SCHEDULE:
+        await function_app.warm_up()
+    server = await asyncio.start_server(serve_client, "127.0.0.1", port, backlog=1024)
+    print(f"function_app listening on http://127.0.0.1:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=7071)
+    args = parser.parse_args()
+    asyncio.run(main_async(args.port))
+
+
+if __name__ == "__main__":
+    main()
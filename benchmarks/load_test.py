@@ -0,0 +1,454 @@
+"""
+Load test of the bot's /api/messages endpoint against mock upstreams
+
+Starts the mock Entra token endpoint, Bot Connector, Ollama and Azure
+OpenAI (mock_servers.py), starts the bot host under test pointed at them
+(function_app.py through function_host.py, or app_simple.py under Flask or gunicorn)
+and drives /api/messages with realistic Teams message Activities, either
+open-loop at a fixed --rps or closed-loop with --concurrency clients.
+
+Reports latency percentiles (open-loop latencies are measured from the
+scheduled send time, so a stalled host is not hidden by a slowed-down
+client), throughput, replies delivered to the Connector and the host's
+memory. The bot's outbound rate limit is lifted (the mock Connector does
+not throttle); pass --env OUTBOUND_GLOBAL_RATE=40 to keep it. So are the
+per-user and per-tenant admission quotas, since all load test users share
+one tenant; the admission concurrency limit stays in force.
+--json writes the results (with the git commit) for CI; with
+--baseline the run is compared with an earlier result file and the exit
+status is 1 if p99 latency, throughput or peak memory regressed by more
+than --max-regression.
+
+Usage:
+  python benchmarks/load_test.py --host functions --rps 50 --duration 20
+  python benchmarks/load_test.py --host flask --concurrency 16 --requests 2000 --json flask.json
+  python benchmarks/load_test.py --host functions --json new.json --baseline main.json
+  python benchmarks/load_test.py --host gunicorn --env GUNICORN_WORKERS=4 --rps 100 --duration 20
+
+With --host gunicorn the memory figures are the gunicorn master's and the
+admission counters come from whichever worker answers the health check.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+
+from mock_servers import start_mock_server
+
+TENANT_ID = "5363c28c-cdab-42ce-86c6-1b35f030504b"
+APP_ID = "00000000-0000-0000-0000-000000000b07"
+
+PROMPTS = [
+    "Szia!",
+    "Mikor lesz a következő sprint review?",
+    "Összefoglalnád röviden, mi a különbség a Scrum és a Kanban között?",
+    "Írj egy rövid emailt a csapatnak arról, hogy pénteken korábban zárunk, és kérd meg őket, hogy a nyitott "
+    "pull requesteket csütörtök estig nézzék át.",
+    "What is the status of the deployment pipeline?",
+    "Segíts megfogalmazni egy ügyfélnek szóló választ: a hibát reprodukáltuk, a javítás a jövő heti kiadásban "
+    "lesz benne, addig a megkerülő megoldás a cache ürítése. Legyen udvarias, de tömör.",
+]
+
+# Compared with --baseline: (path in the results, True if higher is worse)
+COMPARED = [
+    (("latency_ms", "p50"), True),
+    (("latency_ms", "p99"), True),
+    (("throughput_rps",), False),
+    (("host_memory_mb", "peak"), True),
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ActivityFactory:
+    """Teams message Activities spread over `conversations` one-on-one chats"""
+
+    def __init__(self, service_url, conversations=200, seed=1):
+        self.service_url = service_url
+        self.conversations = conversations
+        self.rng = random.Random(seed)
+        self.ids = itertools.count(1)
+
+    def __call__(self):
+        n = self.rng.randrange(self.conversations)
+        user_id = f"29:1load-test-user-{n}"
+        return {
+            "type": "message",
+            "id": f"{int(time.time() * 1000)}{next(self.ids):06d}",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "localTimestamp": datetime.now().astimezone().isoformat(),
+            "serviceUrl": self.service_url,
+            "channelId": "msteams",
+            "from": {"id": user_id, "name": f"Load Test User {n}", "aadObjectId": str(uuid.UUID(int=n))},
+            "conversation": {"conversationType": "personal", "tenantId": TENANT_ID, "id": f"a:1load-test-conversation-{n}"},
+            "recipient": {"id": f"28:{APP_ID}", "name": "Fresh Bot"},
+            "textFormat": "plain",
+            "locale": "hu-HU",
+            "text": self.rng.choice(PROMPTS),
+            "entities": [{"locale": "hu-HU", "country": "HU", "platform": "Web", "timezone": "Europe/Budapest", "type": "clientInfo"}],
+            "channelData": {
+                "tenant": {"id": TENANT_ID},
+                "teamsUser": {"userPrincipalName": f"load.test.{n}@grepton.hu", "tenantId": TENANT_ID}
+            }
+        }
+
+
+class HostProcess:
+    """The bot host under test, started as a subprocess configured for the mock upstreams"""
+
+    def __init__(self, kind, port, env):
+        self.kind = kind
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.log_path = os.path.join(tempfile.mkdtemp(prefix="load_test_"), f"{kind}.log")
+        env = dict(os.environ, **env, PORT=str(port))
+        if kind in ("flask", "gunicorn"):
+            # app_simple.py (re)loads its settings file over the environment
+            settings = os.path.join(os.path.dirname(self.log_path), "local.settings.json")
+            with open(settings, "w") as f:
+                json.dump({"IsEncrypted": False, "Values": env_values(env)}, f)
+            env["SETTINGS_FILE"] = settings
+            command = [sys.executable, os.path.join(ROOT, "app_simple.py")]
+            if kind == "gunicorn":  # GUNICORN_WORKERS / GUNICORN_THREADS via --env
+                command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app_simple:app"]
+        else:
+            command = [sys.executable, os.path.join(ROOT, "benchmarks", "function_host.py"), "--port", str(port)]
+        self.log = open(self.log_path, "w")
+        self.process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        self.peak_rss = 0.0
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if httpx.get(f"{self.url}/api/health", timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        with open(self.log_path) as f:
+            sys.stderr.write(f.read()[-4000:])
+        raise SystemExit(f"{self.kind} host did not become ready (log: {self.log_path})")
+
+    def memory_mb(self):
+        """Current and peak resident memory of the host process (Linux /proc), in MB"""
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+        except OSError:
+            return None, None
+        rss = int(fields["VmRSS"].split()[0]) / 1024
+        hwm = int(fields["VmHWM"].split()[0]) / 1024
+        return rss, hwm
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def env_values(env):
+    keys = ("MicrosoftAppId", "MicrosoftAppPassword", "MicrosoftAppTenantId", "BOT_TOKEN_ENDPOINT", "BOT_AUTH_ENABLED",
+            "LLM_PROVIDER", "LLAMA3_API_URL", "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "MESSAGE_PROCESSING_MODE",
+            "LLM_STREAMING", "LOG_LEVEL", "OUTBOUND_GLOBAL_RATE", "OUTBOUND_GLOBAL_BURST",
+            "ADMISSION_USER_RATE_PER_MINUTE", "ADMISSION_USER_BURST", "ADMISSION_TENANT_RATE_PER_MINUTE",
+            "ADMISSION_TENANT_BURST")
+    return {key: env[key] for key in keys if key in env}
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else None
+
+
+def connector_calls(mock):
+    return sum(count for path, count in mock.hits.items() if "/v3/conversations/" in path)
+
+
+async def drive(url, factory, args):
+    """Send the load; returns (latencies in seconds, status counts, elapsed seconds)"""
+    latencies, statuses = [], {}
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100), max_keepalive_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=args.timeout) as client:
+        async def send(scheduled):
+            try:
+                response = await client.post("/api/messages", json=factory())
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - scheduled)
+            statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        deadline = start + args.duration if args.duration else None
+        if args.rps:
+            total = args.requests or int(args.rps * (args.duration or 10))
+            pending = set()
+            for i in range(total):
+                scheduled = start + i / args.rps
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+                task = asyncio.ensure_future(send(scheduled))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        else:
+            counter = itertools.count()
+
+            async def worker():
+                while next(counter) < (args.requests or sys.maxsize):
+                    if deadline and time.perf_counter() >= deadline:
+                        return
+                    await send(time.perf_counter())
+
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        return latencies, statuses, time.perf_counter() - start
+
+
+async def fetch_admission(url):
+    """The host's admission counters from its health endpoint (rejected messages still get a reply)"""
+    try:
+        async with httpx.AsyncClient(base_url=url, timeout=5) as client:
+            return (await client.get("/api/health")).json().get("admission")
+    except (httpx.HTTPError, ValueError):
+        return None
+
+
+async def sample_memory(host, stop):
+    while not stop.is_set():
+        rss, _ = host.memory_mb() if host else (None, None)
+        if rss:
+            host.peak_rss = max(host.peak_rss, rss)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args, url, host, mock):
+    factory = ActivityFactory(f"{mock.url}/", args.conversations)
+    if args.warmup:
+        warmup = argparse.Namespace(**dict(vars(args), rps=0, requests=args.warmup, duration=0, concurrency=min(args.concurrency, 4)))
+        await drive(url, factory, warmup)
+    calls_before = connector_calls(mock)
+    tokens_before = mock.engine.generated if mock.engine else 0
+    rss_start = host.memory_mb()[0] if host else None
+
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(sample_memory(host, stop))
+    started = time.monotonic()
+    latencies, statuses, elapsed = await drive(url, factory, args)
+
+    # Queued (202) requests are answered later; wait for their replies to reach the Connector
+    accepted = sum(count for status, count in statuses.items() if status in ("200", "202"))
+    drain_deadline = time.monotonic() + args.drain_timeout
+    while connector_calls(mock) - calls_before < accepted and time.monotonic() < drain_deadline:
+        await asyncio.sleep(0.1)
+    finished = time.monotonic()
+    stop.set()
+    await sampler
+
+    admission = await fetch_admission(url)
+    tokens = mock.engine.generated - tokens_before if mock.engine else None
+    ordered = sorted(latencies)
+    rss_end, hwm = host.memory_mb() if host else (None, None)
+    errors = sum(count for status, count in statuses.items() if status not in ("200", "202"))
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 2)
+    return {
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "host": args.host if not args.target else args.target,
+            "provider": args.provider,
+            "streaming": args.streaming,
+            "mode": args.mode,
+            "rps": args.rps,
+            "concurrency": None if args.rps else args.concurrency,
+            "upstream_latency_ms": args.upstream_latency * 1000,
+            "chunk_latency_ms": args.chunk_latency * 1000,
+            "ollama_parallel": args.ollama_parallel,
+            "env": args.env
+        },
+        "requests": len(latencies),
+        "errors": errors,
+        "status_counts": statuses,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "mean": ms(sum(ordered) / len(ordered)) if ordered else None,
+            "p50": ms(percentile(ordered, 50)),
+            "p90": ms(percentile(ordered, 90)),
+            "p99": ms(percentile(ordered, 99)),
+            "max": ms(ordered[-1]) if ordered else None
+        },
+        "connector_calls": connector_calls(mock) - calls_before,
+        "llm_tokens_per_s": round(tokens / (finished - started), 1) if tokens is not None else None,
+        "admission": admission,
+        "host_memory_mb": {
+            "start": round(rss_start, 1) if rss_start else None,
+            "end": round(rss_end, 1) if rss_end else None,
+            "peak": round(max(host.peak_rss, hwm or 0), 1) if host else None
+        }
+    }
+
+
+def lookup(result, path):
+    for key in path:
+        result = (result or {}).get(key)
+    return result
+
+
+def compare(result, baseline, max_regression):
+    """Print the change of the compared metrics; returns the names of those that regressed"""
+    regressed = []
+    print(f"\nvs baseline {baseline.get('commit')} ({baseline.get('time')}):")
+    for path, higher_is_worse in COMPARED:
+        old, new = lookup(baseline, path), lookup(result, path)
+        name = ".".join(path)
+        if not old or new is None:
+            print(f"  {name:<22} {'n/a':>10}")
+            continue
+        change = (new - old) / old
+        worse = change > max_regression if higher_is_worse else change < -max_regression
+        if worse:
+            regressed.append(name)
+        print(f"  {name:<22} {old:>10} -> {new:<10} {change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def print_result(result):
+    latency = result["latency_ms"]
+    memory = result["host_memory_mb"]
+    print(f"{result['config']['host']} {result['config']['provider']}"
+          f"{' streaming' if result['config']['streaming'] else ''} mode={result['config']['mode']}")
+    print(f"  requests={result['requests']} errors={result['errors']} statuses={result['status_counts']}")
+    print(f"  throughput={result['throughput_rps']} req/s  connector calls={result['connector_calls']}"
+          + (f"  llm tokens/s={result['llm_tokens_per_s']}" if result.get("llm_tokens_per_s") is not None else ""))
+    admission = result.get("admission")
+    if admission:
+        rejected = {reason: admission[reason] for reason in ("user_quota", "tenant_quota", "overloaded", "timeout")}
+        print(f"  admission admitted={admission['admitted']} queued={admission['queued']} rejected={rejected} "
+              f"limit={admission['limit']}")
+    print(f"  latency p50={latency['p50']}ms p90={latency['p90']}ms p99={latency['p99']}ms max={latency['max']}ms")
+    print(f"  host memory start={memory['start']}MB end={memory['end']}MB peak={memory['peak']}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", choices=["functions", "flask", "gunicorn"], default="functions", help="bot host to start")
+    parser.add_argument("--target", help="URL of an already running host instead (configure it to use the mocks)")
+    parser.add_argument("--mock-port", type=int, default=0, help="fixed port for the mock upstreams (with --target)")
+    parser.add_argument("--provider", choices=["llama3", "azure"], default="llama3")
+    parser.add_argument("--streaming", action="store_true", help="LLM_STREAMING=true")
+    parser.add_argument("--mode", choices=["sync", "queue"], default="sync", help="MESSAGE_PROCESSING_MODE")
+    parser.add_argument("--rps", type=float, default=0, help="open-loop request rate (default: closed loop)")
+    parser.add_argument("--concurrency", type=int, default=8, help="closed-loop clients")
+    parser.add_argument("--requests", type=int, default=0, help="number of requests")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run (default 10 if --requests is not set)")
+    parser.add_argument("--warmup", type=int, default=20, help="requests sent before measuring")
+    parser.add_argument("--conversations", type=int, default=200)
+    parser.add_argument("--upstream-latency", type=float, default=0.02, help="seconds every mock call waits")
+    parser.add_argument("--chunk-latency", type=float, default=0.01, help="seconds per generated word")
+    parser.add_argument("--ollama-parallel", type=int, default=0,
+                        help="simulate a GPU Ollama host running this many sequences at once (0: unlimited)")
+    parser.add_argument("--prefill-latency", type=float, default=0.05, help="seconds per prompt evaluation step (GPU mode)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for queued replies")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra host setting")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+    if not args.requests and not args.duration:
+        args.duration = 10
+
+    mock = start_mock_server(port=args.mock_port, latency=args.upstream_latency, chunk_latency=args.chunk_latency,
+                             ollama_parallel=args.ollama_parallel, prefill_latency=args.prefill_latency)
+    env = {
+        "MicrosoftAppId": APP_ID,
+        "MicrosoftAppPassword": "load-test-secret",
+        "MicrosoftAppTenantId": TENANT_ID,
+        "BOT_TOKEN_ENDPOINT": mock.url + "/{tenant_id}/oauth2/v2.0/token",
+        # The load generator posts as the channel but holds none of its signing keys
+        "BOT_AUTH_ENABLED": "false",
+        "LLM_PROVIDER": args.provider,
+        "LLAMA3_API_URL": mock.url,
+        "AZURE_OPENAI_ENDPOINT": mock.url,
+        "AZURE_OPENAI_API_KEY": "load-test-key",
+        "MESSAGE_PROCESSING_MODE": args.mode,
+        "LLM_STREAMING": str(args.streaming).lower(),
+        "LOG_LEVEL": "WARNING",
+        # The mock Connector does not throttle; keep the bot's Teams limit (40/s) from capping throughput
+        "OUTBOUND_GLOBAL_RATE": "100000",
+        "OUTBOUND_GLOBAL_BURST": "1000",
+        # One tenant sends everything; measure the hosts, not the quotas
+        "ADMISSION_USER_RATE_PER_MINUTE": "100000",
+        "ADMISSION_USER_BURST": "1000",
+        "ADMISSION_TENANT_RATE_PER_MINUTE": "1000000",
+        "ADMISSION_TENANT_BURST": "10000",
+        **dict(item.split("=", 1) for item in args.env)
+    }
+
+    host = None
+    if args.target:
+        url = args.target.rstrip("/")
+        print(f"Mock upstreams on {mock.url}; the host at {url} must use them:")
+        for key, value in env.items():
+            print(f"  {key}={value}")
+    else:
+        host = HostProcess(args.host, free_port(), env)
+        host.wait_ready()
+        url = host.url
+
+    try:
+        result = asyncio.run(run(args, url, host, mock))
+    finally:
+        if host:
+            host.stop()
+        mock.shutdown()
+
+    print_result(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = compare(result, json.load(f), args.max_regression)
+        if regressed:
+            raise SystemExit(f"Regression in {', '.join(regressed)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Local stand-ins for the bot's upstreams, for benchmarks
+
+One threaded HTTP/1.1 server answers all of:
+  POST .../oauth2/v2.0/token                      (Entra token endpoint)
+  POST /v3/conversations/{id}/activities          (Bot Connector)
+  PUT  /v3/conversations/{id}/activities/{id}     (Bot Connector update)
+  POST /api/chat                                  (Ollama)
+  POST /openai/deployments/{name}/chat/completions (Azure OpenAI)
+  POST /api/embed, /openai/deployments/{name}/embeddings (bag-of-words vectors)
+Each request sleeps `latency` seconds before answering. Chat replies are
+generated word by word with `chunk_latency` seconds per word; requests with
+"stream": true receive the words as they come (Ollama NDJSON / OpenAI SSE).
+To imitate an unhealthy LLM host, a `slow_ratio` share of chat requests
+waits an extra `slow_latency` seconds and an `error_ratio` share fails
+with 500. With `connector_limit` set, Connector calls beyond that many
+per second are answered 429 with Retry-After, like Teams throttling.
+
+With `ollama_parallel` set, Ollama chat requests run on a simulated GPU
+instead: at most that many generate at once, one token per sequence per
+decode step. A step gets 10% slower per extra sequence in the batch. Every
+step that admits new requests first stalls for `prefill_latency`, once for
+all of them, to evaluate their prompts. Excess requests queue, like in
+Ollama. Ollama replies report eval_count and eval_duration.
+"""
+
+import hashlib
+import itertools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockOllamaEngine:
+    """Continuous batching on a simulated GPU: `parallel` sequences, one token each per decode step"""
+
+    def __init__(self, parallel, step_latency, prefill_latency):
+        self.parallel = parallel
+        self.step_latency = step_latency
+        self.prefill_latency = prefill_latency
+        self.generated = 0
+        self.prefills = 0
+        self._waiting = deque()
+        self._condition = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, words):
+        """Queue a generation; returns a queue that receives its words, then None"""
+        tokens = queue.Queue()
+        with self._condition:
+            self._waiting.append([deque(words), tokens])
+            self._condition.notify()
+        return tokens
+
+    def _run(self):
+        active = []
+        while True:
+            with self._condition:
+                while not active and not self._waiting:
+                    self._condition.wait()
+                admitted = [self._waiting.popleft() for _ in range(min(self.parallel - len(active), len(self._waiting)))]
+            if admitted:
+                self.prefills += 1
+                time.sleep(self.prefill_latency)
+                active += admitted
+            time.sleep(self.step_latency * (1 + 0.1 * (len(active) - 1)))
+            for sequence in active:
+                words, tokens = sequence
+                tokens.put(words.popleft())
+                self.generated += 1
+                if not words:
+                    tokens.put(None)
+            active = [sequence for sequence in active if sequence[0]]
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; Nagle would stall keep-alive clients ~40ms
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_throttled(self):
+        payload = b'{"error": {"code": "Throttled"}}'
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Retry-After", "1")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_chunked(self, content_type, chunks, delay):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i and delay:
+                time.sleep(delay)
+            data = chunk.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _words(self):
+        words = self.server.reply.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _simulate_generation(self):
+        # A buffered reply takes as long as streaming every chunk would
+        time.sleep(self.server.chunk_latency * (len(self._words()) - 1))
+
+    def _ollama_done(self, started):
+        return {
+            "model": "llama3",
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "eval_count": len(self._words()),
+            "eval_duration": int((time.perf_counter() - started) * 1e9)
+        }
+
+    def _generate_on_engine(self):
+        """Words of the reply as the simulated GPU produces them"""
+        tokens = self.server.engine.submit(self._words())
+        while (word := tokens.get()) is not None:
+            yield word
+
+    def _chat_ollama(self):
+        started = time.perf_counter()
+        if self.server.engine:
+            content = "".join(self._generate_on_engine())
+        else:
+            self._simulate_generation()
+            content = self.server.reply
+        done = self._ollama_done(started)
+        done["message"]["content"] = content
+        self._send_json(200, done)
+
+    def _stream_ollama(self):
+        started = time.perf_counter()
+        engine = self.server.engine
+
+        def lines():
+            for word in self._generate_on_engine() if engine else self._words():
+                yield json.dumps({"model": "llama3", "message": {"role": "assistant", "content": word}, "done": False}) + "\n"
+            yield json.dumps(self._ollama_done(started)) + "\n"
+
+        # The engine paces its own tokens
+        self._send_chunked("application/x-ndjson", lines(), 0 if engine else self.server.chunk_latency)
+
+    def _stream_openai(self):
+        def event(delta, finish_reason=None):
+            data = {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": "gpt-4o-mini",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+            return f"data: {json.dumps(data)}\n\n"
+
+        events = [event({"role": "assistant", "content": word}) for word in self._words()]
+        events.append(event({}, "stop"))
+        events.append("data: [DONE]\n\n")
+        self._send_chunked("text/event-stream", events, self.server.chunk_latency)
+
+    @staticmethod
+    def _embedding(text, dim=64):
+        vector = [0.0] * dim
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % dim] += 1.0
+        return vector
+
+    def _embeddings(self, texts):
+        """One embedding per input; the input is a string or a list of them"""
+        return [self._embedding(text) for text in ([texts] if isinstance(texts, str) else texts)]
+
+    def do_POST(self):
+        body = self._read_body()
+        try:
+            request = json.loads(body) if body.startswith(b"{") else {}
+        except ValueError:
+            request = {}
+        stream = bool(request.get("stream"))
+        time.sleep(self.server.latency)
+        self.server.count(self.path)
+        if self.path == "/api/chat" or "/chat/completions" in self.path:
+            if self.server.rng.random() < self.server.error_ratio:
+                self._send_json(500, {"error": "mock failure"})
+                return
+            if self.server.rng.random() < self.server.slow_ratio:
+                time.sleep(self.server.slow_latency)
+        if self.path.endswith("/oauth2/v2.0/token"):
+            self._send_json(200, {"token_type": "Bearer", "expires_in": 3600, "access_token": "mock-token"})
+        elif "/v3/conversations/" in self.path:
+            if self.server.throttled():
+                self._send_throttled()
+                return
+            self._send_json(200, {"id": f"mock-activity-{next(self.server.ids)}"})
+        elif self.path == "/api/embed":
+            self._send_json(200, {"model": request.get("model"), "embeddings": self._embeddings(request.get("input", ""))})
+        elif "/embeddings" in self.path:
+            self._send_json(200, {
+                "object": "list",
+                "model": "text-embedding-3-small",
+                "data": [{"object": "embedding", "index": index, "embedding": embedding}
+                         for index, embedding in enumerate(self._embeddings(request.get("input", "")))],
+                "usage": {"prompt_tokens": 1, "total_tokens": 1}
+            })
+        elif self.path == "/api/chat" and stream:
+            self._stream_ollama()
+        elif "/chat/completions" in self.path and stream:
+            self._stream_openai()
+        elif self.path == "/api/chat":
+            self._chat_ollama()
+        elif "/chat/completions" in self.path:
+            self._simulate_generation()
+            self._send_json(200, {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-4o-mini",
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": self.server.reply}
+                }],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20}
+            })
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_PUT(self):
+        self._read_body()
+        time.sleep(self.server.latency)
+        self.server.count(self.path)
+        if self.server.throttled():
+            self._send_throttled()
+            return
+        self._send_json(200, {"id": self.path.rsplit("/", 1)[-1]})
+
+
+class MockUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, latency=0.05, chunk_latency=0.02, reply="Szia! Ez egy teszt válasz.",
+                 slow_ratio=0.0, slow_latency=1.0, error_ratio=0.0, connector_limit=0, ollama_parallel=0,
+                 prefill_latency=0.0, seed=None):
+        super().__init__(("127.0.0.1", port), MockUpstreamHandler)
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.reply = reply
+        self.slow_ratio = slow_ratio
+        self.slow_latency = slow_latency
+        self.error_ratio = error_ratio
+        self.rng = random.Random(seed)
+        self.connector_limit = connector_limit
+        self.engine = MockOllamaEngine(ollama_parallel, chunk_latency, prefill_latency) if ollama_parallel else None
+        self._connector_calls = deque()
+        self.ids = itertools.count(1)
+        self.hits = {}
+        self._hits_lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (cancelled hedges, closed streams) are expected
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def throttled(self):
+        """Whether a Connector call is over `connector_limit` calls in the last second"""
+        if not self.connector_limit:
+            return False
+        now = time.monotonic()
+        with self._hits_lock:
+            while self._connector_calls and now - self._connector_calls[0] >= 1.0:
+                self._connector_calls.popleft()
+            if len(self._connector_calls) >= self.connector_limit:
+                self.hits["throttled"] = self.hits.get("throttled", 0) + 1
+                return True
+            self._connector_calls.append(now)
+            return False
+
+    def count(self, path):
+        with self._hits_lock:
+            self.hits[path] = self.hits.get(path, 0) + 1
+
+
+def start_mock_server(port=0, latency=0.05, **kwargs):
+    """Start a MockUpstreamServer on a background thread and return it"""
+    server = MockUpstreamServer(port=port, latency=latency, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,3 @@
+"""
+Shared building blocks for the Teams bot hosts (function_app.py, app_simple.py)
+"""
@@ -0,0 +1,177 @@
+"""
+Compact Bot Framework Activities: only the fields the bot reads
+
+A Teams Activity is a deep JSON document (entities, channelData, locale,
+timestamps...) of which the engine uses a dozen values. parse_activity()
+decodes the request body once (orjson when installed, json otherwise)
+and pulls those values into an Activity with __slots__, so the handlers
+read plain attributes instead of chaining .get() lookups through nested
+dicts, and the decoded document is dropped right away.
+
+Attachments are kept as Attachment objects minus the text/html copy of the
+message text Teams adds. to_dict() gives the Bot Framework shape of the
+same fields back (for the work queue, which stores JSON);
+Activity.from_dict() reads a full or a compact dict alike. A field of the
+wrong JSON type (a string where an object belongs, say) is a ValueError,
+like a body that is not JSON at all.
+"""
+
+import json
+import logging
+import operator
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Teams repeats the message text (with mentions) as a text/html attachment
+_MESSAGE_COPY_TYPES = {"text/html"}
+
+
+_text_fields = operator.attrgetter("type", "id", "text", "service_url", "channel_id", "conversation_id",
+                                   "conversation_type", "from_id", "from_name", "aad_object_id", "recipient_id",
+                                   "tenant_id", "upn")
+
+
+class Attachment:
+    """A file, image or card sent with a message"""
+
+    __slots__ = ("content_type", "url", "name", "content")
+
+    def __init__(self, content_type="", url="", name="", content=None):
+        self.content_type = content_type
+        self.url = url
+        self.name = name
+        self.content = content
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("contentType") or "", data.get("contentUrl") or "", data.get("name") or "",
+                   data.get("content"))
+
+    def to_dict(self):
+        data = {"contentType": self.content_type, "contentUrl": self.url, "name": self.name}
+        if self.content is not None:
+            data["content"] = self.content
+        return data
+
+    def __repr__(self):
+        return f"Attachment(content_type={self.content_type!r}, name={self.name!r})"
+
+
+class Activity:
+    """The fields of an incoming Activity the engine uses"""
+
+    __slots__ = ("type", "id", "text", "service_url", "channel_id", "conversation_id", "conversation_type", "from_id",
+                 "from_name", "aad_object_id", "recipient_id", "tenant_id", "upn", "members_added", "attachments")
+
+    def __init__(self, type="", id="", text="", service_url="", channel_id="", conversation_id="", conversation_type="",
+                 from_id="", from_name="", aad_object_id="", recipient_id="", tenant_id="", upn="", members_added=(),
+                 attachments=()):
+        self.type = type
+        self.id = id
+        self.text = text
+        self.service_url = service_url
+        self.channel_id = channel_id
+        self.conversation_id = conversation_id
+        self.conversation_type = conversation_type
+        self.from_id = from_id
+        self.from_name = from_name
+        self.aad_object_id = aad_object_id
+        self.recipient_id = recipient_id
+        self.tenant_id = tenant_id
+        self.upn = upn
+        self.members_added = members_added
+        self.attachments = attachments
+
+    @classmethod
+    def from_dict(cls, data):
+        """The Activity of a Bot Framework dict; ValueError if a field has the wrong JSON type"""
+        try:
+            sender = data.get("from") or {}
+            conversation = data.get("conversation") or {}
+            channel_data = data.get("channelData") or {}
+            teams_user = channel_data.get("teamsUser") or {}
+            activity = cls(
+                type=data.get("type") or "",
+                id=data.get("id") or "",
+                text=data.get("text") or "",
+                service_url=data.get("serviceUrl") or "",
+                channel_id=data.get("channelId") or "",
+                conversation_id=conversation.get("id") or "",
+                conversation_type=conversation.get("conversationType") or "",
+                from_id=sender.get("id") or "",
+                from_name=sender.get("name") or "",
+                aad_object_id=sender.get("aadObjectId") or "",
+                recipient_id=(data.get("recipient") or {}).get("id") or "",
+                tenant_id=(
+                    (channel_data.get("tenant") or {}).get("id")
+                    or teams_user.get("tenantId")
+                    or conversation.get("tenantId")
+                    or ""
+                ),
+                upn=teams_user.get("userPrincipalName") or "",
+                members_added=tuple(member.get("id") or "" for member in data.get("membersAdded") or ()),
+                attachments=tuple(attachment for attachment in map(Attachment.from_dict, data.get("attachments") or ())
+                                  if attachment.content_type not in _MESSAGE_COPY_TYPES)
+            )
+            # Joining the text fields fails like .get() on a misplaced value: a TypeError if one is not a string
+            "".join(_text_fields(activity))
+        except (AttributeError, TypeError) as e:
+            # A value of the wrong JSON type, e.g. "from": "x" or "attachments": ["x"]
+            raise ValueError(f"malformed Activity: {e}") from None
+        return activity
+
+    def to_dict(self):
+        """The Activity's fields in the Bot Framework JSON shape"""
+        data = {
+            "type": self.type,
+            "id": self.id,
+            "text": self.text,
+            "serviceUrl": self.service_url,
+            "channelId": self.channel_id,
+            "from": {"id": self.from_id, "name": self.from_name, "aadObjectId": self.aad_object_id},
+            "conversation": {"id": self.conversation_id, "conversationType": self.conversation_type},
+            "recipient": {"id": self.recipient_id},
+            "channelData": {"tenant": {"id": self.tenant_id}, "teamsUser": {"userPrincipalName": self.upn}}
+        }
+        if self.members_added:
+            data["membersAdded"] = [{"id": member_id} for member_id in self.members_added]
+        if self.attachments:
+            data["attachments"] = [attachment.to_dict() for attachment in self.attachments]
+        return data
+
+    @property
+    def key(self):
+        """Dedup key, None if the Activity carries no id"""
+        return f"{self.conversation_id}|{self.id}" if self.id else None
+
+    @property
+    def domain(self):
+        """The domain of the sender's UPN, "" if there is none"""
+        return self.upn.split("@")[1] if "@" in self.upn else ""
+
+    @property
+    def user_id(self):
+        """The sender's identity for quotas, preferring the AAD object id"""
+        return self.aad_object_id or self.from_id
+
+    def __repr__(self):
+        return f"Activity(type={self.type!r}, id={self.id!r}, conversation_id={self.conversation_id!r})"
+
+
+def as_activity(value):
+    """An Activity from an Activity or its dict"""
+    return value if isinstance(value, Activity) else Activity.from_dict(value)
+
+
+def parse_activity(data):
+    """Decode a request body (bytes or str) into an Activity; ValueError if it is not an Activity's JSON object"""
+    body = _loads(data)
+    if not isinstance(body, dict):
+        raise ValueError(f"expected a JSON object, got {type(body).__name__}")
+    return Activity.from_dict(body)
@@ -0,0 +1,209 @@
+"""
+Admission control for LLM capacity: quotas, fair queuing and fast rejection
+
+Every message first has to pass two token buckets: one for its user and
+one for its tenant. It then needs one of `limit` concurrency slots for
+generating the reply. While all slots are busy, waiting messages are
+served by weighted fair queuing across tenants. Each tenant is one flow,
+and priority (internal) tenants weigh `priority_weight` times as much. A
+single chatty tenant therefore only delays itself.
+
+With `adaptive` set, the slot count follows what the backend sustains.
+It grows by about one slot per `limit` fast replies. It shrinks by 10%
+while the smoothed reply time is above `latency_tolerance` times its
+baseline (its slowly rising minimum). It stays between `min_concurrency`
+and `max_concurrency`.
+
+A message is rejected with Rejected(reason) instead of waiting without
+bound in four cases:
+  user_quota     its user is over the user quota
+  tenant_quota   its tenant is over the tenant quota
+  overloaded     the queue is full, or the expected wait exceeds `max_wait`
+  timeout        it waited `max_wait` seconds without getting a slot
+The host answers a rejection with a short friendly reply.
+
+The controller lives on the bot's event loop (the threaded host drives
+the same loop from its request threads, see bot.ThreadedBot), so its
+state needs no lock.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from .outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """The message was not admitted; `reason` is one of user_quota, tenant_quota, overloaded, timeout"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("tenant_id", "granted", "cancelled", "signal")
+
+    def __init__(self, tenant_id, signal):
+        self.tenant_id = tenant_id
+        self.granted = False
+        self.cancelled = False
+        self.signal = signal
+
+
+class AdmissionController:
+    """Admission control for coroutines on one event loop"""
+
+    def __init__(self, max_concurrency=4, min_concurrency=1, adaptive=True, latency_tolerance=2.0,
+                 max_queue=50, max_wait=20.0, user_rate=20 / 60, user_burst=10, tenant_rate=600 / 60,
+                 tenant_burst=100, priority_tenants=(), priority_weight=4.0, max_tracked=10000,
+                 clock=time.monotonic):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.tenant_rate = tenant_rate
+        self.tenant_burst = tenant_burst
+        self.priority_tenants = frozenset(priority_tenants)
+        self.priority_weight = priority_weight
+        self.max_tracked = max_tracked
+        self.clock = clock
+        self.active = 0
+        self.service_time = None  # EWMA of seconds a slot is held
+        self.baseline = None  # slowly rising minimum of the service time
+        self._decreased_at = float("-inf")
+        self.stats = {"admitted": 0, "queued": 0, "user_quota": 0, "tenant_quota": 0, "overloaded": 0, "timeout": 0}
+        self._user_buckets = OrderedDict()
+        self._tenant_buckets = OrderedDict()
+        self._queue = []  # heap of (finish tag, sequence, waiter)
+        self._virtual_time = 0.0
+        self._last_finish = {}  # tenant -> finish tag of its last queued message
+        self._sequence = itertools.count()
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            # Forget idle users/tenants first; their buckets are full anyway
+            while len(buckets) >= self.max_tracked:
+                oldest, oldest_bucket = next(iter(buckets.items()))
+                if not oldest_bucket.idle():
+                    break
+                del buckets[oldest]
+            bucket = buckets[key] = TokenBucket(rate, burst, self.clock)
+        buckets.move_to_end(key)
+        return bucket
+
+    def _reject(self, reason):
+        self.stats[reason] += 1
+        raise Rejected(reason)
+
+    def _enter(self, user_id, tenant_id):
+        """Check the quotas and take a slot; returns None if admitted, else a queued _Waiter"""
+        user_bucket = self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst)
+        tenant_bucket = self._bucket(self._tenant_buckets, tenant_id, self.tenant_rate, self.tenant_burst)
+        # Check both before taking from either: a message the tenant quota rejects must not use up the user's
+        if not user_bucket.available():
+            self._reject("user_quota")
+        if not tenant_bucket.available():
+            self._reject("tenant_quota")
+        user_bucket.take()
+        tenant_bucket.take()
+        if self.active < int(self.limit) and not self._queue:
+            self.active += 1
+            self.stats["admitted"] += 1
+            return None
+        # Fail fast rather than queue a message that would wait longer than max_wait anyway
+        expected_wait = (len(self._queue) + 1) * (self.service_time or 0.0) / max(self.limit, 1.0)
+        if len(self._queue) >= self.max_queue or expected_wait > self.max_wait:
+            self._reject("overloaded")
+        weight = self.priority_weight if tenant_id in self.priority_tenants else 1.0
+        start = max(self._virtual_time, self._last_finish.get(tenant_id, 0.0))
+        finish = self._last_finish[tenant_id] = start + 1.0 / weight
+        waiter = _Waiter(tenant_id, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queue, (finish, next(self._sequence), waiter))
+        self.stats["queued"] += 1
+        return waiter
+
+    def _abandon(self, waiter):
+        """Give up waiting; True if the slot was granted meanwhile and must be released"""
+        if waiter.granted:
+            return True
+        waiter.cancelled = True
+        return False
+
+    def _leave(self, seconds):
+        """Free a slot, adapt the limit and wake the waiters that now get one"""
+        self.active -= 1
+        if seconds is not None:
+            self._observe(seconds)
+        while self._queue and self.active < int(self.limit):
+            finish, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            self._virtual_time = finish
+            waiter.granted = True
+            self.active += 1
+            self.stats["admitted"] += 1
+            if not waiter.signal.done():
+                waiter.signal.set_result(None)
+        if not self._queue:
+            self._last_finish.clear()
+        elif len(self._last_finish) > self.max_tracked:
+            self._last_finish = {t: f for t, f in self._last_finish.items() if f > self._virtual_time}
+
+    def _observe(self, seconds):
+        self.service_time = seconds if self.service_time is None else 0.8 * self.service_time + 0.2 * seconds
+        self.baseline = self.service_time if self.baseline is None else min(self.service_time, self.baseline * 1.01)
+        if not self.adaptive:
+            return
+        now = self.clock()
+        if self.service_time > self.latency_tolerance * self.baseline:
+            # At most one decrease per service time, so one slow phase doesn't collapse the limit
+            if now - self._decreased_at >= self.service_time:
+                self.limit = max(self.min_concurrency, self.limit * 0.9)
+                self._decreased_at = now
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    @asynccontextmanager
+    async def admit(self, user_id, tenant_id):
+        """Hold a slot for the body of the `async with`; raises Rejected if not admitted"""
+        waiter = self._enter(user_id, tenant_id)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.signal), self.max_wait)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if self._abandon(waiter):
+                    self._leave(None)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject("timeout")
+        start = self.clock()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self._leave(self.clock() - start if ok else None)
+
+    def snapshot(self):
+        """Counters plus the current limit, slots in use and queue length"""
+        return dict(
+            self.stats,
+            limit=round(self.limit, 2),
+            active=self.active,
+            waiting=sum(1 for _, _, waiter in self._queue if not waiter.cancelled),
+            service_ms=None if self.service_time is None else round(self.service_time * 1000, 1)
+        )
@@ -0,0 +1,357 @@
+"""
+The provider layer: the reply to a message, from retrieval to the saved turn
+
+Both hosts get their replies here. Per message: the indexed documents
+relevant to it (rag.py), the prompt with the conversation's history
+(conversation.py), then the reply from the response cache, from an
+identical call already in flight (coalescing.py) or from the LLM router
+(llm_router.py), and finally the turn saved to history and transcript.
+A failure becomes a short apology (providers.failure_reply), so the
+engine always has something to post; without any backend configured the
+reply echoes the message.
+
+The backends come from LLM_BACKENDS, or the single provider selected by
+LLM_PROVIDER: Ollama hosts, each behind its micro-batcher (batching.py),
+and Azure OpenAI deployments. Texts are embedded with Settings.embedding
+(EMBEDDING_BACKEND, else the first of those backends). Provider clients are kept in a
+ProviderRegistry and only rebuilt when their configuration changes.
+
+The calls go through httpx and AsyncAzureOpenAI. configure() rebuilds
+the backends from new settings, e.g. when the threaded host's
+SettingsWatcher sees the settings file change (hot-switching providers
+without a restart).
+
+`processes` is the number of processes sharing the host's LLM capacity;
+each micro-batcher lets through its share of OLLAMA_NUM_PARALLEL.
+"""
+
+import asyncio
+import logging
+import threading
+
+from bot_core.batching import MicroBatcher
+from bot_core.coalescing import SingleFlight, prompt_key
+from bot_core.conversation import ConversationMemory
+from bot_core.http_clients import get_client
+from bot_core.llm_router import Backend, LLMRouter
+from bot_core.metrics import Tracer
+from bot_core.provider_registry import ProviderRegistry
+from bot_core.providers import (FAILURE_REPLIES, azure_openai_chat, azure_openai_embed, azure_openai_stream,
+                                failure_reply, ollama_chat, ollama_embed, ollama_host, ollama_stream)
+from bot_core.rag import knowledge_message, load_document_index
+from bot_core.response_cache import ResponseCache
+from bot_core.settings import per_process
+from bot_core.structured_log import StructuredLogger
+
+logger = logging.getLogger(__name__)
+
+
+def azure_host(endpoint):
+    """The resource name of an Azure OpenAI endpoint"""
+    return endpoint.split("//")[-1].split(".")[0]
+
+
+def _async_azure_openai_client(endpoint, api_key, api_version):
+    # Importing openai (with pydantic) takes longer than loading everything else, so it stays out of the cold start
+    from openai import AsyncAzureOpenAI
+    return AsyncAzureOpenAI(azure_endpoint=endpoint, api_key=api_key, api_version=api_version,
+                            http_client=get_client("azure_openai"))
+
+
+class Assistant:
+    """The provider layer: reply(), stream() and chat() are coroutines"""
+
+    def __init__(self, settings, history, transcript=None, processes=1, tracer=None, log=None):
+        self.processes = processes
+        self.tracer = tracer or Tracer()
+        self.log = log or StructuredLogger(__name__)
+        self.clients = ProviderRegistry({"azure": _async_azure_openai_client})
+        self.batchers = {}  # Ollama base URL -> micro-batcher
+        self.settings = settings
+        self.backends = []
+        self.router = None
+        # tiktoken counts for OpenAI models, the cheaper approximation for Ollama-only setups
+        self.exact_tokens = False
+        self._document_index = None
+        self._document_index_loaded = False
+        self._index_lock = threading.Lock()
+
+        self.memory = ConversationMemory(
+            history,
+            transcript=transcript,
+            system_prompt=settings.system_prompt,
+            token_budget=settings.context_token_budget,
+            max_messages=settings.history_max_messages,
+            ttl=settings.history_ttl_seconds,
+            # Rolling summaries of turns that no longer fit in the context budget
+            summarize=self.chat if settings.context_summary_enabled else None,
+            max_summaries=settings.history_max_conversations,
+            tracer=self.tracer,
+            log=self.log
+        )
+        # Cache of LLM replies for repeated (FAQ-style) questions
+        self.cache = None
+        if settings.response_cache_enabled:
+            self.cache = ResponseCache(
+                max_entries=settings.response_cache_max_entries,
+                ttl=settings.response_cache_ttl_seconds,
+                scope=settings.response_cache_scope,
+                embed=self.embed if settings.response_cache_semantic else None,
+                similarity=settings.response_cache_similarity
+            )
+        # In-flight LLM calls shared by identical concurrent prompts
+        self.coalescer = SingleFlight() if settings.coalescing_enabled else None
+        self.configure(settings)
+
+    def configure(self, settings):
+        """(Re)build the LLM backends and their router from the settings"""
+        backends = self._backends(settings)
+        router = None
+        if backends:
+            router = LLMRouter(
+                backends,
+                hedging=settings.llm_hedging_enabled,
+                hedge_min_delay=settings.llm_hedge_min_ms / 1000,
+                failure_threshold=settings.llm_breaker_failures,
+                reset_timeout=settings.llm_breaker_reset_seconds,
+                observe=self.tracer.observe
+            )
+            logger.info(f"LLM backends: {', '.join(backend.name for backend in backends)}")
+        elif settings.llm_provider == "azure":
+            logger.warning("Azure OpenAI not configured")
+        self.settings, self.backends, self.router = settings, backends, router
+        self.exact_tokens = any(backend.kind == "azure" for backend in backends)
+
+    def _backends(self, settings):
+        """Router backends from LLM_BACKENDS, or from LLM_PROVIDER when it is empty"""
+        backends = []
+        for entry in filter(None, (part.strip() for part in settings.llm_backends.split(","))):
+            kind, _, target = entry.partition(":")
+            fields = target.split("|")
+            if kind == "ollama":
+                backends.append(self._ollama_backend(settings, fields[0], fields[1] if len(fields) > 1 else None))
+            elif kind == "azure":
+                api_key = settings.environ.get(fields[2], "") if len(fields) > 2 else None
+                backends.append(self._azure_backend(settings, fields[0], fields[1] if len(fields) > 1 else None, api_key))
+            else:
+                logger.warning(f"Ignoring unknown LLM backend: {entry}")
+
+        if not settings.llm_backends.strip():
+            if settings.llm_provider == "azure" and settings.azure_openai_configured:
+                backends.append(self._azure_backend(settings, settings.azure_openai_chat_deployment))
+            elif settings.llm_provider == "llama3":
+                backends.append(self._ollama_backend(settings, settings.llama3_api_url))
+        return backends
+
+    def _ollama_backend(self, settings, base_url, model=None):
+        """Router backend for an Ollama host"""
+        base_url = base_url.rstrip("/")
+        model = model or settings.llama3_model
+        batcher = self._batcher(settings, base_url)
+        return Backend(
+            f"ollama:{ollama_host(base_url)}",
+            model,
+            chat=lambda messages: ollama_chat(get_client("ollama"), base_url, model, messages,
+                                              batcher.slot() if batcher else None),
+            stream=lambda messages: ollama_stream(get_client("ollama"), base_url, model, messages,
+                                                  batcher.slot() if batcher else None),
+            kind="ollama",
+            warm_up=lambda: get_client("ollama").get(f"{base_url}/api/version", timeout=10),
+            saturated=batcher.saturated if batcher else None
+        )
+
+    def _azure_backend(self, settings, deployment, endpoint=None, api_key=None):
+        """Router backend for an Azure OpenAI deployment (default: the configured resource)"""
+        endpoint = endpoint or settings.azure_openai_endpoint
+        return Backend(
+            f"azure:{deployment}@{azure_host(endpoint)}",
+            deployment,
+            chat=lambda messages: azure_openai_chat(self._azure_client(settings, endpoint, api_key), deployment, messages),
+            stream=lambda messages: azure_openai_stream(self._azure_client(settings, endpoint, api_key), deployment,
+                                                        messages),
+            kind="azure",
+            warm_up=lambda: self._azure_warm_up(settings, endpoint, api_key)
+        )
+
+    async def _azure_warm_up(self, settings, endpoint, api_key):
+        """Load the client and open a connection to the resource (any HTTP status will do)"""
+        # Importing openai takes a second; don't hold up the requests already being served
+        await asyncio.to_thread(self._azure_client, settings, endpoint, api_key)
+        await get_client("azure_openai").get(endpoint, timeout=10)
+
+    async def embed(self, text):
+        """Embed a text with the embedding backend (semantic response cache, retrieval)"""
+        settings = self.settings
+        backend = settings.embedding
+        if backend.kind == "azure":
+            api_key = settings.environ.get(backend.api_key_env, "") if backend.api_key_env else None
+            return await azure_openai_embed(self._azure_client(settings, backend.url, api_key), backend.model, text)
+        return await ollama_embed(get_client("ollama"), backend.url, backend.model, text)
+
+    async def retrieve(self, user_message, exact=True):
+        """System message with the indexed documents relevant to the message (None: retrieval off or nothing relevant)"""
+        index = self.document_index()
+        if index is None:
+            return None
+        vector = None
+        if self._embeds_query(index):
+            try:
+                with self.tracer.span("embed"):
+                    vector = await self.embed(user_message)
+            except Exception as e:
+                self.log.warning("rag_embed_failed", error=str(e))
+        return self._search(index, user_message, vector, exact)
+
+    async def chat(self, messages):
+        """One chat call outside any conversation (summaries of history and attachments); None without a backend"""
+        router = self.router
+        return await router.chat(messages) if router is not None else None
+
+    async def _prompt(self, user_message, conversation_id):
+        # Retrieved documents and conversation history within the token budget
+        knowledge = await self.retrieve(user_message, self.exact_tokens)
+        return await self.memory.prompt(user_message, conversation_id, self.exact_tokens, knowledge)
+
+    async def _lookup(self, messages, model):
+        if self.cache is None:
+            return None, None
+        reply, ticket = await self.cache.lookup(messages, model)
+        return self._cache_hit(reply), ticket
+
+    async def _cached_chat(self, router, messages):
+        reply, ticket = await self._lookup(messages, router.model)
+        if reply is not None:
+            return reply
+        if self.coalescer is None:
+            reply = await router.chat(messages)
+        else:
+            reply = await self.coalescer.do(prompt_key(messages, router.model), lambda: router.chat(messages))
+        self._store(ticket, reply)
+        return reply
+
+    def _coalesced_stream(self, router, messages):
+        if self.coalescer is None:
+            return router.stream(messages)
+        return self.coalescer.stream(prompt_key(messages, router.model), lambda: router.stream(messages))
+
+    async def reply(self, user_message, conversation_id):
+        """The reply to a message in a conversation, saved to its history"""
+        router = self.router
+        if router is None:
+            return self._no_backend(user_message)
+        try:
+            self.log.debug("llm_request", conversation_id=conversation_id, text=user_message)
+            messages = await self._prompt(user_message, conversation_id)
+            reply = await self._cached_chat(router, messages)
+            if not reply:
+                return self._empty(conversation_id)
+            self.log.debug("llm_reply", conversation_id=conversation_id, reply=reply)
+            await self.memory.save_turn(conversation_id, user_message, reply, self.exact_tokens)
+            return reply
+        except Exception as e:
+            return failure_reply(e, self.log, conversation_id=conversation_id)
+
+    async def stream(self, user_message, conversation_id):
+        """The reply to a message chunk by chunk, saved to the history once complete"""
+        router = self.router
+        if router is None:
+            yield self._no_backend(user_message)
+            return
+        reply = ""
+        try:
+            self.log.debug("llm_request", conversation_id=conversation_id, text=user_message, stream=True)
+            messages = await self._prompt(user_message, conversation_id)
+            cached, ticket = await self._lookup(messages, router.model)
+            if cached is not None:
+                reply = cached
+                yield cached
+            else:
+                async for chunk in self._coalesced_stream(router, messages):
+                    reply += chunk
+                    yield chunk
+                self._store(ticket, reply)
+        except Exception as e:
+            yield failure_reply(e, self.log, conversation_id=conversation_id, stream=True)
+            return
+        if not reply:
+            yield self._empty(conversation_id)
+            return
+        self.log.debug("llm_reply", conversation_id=conversation_id, reply=reply, stream=True)
+        await self.memory.save_turn(conversation_id, user_message, reply, self.exact_tokens)
+
+    def warm_up_steps(self):
+        """Named coroutine functions that load the documents and open the backends' connections"""
+        steps = {}
+        if self.settings.rag_index_path:
+            steps["documents"] = lambda: asyncio.to_thread(self.document_index)
+        steps.update((backend.name, backend.warm_up) for backend in self.backends if backend.warm_up)
+        return steps
+
+    def _batcher(self, settings, base_url):
+        """The micro-batcher of an Ollama host (None with OLLAMA_BATCHING_ENABLED=false)"""
+        if not settings.ollama_batching_enabled:
+            return None
+        if base_url not in self.batchers:
+            self.batchers[base_url] = MicroBatcher(
+                parallelism=per_process(settings.ollama_num_parallel, self.processes),
+                window=settings.ollama_batch_window_ms / 1000,
+                max_batch=settings.ollama_batch_max_size or None
+            )
+        return self.batchers[base_url]
+
+    def _azure_client(self, settings, endpoint=None, api_key=None):
+        """The client of an Azure OpenAI resource (default: the configured one)"""
+        endpoint = endpoint or settings.azure_openai_endpoint
+        config = (endpoint, api_key or settings.azure_openai_api_key, settings.azure_openai_api_version)
+        return self.clients.get(f"azure:{endpoint}", config, kind="azure")
+
+    def document_index(self):
+        """The document index for retrieval, opened on first use (None: retrieval off or the index unusable)"""
+        if not self._document_index_loaded and self.settings.rag_index_path:
+            with self._index_lock:
+                if not self._document_index_loaded:
+                    self._document_index = load_document_index(self.settings.rag_index_path)
+                    self._document_index_loaded = True
+        return self._document_index
+
+    def _embeds_query(self, index):
+        # Only embeddings of the model the index was built with are comparable (the provider can switch at runtime)
+        settings = self.settings
+        return (settings.rag_retrieval != "bm25" and index.has_vectors
+                and index.meta.get("model") == settings.embedding_model)
+
+    def _search(self, index, user_message, vector, exact):
+        settings = self.settings
+        with self.tracer.span("retrieval"):
+            hits = index.search(user_message if settings.rag_retrieval != "vector" else None, vector,
+                                settings.rag_top_k, settings.rag_min_similarity)
+        self.log.debug("rag_hits", chunks=[f"{hit['source']}/{hit['title']}" for hit in hits])
+        return knowledge_message(hits, settings.rag_token_budget, exact)
+
+    def _no_backend(self, user_message):
+        self.log.warning("no_llm_backend", provider=self.settings.llm_provider)
+        return f"Echo: {user_message}"
+
+    def _empty(self, conversation_id):
+        self.log.warning("llm_empty_reply", conversation_id=conversation_id)
+        return FAILURE_REPLIES["empty"]
+
+    def _cache_hit(self, reply):
+        if reply is not None:
+            self.log.debug("response_cache_hit")
+        return reply
+
+    def _store(self, ticket, reply):
+        if self.cache is not None:
+            self.cache.store(ticket, reply)
+
+    def snapshot(self):
+        """Router, micro-batcher, cache and coalescing counters, e.g. for the health endpoint"""
+        return {
+            "llm_provider": self.settings.llm_provider,
+            "llm_backends": self.router.snapshot() if self.router else None,
+            "ollama_batching": {ollama_host(url): batcher.snapshot() for url, batcher in self.batchers.items()} or None,
+            "response_cache": self.cache.snapshot() if self.cache else None,
+            "coalescing": self.coalescer.snapshot() if self.coalescer else None,
+            "documents": self._document_index.snapshot() if self._document_index else None
+        }
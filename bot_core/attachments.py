@@ -0,0 +1,416 @@
+"""
+Files and cards sent with a message, read into text for the prompt
+
+Teams delivers a file sent in a chat as a download link (contentType
+application/vnd.microsoft.teams.file.download.info, a pre-authenticated
+downloadUrl), a pasted image or file as a contentUrl on the Connector
+service (needs the bot's token) and cards inline. Cards are read
+directly. Files are streamed in `download_chunk_bytes` blocks into a
+SpooledTemporaryFile (in memory up to `spool_bytes`, on disk beyond) and
+abandoned once they exceed `max_bytes`; at most `max_downloads` run at
+once. Text is then extracted incrementally: plain text line by line,
+DOCX paragraph by paragraph (streaming XML parse of word/document.xml),
+PDF page by page (needs the optional pypdf package). Images and other
+types are reported as unsupported.
+
+The text is cut into chunks of about `chunk_tokens` as it is extracted.
+A document that fits in one chunk of `inline_tokens` goes into the
+prompt as is; a longer one is summarized chunk by chunk through the
+host's LLM (`summarize(messages)`), `summary_concurrency` chunks in
+flight, and the summaries are folded into one if they are still too
+long. Only the chunks in flight and the summaries are held in memory, so
+it stays flat whatever the file size; after `max_chunks` the rest of the
+document is skipped.
+
+read(activity) returns one text block per attachment; with_documents()
+appends them to the user's message. Files are downloaded with the pooled
+httpx client and extracted in a worker thread, off the event loop.
+"""
+
+import asyncio
+import codecs
+import logging
+import os
+import tempfile
+import zipfile
+from urllib.parse import urlsplit
+
+from bot_core.context import APPROX_CHARS_PER_TOKEN, build_document_summary_prompt
+from bot_core.http_clients import get_client
+from bot_core.metrics import Tracer
+from bot_core.structured_log import StructuredLogger
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_TIMEOUT_SECONDS = 60
+FILE_DOWNLOAD_INFO = "application/vnd.microsoft.teams.file.download.info"
+CARD_PREFIX = "application/vnd.microsoft.card."
+
+# Asked when the user sends only attachments
+ATTACHMENT_PROMPT = "Foglald össze a csatolt fájl tartalmát."
+ATTACHMENT_LABEL = "Csatolt fájl:"
+CARD_NAME = "kártya"
+# What the model is told instead of the content of an attachment that could not be read
+ATTACHMENT_NOTES = {
+    "unsupported": "(ezt a fájltípust nem tudom beolvasni)",
+    "too_large": "(a fájl túl nagy, nem olvastam be)",
+    "empty": "(a fájlban nem találtam szöveget)",
+    "failed": "(a fájlt nem sikerült letölteni)"
+}
+
+_TEXT_EXTENSIONS = {"txt", "md", "csv", "tsv", "json", "xml", "log", "yaml", "yml", "ini", "py", "js", "html", "htm"}
+_KINDS_BY_CONTENT_TYPE = {
+    "application/pdf": "pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx",
+    "application/json": "text",
+    "application/xml": "text"
+}
+
+_WORD = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_READ_BLOCK_BYTES = 64 * 1024
+
+
+class AttachmentError(Exception):
+    """An attachment could not be read; `reason` is a key of ATTACHMENT_NOTES"""
+
+    def __init__(self, reason, detail=""):
+        super().__init__(detail or reason)
+        self.reason = reason
+
+
+class _Source:
+    __slots__ = ("kind", "url", "needs_token")
+
+    def __init__(self, kind, url="", needs_token=False):
+        self.kind = kind
+        self.url = url
+        self.needs_token = needs_token
+
+
+def _extension(name):
+    return os.path.splitext(name or "")[1].lstrip(".").lower()
+
+
+def _file_kind(content_type, extension):
+    kind = _KINDS_BY_CONTENT_TYPE.get(content_type)
+    if kind is None and content_type.startswith("text/"):
+        kind = "text"
+    if kind is None and extension in ("pdf", "docx"):
+        kind = extension
+    if kind is None and extension in _TEXT_EXTENSIONS:
+        kind = "text"
+    return kind
+
+
+def attachment_source(attachment, service_url):
+    """Where and how to read an attachment; AttachmentError("unsupported") for anything without text"""
+    content_type = attachment.content_type
+    if content_type.startswith(CARD_PREFIX):
+        return _Source("card")
+    if content_type == FILE_DOWNLOAD_INFO:
+        content = attachment.content or {}
+        kind = _file_kind("", (content.get("fileType") or _extension(attachment.name)).lower())
+        url = content.get("downloadUrl", "")
+    else:
+        kind = _file_kind(content_type, _extension(attachment.name))
+        url = attachment.url
+    if kind is None or not url:
+        raise AttachmentError("unsupported", content_type)
+    # The bot's token only goes to the Connector service the Activity came from
+    service, target = urlsplit(service_url), urlsplit(url)
+    needs_token = bool(service.netloc) and (target.scheme, target.netloc) == (service.scheme, service.netloc)
+    return _Source(kind, url, needs_token)
+
+
+def attachment_name(attachment):
+    if attachment.name:
+        return attachment.name
+    return CARD_NAME if attachment.content_type.startswith(CARD_PREFIX) else attachment.content_type
+
+
+def card_text(card):
+    """The visible text of a card's content: text blocks, titles and facts"""
+    if isinstance(card, list):
+        for item in card:
+            yield from card_text(item)
+        return
+    if not isinstance(card, dict):
+        return
+    for key in ("title", "subtitle", "text"):
+        if isinstance(card.get(key), str) and card[key].strip():
+            yield card[key]
+    for fact in card.get("facts") or ():
+        yield f"{fact.get('title', '')}: {fact.get('value', '')}"
+    for key, value in card.items():
+        if key != "facts" and isinstance(value, (dict, list)):
+            yield from card_text(value)
+
+
+def _text_lines(file):
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    pending = ""
+    while True:
+        block = file.read(_READ_BLOCK_BYTES)
+        pending += decoder.decode(block, final=not block)
+        *lines, pending = pending.split("\n")
+        yield from lines
+        # A file without line breaks is passed on block by block
+        if len(pending) > _READ_BLOCK_BYTES:
+            yield pending
+            pending = ""
+        if not block:
+            break
+    if pending:
+        yield pending
+
+
+def _docx_paragraphs(file):
+    # Imported on first use: only DOCX attachments need the XML parser
+    from xml.etree import ElementTree
+
+    try:
+        yield from _docx_body(file, ElementTree)
+    except ElementTree.ParseError as e:
+        raise AttachmentError("unsupported", f"not a readable docx file: {e}")
+
+
+def _docx_body(file, ElementTree):
+    with zipfile.ZipFile(file) as archive, archive.open("word/document.xml") as xml:
+        parts = []
+        depth = 0
+        body = None
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                depth += 1
+                if element.tag == f"{_WORD}body":
+                    body = element
+                continue
+            depth -= 1
+            if element.tag == f"{_WORD}t":
+                parts.append(element.text or "")
+            elif element.tag == f"{_WORD}tab":
+                parts.append("\t")
+            elif element.tag == f"{_WORD}p":
+                if parts:
+                    yield "".join(parts)
+                    parts = []
+            # Drop every finished top-level block (paragraph, table) so the tree never grows
+            if depth == 2 and body is not None:
+                body.clear()
+
+
+def _pdf_pages(file):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise AttachmentError("unsupported", "pypdf not installed")
+    for page in PdfReader(file).pages:
+        yield page.extract_text() or ""
+
+
+_EXTRACTORS = {"text": _text_lines, "docx": _docx_paragraphs, "pdf": _pdf_pages}
+
+
+def iter_text(file, kind):
+    """The text of a downloaded file piece by piece (lines, paragraphs or pages)"""
+    try:
+        yield from _EXTRACTORS[kind](file)
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise AttachmentError("unsupported", f"not a readable {kind} file: {e}")
+
+
+def iter_chunks(pieces, chunk_chars):
+    """Group text pieces into chunks of at most `chunk_chars` characters (longer pieces are split)"""
+    chunk, size = [], 0
+    for piece in pieces:
+        piece = piece.strip()
+        while piece:
+            if size + len(piece) > chunk_chars and chunk:
+                yield "\n".join(chunk)
+                chunk, size = [], 0
+            head, piece = piece[:chunk_chars], piece[chunk_chars:]
+            chunk.append(head)
+            size += len(head) + 1
+    if chunk:
+        yield "\n".join(chunk)
+
+
+def with_documents(text, documents):
+    """The user's message followed by the text of its attachments"""
+    if not documents:
+        return text
+    return "\n\n".join([text.strip() or ATTACHMENT_PROMPT, *documents])
+
+
+class AttachmentReader:
+    """Attachment reading; `summarize` is a coroutine function"""
+
+    def __init__(self, connector, summarize=None, max_bytes=25 * 1024 * 1024, max_downloads=4, max_attachments=5,
+                 chunk_tokens=2000, inline_tokens=1500, max_chunks=20, summary_concurrency=4, spool_bytes=1024 * 1024,
+                 download_chunk_bytes=64 * 1024, tracer=None, log=None):
+        self.connector = connector
+        self.summarize = summarize
+        self.max_bytes = max_bytes
+        self.max_downloads = max_downloads
+        self.max_attachments = max_attachments
+        self.chunk_chars = chunk_tokens * APPROX_CHARS_PER_TOKEN
+        self.inline_chars = inline_tokens * APPROX_CHARS_PER_TOKEN
+        self.max_chunks = max_chunks
+        self.summary_concurrency = summary_concurrency
+        self.spool_bytes = spool_bytes
+        self.download_chunk_bytes = download_chunk_bytes
+        self.tracer = tracer or Tracer()
+        self.log = log or StructuredLogger(__name__)
+        self.stats = {"attachments": 0, "documents": 0, "cards": 0, "unsupported": 0, "too_large": 0, "empty": 0,
+                      "failed": 0, "downloaded_bytes": 0, "chunks": 0, "summaries": 0, "truncated": 0}
+        self._downloads = None
+
+    async def read(self, activity):
+        """One text block per attachment of a message Activity"""
+        attachments = activity.attachments[:self.max_attachments]
+        self.stats["attachments"] += len(attachments)
+        with self.tracer.span("attachments"):
+            return list(await asyncio.gather(*(self._read(activity, attachment) for attachment in attachments)))
+
+    async def _read(self, activity, attachment):
+        name = attachment_name(attachment)
+        try:
+            source = attachment_source(attachment, activity.service_url)
+            if source.kind == "card":
+                self.stats["cards"] += 1
+                return self._document(name, await self._condense(name, iter_chunks(card_text(attachment.content),
+                                                                                     self.chunk_chars)))
+            file = await self._download(source)
+            try:
+                return self._document(name, await self._condense(name, iter_chunks(iter_text(file, source.kind),
+                                                                                     self.chunk_chars)))
+            finally:
+                file.close()
+        except Exception as e:
+            return self._unreadable(name, e)
+
+    async def _download(self, source):
+        """Stream a file into a spooled temporary file, at most `max_downloads` at once"""
+        token = await self.connector.token() if source.needs_token else None
+        if self._downloads is None:
+            self._downloads = asyncio.Semaphore(self.max_downloads)
+        async with self._downloads:
+            file = self._spool()
+            try:
+                with self.tracer.span("attachment_download"):
+                    size = 0
+                    async with get_client("attachments").stream("GET", source.url, headers=self._headers(source, token),
+                                                                 timeout=DOWNLOAD_TIMEOUT_SECONDS,
+                                                                 follow_redirects=True) as response:
+                        response.raise_for_status()
+                        self._check_length(response.headers.get("content-length"))
+                        async for block in response.aiter_bytes(self.download_chunk_bytes):
+                            size = self._write(file, block, size)
+            except BaseException:
+                file.close()
+                raise
+        return self._downloaded(file, size)
+
+    async def _condense(self, name, chunks):
+        """The document's text as is if it is short, otherwise the summaries of its chunks"""
+        chunks = self._limited_chunks(chunks, name)
+        # Extraction blocks (file reads, XML and PDF parsing), so chunks are pulled in a worker thread
+        next_chunk = lambda: asyncio.to_thread(next, chunks, None)
+        first = await next_chunk()
+        if first is None:
+            raise AttachmentError("empty")
+        peeked = [first]
+        if len(first) <= self.inline_chars:
+            second = await next_chunk()
+            if second is None:
+                return first
+            peeked.append(second)
+
+        summaries = {}
+        pending = set()
+        index = 0
+        while True:
+            chunk = peeked.pop(0) if peeked else await next_chunk()
+            if chunk is None:
+                break
+            index += 1
+            pending.add(asyncio.create_task(self._summarize_chunk(name, chunk, index, summaries)))
+            if len(pending) >= self.summary_concurrency:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        if pending:
+            await asyncio.wait(pending)
+        text = "\n".join(summaries[i] for i in sorted(summaries))
+        if len(text) > self.inline_chars and self.summarize is not None and len(summaries) > 1:
+            text = await self._fold(name, text)
+        return text
+
+    async def _summarize_chunk(self, name, chunk, index, summaries):
+        summary = None
+        if self.summarize is not None:
+            try:
+                with self.tracer.span("attachment_summary"):
+                    summary = await self.summarize(build_document_summary_prompt(name, chunk, index))
+                self.stats["summaries"] += 1
+            except Exception as e:
+                self._summary_failed(name, e)
+        summaries[index] = summary or self._fallback(chunk)
+
+    async def _fold(self, name, text):
+        try:
+            return await self.summarize(build_document_summary_prompt(name, text)) or text[:self.inline_chars]
+        except Exception as e:
+            self._summary_failed(name, e)
+            return text[:self.inline_chars]
+
+    def _spool(self):
+        return tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+
+    def _check_length(self, content_length):
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise AttachmentError("too_large", f"{content_length} bytes")
+
+    def _write(self, file, block, size):
+        size += len(block)
+        if size > self.max_bytes:
+            raise AttachmentError("too_large", f"more than {self.max_bytes} bytes")
+        file.write(block)
+        return size
+
+    def _downloaded(self, file, size):
+        self.stats["downloaded_bytes"] += size
+        file.seek(0)
+        return file
+
+    def _headers(self, source, token):
+        return {"Authorization": f"Bearer {token}"} if source.needs_token and token else {}
+
+    def _limited_chunks(self, chunks, name):
+        """The first `max_chunks` chunks; the rest of the document is not read"""
+        for index, chunk in enumerate(chunks):
+            if index == self.max_chunks:
+                self.stats["truncated"] += 1
+                self.log.info("attachment_truncated", name=name, chunks=self.max_chunks)
+                return
+            self.stats["chunks"] += 1
+            yield chunk
+
+    def _fallback(self, chunk):
+        """What stands for a chunk when it can't be summarized: its beginning"""
+        limit = max(200, self.inline_chars // max(1, self.max_chunks))
+        return chunk if len(chunk) <= limit else chunk[:limit] + "…"
+
+    def _summary_failed(self, name, error):
+        self.log.warning("attachment_summary_failed", name=name, error=str(error))
+
+    def _document(self, name, text):
+        self.stats["documents"] += 1
+        return f"{ATTACHMENT_LABEL} {name}\n{text}"
+
+    def _unreadable(self, name, error):
+        reason = error.reason if isinstance(error, AttachmentError) else "failed"
+        self.stats[reason] += 1
+        self.log.warning("attachment_unreadable", name=name, reason=reason, error=str(error))
+        return f"{ATTACHMENT_LABEL} {name}\n{ATTACHMENT_NOTES[reason]}"
+
+    def snapshot(self):
+        return dict(self.stats)
@@ -0,0 +1,212 @@
+"""
+Authentication of incoming requests: the Bot Framework channel's JWT
+
+Every request the Bot Connector service sends carries
+"Authorization: Bearer <JWT>" signed with one of the keys published at
+its OpenID metadata document. A token is accepted if its RS256 signature
+verifies against the published key with its "kid", its issuer is
+https://api.botframework.com, its audience is the bot's app id, it is
+within its lifetime (5 minutes clock skew), the key is endorsed for the
+Activity's channel and its "serviceurl" claim matches the Activity's.
+
+The key set is fetched once, kept for `refresh_interval` seconds and then
+fetched again; an unknown "kid" (a key rollover) triggers an early fetch,
+at most once per `min_refresh_interval`. If a fetch fails the previous
+keys stay in use. The channel reuses a token for many requests until it
+expires, so tokens that verified are kept (up to `cache_size`) and a
+repeated token costs a dict lookup and the per-Activity claim checks
+instead of the RSA signature check.
+
+The keys are fetched with the pooled httpx client.
+Needs PyJWT with its crypto extra (cryptography).
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from bot_core.http_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+OPENID_METADATA_URL = "https://login.botframework.com/v1/.well-known/openidconfiguration"
+BOT_FRAMEWORK_ISSUER = "https://api.botframework.com"
+CLOCK_SKEW_SECONDS = 300
+KEYS_TIMEOUT_SECONDS = 10
+
+
+class Unauthorized(Exception):
+    """The request's token was not accepted; `reason` says why"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _Verified:
+    __slots__ = ("expires_at", "kid", "service_url")
+
+    def __init__(self, expires_at, kid, service_url):
+        self.expires_at = expires_at
+        self.kid = kid
+        self.service_url = service_url
+
+
+def _bearer(authorization):
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise Unauthorized("missing_token")
+    return token.strip()
+
+
+class JwtValidator:
+    """Validator of the channel's JWTs; the keys are fetched with the pooled httpx client"""
+
+    def __init__(self, app_id, metadata_url=OPENID_METADATA_URL, issuer=BOT_FRAMEWORK_ISSUER, refresh_interval=86400,
+                 min_refresh_interval=60, cache_size=1024, clock=time.time):
+        self.app_id = app_id
+        self.metadata_url = metadata_url
+        self.issuer = issuer
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.cache_size = cache_size
+        self.clock = clock
+        self.stats = {"validated": 0, "cache_hits": 0, "rejected": 0, "key_fetches": 0, "key_fetch_failures": 0}
+        self._jwt = None
+        self._keys = {}  # kid -> (PyJWK, endorsed channel ids or None)
+        self._fetched_at = None
+        self._attempted_at = None
+        self._verified = OrderedDict()  # token -> _Verified
+        self._lock = None
+
+    async def validate(self, authorization, activity):
+        """Check the Authorization header of a request carrying `activity`; raises Unauthorized"""
+        try:
+            token = _bearer(authorization)
+            kid = self._kid(token)
+            if self._needs_fetch(kid, self.clock()):
+                await self.refresh(kid)
+            self._check(token, activity)
+        except Unauthorized as e:
+            raise self._rejected(e)
+
+    async def refresh(self, kid=None):
+        """Fetch the key set (single flight); keeps the old keys if that fails"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another request may have fetched them while this one waited
+            if not self._needs_fetch(kid, self.clock()):
+                return
+            self._attempted_at = self.clock()
+            self.stats["key_fetches"] += 1
+            try:
+                self.load_keys(await self._fetch())
+            except Exception as e:
+                self._fetch_failed(e)
+
+    async def _fetch(self):
+        client = get_client("openid")
+        response = await client.get(self.metadata_url, timeout=KEYS_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        response = await client.get(response.json()["jwks_uri"], timeout=KEYS_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json()
+
+    def _import_jwt(self):
+        # Imported on first use: PyJWT pulls in cryptography, which the host's cold start does not need
+        if self._jwt is None:
+            import jwt
+            self._jwt = jwt
+
+    def load_keys(self, jwks):
+        """Replace the key set with a JWKS document ({"keys": [...]})"""
+        self._import_jwt()
+        keys = {}
+        for key in jwks.get("keys", []):
+            if key.get("kty") != "RSA" or not key.get("kid"):
+                continue
+            endorsements = frozenset(key["endorsements"]) if key.get("endorsements") else None
+            keys[key["kid"]] = (self._jwt.PyJWK(key, algorithm="RS256"), endorsements)
+        if not keys:
+            raise ValueError("the key set contains no RSA signing keys")
+        self._keys = keys
+        self._fetched_at = self.clock()
+        self._verified.clear()
+        logger.info(f"Bot Framework signing keys loaded ({len(keys)} keys)")
+
+    def _needs_fetch(self, kid, now):
+        """Whether the keys should be fetched before checking a token signed with `kid`"""
+        if self._fetched_at is None:
+            return True
+        if kid is not None and kid in self._keys and now - self._fetched_at < self.refresh_interval:
+            return False
+        # Stale keys or an unknown kid: fetch again, but not on every request
+        return self._attempted_at is None or now - self._attempted_at >= self.min_refresh_interval
+
+    def _kid(self, token):
+        verified = self._verified.get(token)
+        if verified is not None:
+            return verified.kid
+        self._import_jwt()
+        try:
+            return self._jwt.get_unverified_header(token).get("kid")
+        except self._jwt.InvalidTokenError:
+            raise Unauthorized("malformed_token")
+
+    def _check(self, token, activity):
+        """Verify the token for an Activity with the loaded keys; raises Unauthorized"""
+        now = self.clock()
+        verified = self._verified.get(token)
+        if verified is not None and now < verified.expires_at:
+            self.stats["cache_hits"] += 1
+        else:
+            verified = self._verify(token, now)
+        key = self._keys.get(verified.kid)
+        if key is None:
+            raise Unauthorized("unknown_key")
+        endorsements = key[1]
+        if endorsements is not None and activity.channel_id not in endorsements:
+            raise Unauthorized("channel_not_endorsed")
+        if verified.service_url and verified.service_url != activity.service_url:
+            raise Unauthorized("service_url_mismatch")
+        self.stats["validated"] += 1
+
+    def _verify(self, token, now):
+        kid = self._kid(token)
+        key = self._keys.get(kid)
+        if key is None:
+            raise Unauthorized("unknown_key")
+        try:
+            claims = self._jwt.decode(token, key[0], algorithms=["RS256"], audience=self.app_id, issuer=self.issuer,
+                                      leeway=CLOCK_SKEW_SECONDS, options={"require": ["exp", "aud", "iss"]})
+        except self._jwt.ExpiredSignatureError:
+            raise Unauthorized("expired")
+        except self._jwt.InvalidAudienceError:
+            raise Unauthorized("wrong_audience")
+        except self._jwt.InvalidIssuerError:
+            raise Unauthorized("wrong_issuer")
+        except self._jwt.InvalidTokenError:
+            raise Unauthorized("invalid_signature")
+        verified = _Verified(claims["exp"] + CLOCK_SKEW_SECONDS, kid, claims.get("serviceurl", ""))
+        self._verified[token] = verified
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+        return verified
+
+    def _fetch_failed(self, error):
+        self.stats["key_fetch_failures"] += 1
+        if self._keys:
+            logger.warning(f"Bot Framework signing keys could not be refreshed, keeping the old ones: {error}")
+            return
+        raise error
+
+    def _rejected(self, error):
+        self.stats["rejected"] += 1
+        return error
+
+    def snapshot(self):
+        now = self.clock()
+        return dict(self.stats, keys=len(self._keys), cached_tokens=len(self._verified),
+                    keys_age=round(now - self._fetched_at) if self._fetched_at is not None else None)
@@ -0,0 +1,141 @@
+"""
+Micro-batching scheduler for Ollama requests
+
+An Ollama host runs OLLAMA_NUM_PARALLEL requests at a time in one batch
+on the GPU. Fewer in flight leaves it idle. More just queue inside Ollama,
+where nothing can prioritise, time out or even see them. The
+batcher keeps exactly `parallelism` requests in flight per host.
+
+Requests that arrive within `window` seconds of each other are released
+together, up to `max_batch` at a time, so their prompts are evaluated in
+the same step rather than each one stalling the generation of the others.
+When all slots are busy, the same window is used once more: after the first
+slot frees up, the batcher waits up to `window` for more to free up, then
+releases as many requests as there are free slots.
+Ollama has no batch chat endpoint. A released request is therefore still
+its own HTTP call, but the caller makes it, so the reply goes straight back
+to the conversation that asked:
+
+    async with batcher.slot():
+        reply = await post_to_ollama(messages)
+
+With window 0 a request is released as soon as a slot is free.
+
+stats: requests, batches and the time spent waiting; snapshot() adds the
+mean batch size, the mean wait, and the requests in flight and waiting.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Micro-batching for coroutines on one event loop"""
+
+    def __init__(self, parallelism=4, window=0.01, max_batch=None, clock=time.monotonic):
+        self.parallelism = max(1, parallelism)
+        self.window = max(0.0, window)
+        self.max_batch = max(1, max_batch or self.parallelism)
+        self.clock = clock
+        self.in_flight = 0
+        self.stats = {"requests": 0, "batches": 0, "wait_seconds": 0.0}
+        self._pending = deque()  # (future that releases the caller, enqueued at)
+        self._arrived = asyncio.Event()
+        self._freed = asyncio.Event()
+        self._dispatcher = None
+
+    def _batch_ready(self):
+        """Seconds until the oldest pending request's window closes (0: release now)"""
+        if len(self._pending) >= self.max_batch:
+            return 0.0
+        return max(0.0, self._pending[0][1] + self.window - self.clock())
+
+    def _granted(self, enqueued):
+        self.in_flight += 1
+        self.stats["requests"] += 1
+        self.stats["wait_seconds"] += self.clock() - enqueued
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait until this request is released in a batch and hold its slot for the body"""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        released = asyncio.get_running_loop().create_future()
+        self._pending.append((released, self.clock()))
+        self._arrived.set()
+        try:
+            await released
+        except asyncio.CancelledError:
+            if released.done() and not released.cancelled():
+                self._release()
+            raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.in_flight -= 1
+        self._freed.set()
+
+    async def _dispatch(self):
+        while True:
+            while not self._pending:
+                self._arrived.clear()
+                await self._arrived.wait()
+            # Collect arrivals until the batch is full or the oldest request's window closes
+            while (delay := self._batch_ready()) > 0:
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), delay)
+                except asyncio.TimeoutError:
+                    break
+            wanted = min(self.max_batch, len(self._pending))
+            while self.in_flight >= self.parallelism:
+                self._freed.clear()
+                await self._freed.wait()
+            # Let more slots free up so the batch goes out in one step
+            deadline = self.clock() + self.window
+            while self.parallelism - self.in_flight < wanted and (delay := deadline - self.clock()) > 0:
+                self._freed.clear()
+                try:
+                    await asyncio.wait_for(self._freed.wait(), delay)
+                except asyncio.TimeoutError:
+                    break
+            released = 0
+            while self._pending and released < wanted and self.in_flight < self.parallelism:
+                future, enqueued = self._pending.popleft()
+                if future.done():  # the caller gave up waiting
+                    continue
+                self._granted(enqueued)
+                future.set_result(None)
+                released += 1
+            if released:
+                self.stats["batches"] += 1
+
+    def saturated(self):
+        """Whether a new request would have to wait for a slot to free up"""
+        return self.in_flight + len(self._pending) >= self.parallelism
+
+    def close(self):
+        """Stop the dispatcher task (requests still waiting are never released)"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+    def snapshot(self):
+        """Counters plus mean batch size and wait, requests in flight and waiting"""
+        requests, batches = self.stats["requests"], self.stats["batches"]
+        return {
+            "requests": requests,
+            "batches": batches,
+            "mean_batch": round(requests / batches, 2) if batches else 0.0,
+            "mean_wait_ms": round(self.stats["wait_seconds"] / requests * 1000, 1) if requests else 0.0,
+            "parallelism": self.parallelism,
+            "in_flight": self.in_flight,
+            "waiting": len(self._pending)
+        }
@@ -0,0 +1,335 @@
+"""
+The whole bot, wired from Settings
+
+function_app.py serves a Bot on its event loop; app_simple.py serves a
+ThreadedBot, the same Bot run on an event loop thread of its own that the
+request threads hand their work to. The hosts only add their routes. The bot owns every component the engine drives: the
+Connector, the channel's JWT validator, conversation history and the
+transcript, the provider layer (assistant.py), admission control, the
+dedup index, the attachment reader, the notifier and the work queue. It
+registers their counters on the metrics registry (/api/metrics) and
+snapshot() reports them for the health endpoint.
+
+`processes` is the number of processes serving the bot on this host
+(gunicorn workers). With more than one, state every process must see
+(history, dedup index, work queue) can't live in process memory and moves
+to SQLite files on this host, and each process takes its share of the
+host-wide limits: LLM capacity (OLLAMA_NUM_PARALLEL,
+ADMISSION_MAX_CONCURRENCY) and outbound sends (OUTBOUND_GLOBAL_RATE,
+OUTBOUND_GLOBAL_BURST, BROADCAST_CONCURRENCY).
+"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from bot_core.admission import AdmissionController
+from bot_core.assistant import Assistant
+from bot_core.attachments import AttachmentReader
+from bot_core.auth import JwtValidator
+from bot_core.connector import Connector
+from bot_core.dedup import create_dedup_index
+from bot_core.engine import BotEngine
+from bot_core.history import create_history_store
+from bot_core.http_clients import close_clients
+from bot_core.metrics import REGISTRY, Tracer
+from bot_core.notify import Notifier
+from bot_core.providers import ollama_host
+from bot_core.settings import per_process, per_process_rate
+from bot_core.structured_log import LogPolicy, StructuredLogger, parse_level_map
+from bot_core.transcript import TranscriptLog
+from bot_core.work_queue import create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class Bot:
+    """The bot: every component, driven on one event loop (BotEngine)"""
+
+    def __init__(self, settings, processes=1, name=__name__):
+        self.settings = settings
+        self.processes = processes
+        # Structured hot-path logging (startup messages stay plain)
+        self.log = StructuredLogger(name, LogPolicy(
+            sample_rates=parse_level_map(settings.log_sample_rates),
+            rate_limits=parse_level_map(settings.log_rate_limits),
+            redact=settings.log_redact_pii
+        ))
+        # Stage timings for /api/metrics and the slow-request log
+        self.tracer = Tracer(slow_ms=settings.trace_slow_ms)
+        if settings.otel_enabled:
+            self.tracer.enable_opentelemetry(settings.otel_service_name)
+
+        # Conversation history (last HISTORY_MAX_MESSAGES messages per conversation)
+        self.history = create_history_store(
+            self._shared("HISTORY_BACKEND", settings.history_backend),
+            max_messages=settings.history_max_messages,
+            max_conversations=settings.history_max_conversations,
+            ttl=settings.history_ttl_seconds,
+            sqlite_path=settings.history_sqlite_path
+        )
+        self.transcript = TranscriptLog(
+            settings.transcript_path,
+            segment_bytes=settings.transcript_segment_mb * 1024 * 1024,
+            retention=settings.transcript_retention_days * 86400,
+            fsync=settings.transcript_fsync
+        ) if settings.transcript_path else None
+
+        # Index of recently handled Activities, to suppress redeliveries
+        self.dedup_index = None
+        if settings.dedup_enabled:
+            self.dedup_backend = self._shared("DEDUP_BACKEND", settings.dedup_backend)
+            self.dedup_index = create_dedup_index(self.dedup_backend, settings.dedup_ttl_seconds,
+                                                  settings.dedup_sqlite_path, settings.dedup_redis_url)
+
+        s = settings
+        self.connector = Connector(s.app_id, s.app_password, s.bot_tenant_id, **self._connector_options())
+        self.validator = JwtValidator(s.app_id, **self._validator_options()) if self._authenticates() else None
+        self.assistant = Assistant(s, self.history, self.transcript, processes, tracer=self.tracer, log=self.log)
+        self.admission = AdmissionController(**self._admission_options()) if s.admission_enabled else None
+        self.attachments = AttachmentReader(self.connector, **self._attachment_options()) if s.attachments_enabled else None
+        self.notifier = Notifier(self.connector, s.notify_sqlite_path, **self._notifier_options()) if s.notify_enabled else None
+        self.engine = BotEngine(self.connector, self.assistant.reply, **self._engine_options())
+        self._register_metrics()
+
+    async def warm_up(self):
+        """Pay the cold-start costs before the first message: bot token, signing keys, system prompt, documents, LLM connections
+
+        Returns the milliseconds each step took, or its error.
+        """
+        async def timed(step):
+            start = time.perf_counter()
+            try:
+                await step()
+            except Exception as e:
+                return f"error: {e}"
+            return round((time.perf_counter() - start) * 1000, 1)
+
+        self.assistant.memory.system_message()
+        if self.notifier:
+            # Resume the broadcast jobs a previous instance left unfinished
+            self.notifier.start()
+        steps = {"bot_token": lambda: self.connector.tokens.get(self.settings.bot_tenant_id)}
+        if self.validator:
+            steps["signing_keys"] = self.validator.refresh
+        steps.update(self.assistant.warm_up_steps())
+        results = dict(zip(steps, await asyncio.gather(*(timed(step) for step in steps.values()))))
+        self.log.info("warm_up", **results)
+        return results
+
+    async def close(self, timeout=60):
+        """Let queued replies finish, then stop the background work
+
+        Broadcast jobs in progress stop after their current sends and are resumed by another worker.
+        """
+        deadline = time.monotonic() + timeout
+        work_queue = self.engine.work_queue
+        drained = await work_queue.drain(timeout) if work_queue else True
+        if self.notifier:
+            self.notifier.close()
+            await self.notifier.drain(max(0.0, deadline - time.monotonic()))
+        self.connector.close()
+        for batcher in self.assistant.batchers.values():
+            batcher.close()
+        if self.transcript:
+            await asyncio.to_thread(self.transcript.close)
+        await close_clients()
+        if drained:
+            logger.info(f"Worker {os.getpid()} drained")
+        else:
+            logger.warning(f"Worker {os.getpid()} stopped with {work_queue.size()} replies still queued")
+        return drained
+
+    def _shared(self, setting, kind):
+        """Backend for state every process must see: "memory" only works with a single process"""
+        if kind == "memory" and self.processes > 1:
+            logger.warning(f"{setting}=memory is per process - using sqlite with {self.processes} workers")
+            return "sqlite"
+        return kind
+
+    def _connector_options(self):
+        # Bot Framework tokens and rate-limited, retrying delivery of everything the bot sends;
+        # the per-bot Teams limit covers every process, so each sends within its share of it
+        s = self.settings
+        global_rate, global_burst = per_process_rate(s.outbound_global_rate, s.outbound_global_burst, self.processes)
+        return dict(
+            token_endpoint=s.bot_token_endpoint,
+            refresh_margin=s.token_refresh_margin_seconds,
+            broadcast_concurrency=per_process(s.broadcast_concurrency, self.processes),
+            tracer=self.tracer,
+            log=self.log,
+            global_rate=global_rate,
+            global_burst=global_burst,
+            conversation_rate=s.outbound_conversation_rate,
+            conversation_burst=s.outbound_conversation_burst,
+            max_attempts=s.outbound_max_attempts,
+            dead_letter_path=s.outbound_dead_letter_path
+        )
+
+    def _authenticates(self):
+        """Whether the channel's JWT is checked on every incoming request (against its cached signing keys)"""
+        if self.settings.bot_auth_enabled and not self.settings.app_id:
+            logger.warning("No MicrosoftAppId configured - incoming requests are not authenticated")
+        return self.settings.bot_auth_enabled and bool(self.settings.app_id)
+
+    def _validator_options(self):
+        return dict(metadata_url=self.settings.bot_openid_metadata_url,
+                    refresh_interval=self.settings.bot_auth_keys_refresh_seconds)
+
+    def _admission_options(self):
+        # Quotas and fair scheduling in front of the LLM backends
+        s = self.settings
+        return dict(
+            max_concurrency=per_process(s.admission_max_concurrency or 4 * max(1, len(self.assistant.backends)),
+                                        self.processes),
+            adaptive=s.admission_adaptive,
+            max_queue=s.admission_max_queue,
+            max_wait=s.admission_max_wait_seconds,
+            user_rate=s.admission_user_rate_per_minute / 60,
+            user_burst=s.admission_user_burst,
+            tenant_rate=s.admission_tenant_rate_per_minute / 60,
+            tenant_burst=s.admission_tenant_burst,
+            priority_tenants=s.admission_priority_tenants,
+            priority_weight=s.admission_priority_weight
+        )
+
+    def _attachment_options(self):
+        # Text of the files and cards sent with messages; long documents are summarized by the LLM
+        s = self.settings
+        return dict(
+            summarize=self.assistant.chat,
+            max_bytes=s.attachment_max_bytes,
+            max_downloads=s.attachment_max_downloads,
+            inline_tokens=s.attachment_inline_tokens,
+            chunk_tokens=s.attachment_chunk_tokens,
+            max_chunks=s.attachment_max_chunks,
+            summary_concurrency=s.attachment_summary_concurrency,
+            tracer=self.tracer,
+            log=self.log
+        )
+
+    def _notifier_options(self):
+        # Conversation references and broadcast jobs for /api/notify
+        if not self.settings.notify_api_key:
+            logger.warning("NOTIFY_ENABLED without NOTIFY_API_KEY - /api/notify refuses every call")
+        return dict(api_key=self.settings.notify_api_key,
+                    concurrency=per_process(self.settings.broadcast_concurrency, self.processes),
+                    tracer=self.tracer, log=self.log)
+
+    def _engine_options(self):
+        s = self.settings
+        return dict(
+            stream=self.assistant.stream if s.llm_streaming else None,
+            stream_interval=s.stream_update_interval_ms / 1000,
+            validator=self.validator,
+            attachments=self.attachments,
+            admission=self.admission,
+            dedup_index=self.dedup_index,
+            # Background reply workers (used when MESSAGE_PROCESSING_MODE=queue)
+            queue_backend=create_backend(self._shared("WORK_QUEUE_BACKEND", s.work_queue_backend), s.work_queue_maxsize,
+                                         s.work_queue_sqlite_path) if s.message_processing_mode == "queue" else None,
+            queue_workers=s.work_queue_workers,
+            notifier=self.notifier,
+            home_tenant_id=s.home_tenant_id,
+            tracer=self.tracer,
+            log=self.log
+        )
+
+    def _register_metrics(self):
+        """Queue and component counters next to the latency histograms on /api/metrics"""
+        engine, connector, assistant = self.engine, self.connector, self.assistant
+        REGISTRY.gauge("bot_work_queue_size", "Activities waiting for a reply worker",
+                       lambda: engine.work_queue.size() if engine.work_queue else 0)
+        REGISTRY.gauge("bot_activities", "Incoming Activities by outcome", lambda: engine.stats, "counter")
+        REGISTRY.gauge("bot_outbound", "Outbound Connector delivery counters", connector.outbound.snapshot, "counter")
+        REGISTRY.gauge("bot_token_manager", "Bot Framework token counters", lambda: connector.tokens.stats, "counter")
+        REGISTRY.gauge("bot_auth", "Channel JWT validation counters", lambda: self.validator.stats if self.validator else {}, "counter")
+        REGISTRY.gauge("bot_attachments", "Attachment reading counters", lambda: self.attachments.stats if self.attachments else {}, "counter")
+        REGISTRY.gauge("bot_transcript", "Transcript log counters", lambda: self.transcript.stats if self.transcript else {}, "counter")
+        REGISTRY.gauge("bot_notify", "Proactive notification counters", lambda: self.notifier.snapshot() if self.notifier else {}, "counter")
+        REGISTRY.gauge("bot_dedup", "Suppressed Activity redeliveries", lambda: self.dedup_index.stats if self.dedup_index else {}, "counter")
+        REGISTRY.gauge("bot_rag", "Document retrieval counters",
+                       lambda: assistant._document_index.snapshot() if assistant._document_index else {}, "counter")
+        REGISTRY.gauge("bot_llm_router", "LLM hedging and failover counters",
+                       lambda: assistant.router.stats if assistant.router else {}, "counter")
+        REGISTRY.gauge("bot_admission", "Admission control counters and current limit", lambda: self.admission.snapshot() if self.admission else {}, "counter")
+        REGISTRY.gauge("bot_coalescing", "Identical concurrent prompts sharing one LLM call",
+                       lambda: assistant.coalescer.snapshot() if assistant.coalescer else {}, "counter")
+        for field, description in (("batches", "Ollama micro-batches released"), ("in_flight", "Ollama requests in flight"),
+                                   ("waiting", "Ollama requests waiting for a batch"), ("mean_wait_ms", "Mean wait for a batch")):
+            REGISTRY.gauge(f"bot_ollama_{field}", description,
+                           lambda field=field: {ollama_host(url): b.snapshot()[field] for url, b in assistant.batchers.items()},
+                           "host")
+        REGISTRY.gauge("bot_response_cache", "Response cache counters",
+                       lambda: assistant.cache.stats if assistant.cache else {}, "counter")
+
+    def snapshot(self):
+        """Counters of every component, e.g. for the health endpoint"""
+        return dict(
+            self.assistant.snapshot(),
+            activities=self.engine.snapshot(),
+            bot_tokens=self.connector.tokens.snapshot(),
+            auth=self.validator.snapshot() if self.validator else None,
+            attachments=self.attachments.snapshot() if self.attachments else None,
+            admission=self.admission.snapshot() if self.admission else None,
+            outbound=self.connector.outbound.snapshot(),
+            transcript=self.transcript.snapshot() if self.transcript else None,
+            notify=self.notifier.snapshot() if self.notifier else None,
+            dedup=dict(self.dedup_index.stats, backend=self.dedup_backend) if self.dedup_index else None,
+            logging=self.log.policy.stats
+        )
+
+
+class ThreadedBot:
+    """The bot for threaded hosts: a Bot on an event loop thread, driven from the request threads
+
+    run() hands a coroutine to the loop and waits for its result, so every
+    component has one implementation whichever host serves it. `watcher` (a
+    SettingsWatcher) is checked on every run(); when the settings file
+    changed, the LLM backends are rebuilt from it (hot-switching providers).
+    """
+
+    def __init__(self, settings, processes=1, watcher=None, name=__name__):
+        self.watcher = watcher
+        self.bot = Bot(settings, processes, name)
+        self.engine = self.bot.engine
+        self.notifier = self.bot.notifier
+        self.tracer = self.bot.tracer
+        self.log = self.bot.log
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="bot-loop", daemon=True)
+        self._thread.start()
+        # Document index, unfinished broadcast jobs, bot token and LLM connections, without holding up the first requests
+        asyncio.run_coroutine_threadsafe(self.bot.warm_up(), self.loop)
+
+    def run(self, coroutine):
+        """Run a coroutine on the bot's loop and return its result"""
+        self.refresh()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def call(self, function, *args):
+        """Call a plain function on the bot's loop (e.g. to read counters the loop is updating) and return its result"""
+        async def call():
+            return function(*args)
+
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def refresh(self):
+        """Pick up edits of the settings file: rebuild the backends when it was reloaded"""
+        if self.watcher is not None and self.watcher.refresh():
+            assistant = self.bot.assistant
+            self.loop.call_soon_threadsafe(assistant.configure, assistant.settings.reread())
+
+    def snapshot(self):
+        """Counters of every component, e.g. for the health endpoint"""
+        return self.call(self.bot.snapshot)
+
+    def close(self, timeout=60):
+        """Let queued replies finish, then stop the loop (see Bot.close)"""
+        try:
+            return asyncio.run_coroutine_threadsafe(self.bot.close(timeout), self.loop).result()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
@@ -0,0 +1,158 @@
+"""
+Single-flight coalescing of identical concurrent LLM prompts
+
+When an announcement goes out, many users ask the same question within
+seconds. Concurrent calls with the same key (see prompt_key: model plus
+every message actually sent, so system prompt, trimmed history and user
+message) share one upstream call. Everyone gets its result or its
+exception. Only calls that overlap in time are merged. Once the flight
+lands, the next call with the key goes upstream again; the response cache
+is what keeps answers around. A flight everyone stopped waiting for lands
+as it is cancelled; if it is cancelled under a caller still waiting (e.g.
+on shutdown), that caller gets FlightCancelled.
+
+Since the key covers the whole history, conversations with different
+context never share a reply. Each caller still saves the turn to its own
+conversation.
+
+stats: calls (requests seen), flights (upstream calls made) and coalesced
+(calls that joined a flight already in progress); snapshot() adds the
+coalescing ratio, coalesced / calls.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_key(messages, model):
+    """Key of an effective prompt: the model and the exact messages sent"""
+    payload = json.dumps([model, [[m["role"], m["content"]] for m in messages]], ensure_ascii=False)
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+class FlightCancelled(Exception):
+    """The shared upstream call was cancelled under a caller still waiting for it (e.g. on shutdown)"""
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class _StreamFlight:
+    __slots__ = ("task", "chunks", "done", "error", "changed", "readers")
+
+    def __init__(self):
+        self.task = None
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.readers = 0
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Coalescing for coroutines on one event loop
+
+    The upstream call runs as its own task, so one caller giving up (a
+    cancelled request) does not fail the others; it is cancelled only when
+    nobody is waiting for it any more.
+    """
+
+    def __init__(self):
+        self.stats = {"calls": 0, "flights": 0, "coalesced": 0}
+        self._flights = {}
+
+    def _count(self, joined):
+        self.stats["calls"] += 1
+        self.stats["coalesced" if joined else "flights"] += 1
+
+    async def do(self, key, call):
+        """Result of `await call()`, shared with concurrent callers of the same key"""
+        flight = self._flights.get(key)
+        self._count(flight is not None)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda _: self._land(key, flight))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            # The flight, not this caller, was cancelled: fail like an upstream error would
+            if flight.task.cancelled():
+                raise FlightCancelled(key) from None
+            raise
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Land now, not in the done callback a loop iteration later: a new caller starts a new flight
+                self._land(key, flight)
+                flight.task.cancel()
+
+    def _land(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def stream(self, key, make_stream):
+        """Chunks of `make_stream()` (an async iterator), replayed to concurrent callers of the same key
+
+        Callers that join late first get the chunks produced so far, then the
+        rest as they arrive.
+        """
+        flight = self._flights.get(key)
+        self._count(flight is not None)
+        if flight is None:
+            flight = self._flights[key] = _StreamFlight()
+            flight.task = asyncio.ensure_future(self._produce(key, flight, make_stream))
+        flight.readers += 1
+        try:
+            position = 0
+            while True:
+                changed = flight.changed
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            flight.readers -= 1
+            if flight.readers == 0 and not flight.done:
+                self._land(key, flight)
+                flight.task.cancel()
+
+    async def _produce(self, key, flight, make_stream):
+        try:
+            async for chunk in make_stream():
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = FlightCancelled(key)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            self._land(key, flight)
+            flight.notify()
+
+    def snapshot(self):
+        """Counters plus the coalescing ratio and the number of flights in progress"""
+        calls = self.stats["calls"]
+        return dict(
+            self.stats,
+            ratio=round(self.stats["coalesced"] / calls, 3) if calls else 0.0,
+            in_flight=len(self._flights)
+        )
@@ -0,0 +1,132 @@
+"""
+Bot Framework Connector client: the bot's access tokens and delivery of Activities
+
+A connector owns everything the bot needs to talk to Teams: the token
+manager for its app registration (client credentials against the token
+endpoint) and the outbound sender that paces, retries and dead-letters
+every call (see outbound.py). It uses the pooled httpx clients, so the
+connections to the token endpoint and the Connector service are reused.
+"""
+
+import logging
+
+from bot_core.http_clients import get_client
+from bot_core.metrics import Tracer
+from bot_core.outbound import OutboundSender
+from bot_core.structured_log import StructuredLogger
+from bot_core.token_manager import BOT_FRAMEWORK_SCOPE, AsyncTokenManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_ENDPOINT = "https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
+TOKEN_TIMEOUT_SECONDS = 10
+CONNECTOR_TIMEOUT_SECONDS = 10
+
+
+def activities_url(service_url, conversation_id, activity_id=None):
+    """Connector REST URL of a conversation's activities (or of one of them)"""
+    url = f"{service_url}v3/conversations/{conversation_id}/activities"
+    return f"{url}/{activity_id}" if activity_id else url
+
+
+def _activity_id(response):
+    try:
+        return response.json().get("id", "")
+    except ValueError:
+        return ""
+
+
+class Connector:
+    """Connector client; runs on the bot's event loop"""
+
+    def __init__(self, app_id, app_password, tenant_id, token_endpoint=DEFAULT_TOKEN_ENDPOINT, refresh_margin=300,
+                 broadcast_concurrency=50, tracer=None, log=None, **outbound):
+        self.app_id = app_id
+        self.app_password = app_password
+        self.tenant_id = tenant_id
+        self.token_endpoint = token_endpoint
+        self.refresh_margin = refresh_margin
+        self.broadcast_concurrency = broadcast_concurrency
+        self.tracer = tracer or Tracer()
+        self.log = log or StructuredLogger(__name__)
+        self.tokens = AsyncTokenManager(self.fetch_token, refresh_margin=refresh_margin)
+        self.outbound = OutboundSender(self._call, **outbound)
+
+    async def fetch_token(self, tenant_id, scope):
+        """Request a new Bot Framework access token from Entra ID"""
+        url, data = self._token_request(tenant_id, scope)
+        response = await get_client("token").post(url, data=data, timeout=TOKEN_TIMEOUT_SECONDS)
+        response.raise_for_status()
+        return response.json()
+
+    async def token(self, tenant_id=None, scope=BOT_FRAMEWORK_SCOPE):
+        """Bot Framework access token (cached, refreshed ahead of expiry); None if none can be had"""
+        tenant_id = tenant_id or self.tenant_id
+        try:
+            with self.tracer.span("token"):
+                return await self.tokens.get(tenant_id, scope)
+        except Exception as e:
+            self.log.error("token_failed", tenant_id=tenant_id, error=str(e))
+            return None
+
+    def _token_request(self, tenant_id, scope):
+        return self.token_endpoint.format(tenant_id=tenant_id), {
+            "grant_type": "client_credentials",
+            "client_id": self.app_id,
+            "client_secret": self.app_password,
+            "scope": scope
+        }
+
+    @staticmethod
+    def _headers(token):
+        return {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+    @staticmethod
+    def _sends(service_url, conversation_ids, activity):
+        return (("POST", activities_url(service_url, conversation_id), activity, conversation_id)
+                for conversation_id in conversation_ids)
+
+    async def _call(self, method, url, activity):
+        """One Bot Framework REST API call; raises on failure"""
+        token = await self.token()
+        if not token:
+            raise RuntimeError("No access token available")
+        with self.tracer.span(f"connector_{method.lower()}") as span:
+            response = await get_client("connector").request(method, url, json=activity, headers=self._headers(token),
+                                                             timeout=CONNECTOR_TIMEOUT_SECONDS)
+            span.set(status=response.status_code)
+            response.raise_for_status()
+        return response
+
+    async def post(self, service_url, conversation_id, activity):
+        """Post an Activity to a conversation, returning the new activity id (None on failure)"""
+        response = await self.outbound.send("POST", activities_url(service_url, conversation_id), activity, conversation_id)
+        if response is None:
+            return None
+        self.log.debug("activity_sent", conversation_id=conversation_id)
+        return _activity_id(response)
+
+    async def send(self, service_url, conversation_id, activity):
+        """Post an Activity to a conversation; True if it was delivered"""
+        return await self.post(service_url, conversation_id, activity) is not None
+
+    async def update(self, service_url, conversation_id, activity_id, activity):
+        """Replace a previously sent Activity (used for progressive streaming updates)"""
+        url = activities_url(service_url, conversation_id, activity_id)
+        return await self.outbound.send("PUT", url, activity, conversation_id) is not None
+
+    async def broadcast(self, service_url, conversation_ids, activity):
+        """Proactively post the same Activity to many conversations within the throttling limits
+
+        Returns {"sent": n, "failed": n}; failures end up in the dead-letter log.
+        """
+        result = await self.outbound.broadcast(self._sends(service_url, conversation_ids, activity),
+                                               concurrency=self.broadcast_concurrency)
+        self.log.info("broadcast_finished", **result)
+        return result
+
+    def snapshot(self):
+        return {"tokens": self.tokens.snapshot(), "outbound": self.outbound.snapshot()}
+
+    def close(self):
+        self.tokens.close()
@@ -0,0 +1,164 @@
+"""
+Token-budget-aware prompt assembly
+
+Instead of a fixed message count, the prompt is filled with history
+newest-first until a token budget is used up. Each stored message carries
+its token count (computed once, when it is added to the history), so
+building a prompt is just a walk over integers. Turns that no longer fit
+can be replaced by a cached rolling summary of the conversation.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Rough average for mixed Hungarian/English text; used when tiktoken is missing
+APPROX_CHARS_PER_TOKEN = 4
+# Role/separator tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "A korábbi beszélgetés összefoglalója: "
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.info(f"tiktoken not available ({e}), using approximate token counts")
+    return _encoding
+
+
+def count_tokens(text, exact=True):
+    """Count the tokens of a text (tiktoken when installed and `exact`, otherwise ~4 chars/token)"""
+    if exact:
+        encoding = _get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + APPROX_CHARS_PER_TOKEN - 1) // APPROX_CHARS_PER_TOKEN
+
+
+def make_message(role, content, exact=True):
+    """Create a history message with its token count cached"""
+    return {"role": role, "content": content, "tokens": count_tokens(content, exact)}
+
+
+def message_tokens(message, exact=True):
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = count_tokens(message["content"], exact)
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def build_context(system_prompt, history, user_message, budget, summary=None, exact=True, knowledge=None):
+    """Assemble the chat messages for a prompt within `budget` tokens
+
+    `system_prompt` is the text or a make_message() system message, whose
+    token count is then not recomputed. `knowledge` is an optional system
+    message with retrieved documents (rag.knowledge_message); it goes right
+    after the system prompt and its tokens come out of the budget before
+    the history. Returns (messages, dropped): the messages to send (without
+    token counts) and the older history messages that did not fit.
+    """
+    if isinstance(system_prompt, str):
+        system_prompt = {"role": "system", "content": system_prompt}
+    used = message_tokens(system_prompt, exact) + count_tokens(user_message, exact) + MESSAGE_OVERHEAD_TOKENS
+    if knowledge:
+        used += message_tokens(knowledge, exact)
+    if used > budget:
+        logger.warning(f"Prompt exceeds context budget without history ({used} > {budget} tokens)")
+
+    kept = []
+    cutoff = len(history)
+    for index in range(len(history) - 1, -1, -1):
+        tokens = message_tokens(history[index], exact)
+        if used + tokens > budget:
+            break
+        used += tokens
+        kept.append(history[index])
+        cutoff = index
+    dropped = history[:cutoff]
+
+    messages = [{"role": "system", "content": system_prompt["content"]}]
+    if knowledge:
+        messages.append({"role": "system", "content": knowledge["content"]})
+    if summary and dropped:
+        summary_tokens = count_tokens(summary, exact) + MESSAGE_OVERHEAD_TOKENS
+        # Make room for the summary by giving up the oldest kept turns
+        while kept and used + summary_tokens > budget:
+            used -= message_tokens(kept.pop(), exact)
+            cutoff += 1
+        if used + summary_tokens <= budget:
+            messages.append({"role": "system", "content": SUMMARY_PREFIX + summary})
+        dropped = history[:cutoff]
+
+    messages.extend({"role": m["role"], "content": m["content"]} for m in reversed(kept))
+    messages.append({"role": "user", "content": user_message})
+    return messages, dropped
+
+
+def message_key(message):
+    """Identity of a history message, used to track what a summary covers"""
+    return hash((message["role"], message["content"]))
+
+
+class SummaryCache:
+    """Per-conversation rolling summaries, bounded by LRU"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # conversation_id -> (summary, key of last covered message)
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id):
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None:
+                self._entries.move_to_end(conversation_id)
+            return entry[0] if entry else None
+
+    def pending(self, conversation_id, dropped):
+        """Dropped messages the cached summary does not cover yet"""
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+        if entry is None:
+            return list(dropped)
+        keys = [message_key(m) for m in dropped]
+        if entry[1] in keys:
+            return list(dropped[keys.index(entry[1]) + 1:])
+        return list(dropped)
+
+    def set(self, conversation_id, summary, last_covered):
+        with self._lock:
+            self._entries[conversation_id] = (summary, message_key(last_covered))
+            self._entries.move_to_end(conversation_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def build_summary_prompt(previous_summary, messages):
+    """Messages asking the model to fold older turns into the running summary"""
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f"Eddigi összefoglaló: {previous_summary}\n\n{transcript}"
+    return [
+        {"role": "system", "content": "Foglald össze tömören (legfeljebb 5 mondatban, magyarul) az alábbi beszélgetést, a fontos tényekkel és kérésekkel együtt."},
+        {"role": "user", "content": transcript}
+    ]
+
+
+def build_document_summary_prompt(name, text, part=None):
+    """Messages asking the model to summarize an attached document (or one part of it)"""
+    source = f"{name} ({part}. rész)" if part else name
+    return [
+        {"role": "system", "content": "Foglald össze tömören (legfeljebb 5 mondatban, magyarul) az alábbi dokumentumrészletet, a fontos tényekkel, számokkal és nevekkel együtt."},
+        {"role": "user", "content": f"{source}:\n\n{text}"}
+    ]
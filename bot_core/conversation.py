@@ -0,0 +1,130 @@
+"""
+Conversation memory: the prompt for a message and the turns it leaves behind
+
+Every reply goes through the same steps, whichever host serves it:
+history from the store (or, for a conversation the store does not know
+after a restart, its last turns from the transcript), the prompt within
+the token budget (context.build_context), and afterwards the new turn
+saved to the store and the transcript. With summaries enabled, turns that
+no longer fit are folded into a rolling summary by the LLM, off the
+critical path.
+
+`summarize(messages)` is a coroutine function returning the summary
+text. A SQLite history store and the transcript are read and written on a
+thread, off the event loop.
+"""
+
+import asyncio
+import logging
+import time
+
+from bot_core.context import SummaryCache, build_context, build_summary_prompt, make_message
+from bot_core.metrics import Tracer
+from bot_core.settings import SYSTEM_PROMPT
+from bot_core.structured_log import StructuredLogger
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationMemory:
+    """Conversation memory; runs on the bot's event loop"""
+
+    def __init__(self, history, transcript=None, system_prompt=SYSTEM_PROMPT, token_budget=3000, max_messages=50,
+                 ttl=86400, summarize=None, max_summaries=10000, tracer=None, log=None):
+        self.history = history
+        self.transcript = transcript
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.summarize = summarize
+        self.summaries = SummaryCache(max_entries=max_summaries) if summarize is not None else None
+        self.tracer = tracer or Tracer()
+        self.log = log or StructuredLogger(__name__)
+        self._system_message = None
+        self._summarizing = set()  # conversations whose summary is being refreshed
+        self._tasks = set()  # the refresh tasks: the loop keeps only weak references to them
+        # Whether loading or saving a turn does file I/O
+        self.blocking = history.durable or transcript is not None
+
+    async def _offload(self, call, *args):
+        if self.blocking:
+            return await asyncio.to_thread(call, *args)
+        return call(*args)
+
+    async def prompt(self, user_message, conversation_id, exact=True, knowledge=None):
+        """The chat messages: system prompt, retrieved documents, history within the token budget, user message"""
+        history = await self._offload(self._load, conversation_id)
+        messages, dropped = self._context(conversation_id, history, user_message, exact, knowledge)
+        # Fold turns that no longer fit into the rolling summary, off the critical path
+        if self._needs_summary(conversation_id, dropped):
+            task = asyncio.get_running_loop().create_task(self._refresh_summary(conversation_id, dropped))
+            self._tasks.add(task)
+            task.add_done_callback(lambda task: self._summary_done(task, conversation_id))
+        return messages
+
+    def _summary_done(self, task, conversation_id):
+        self._tasks.discard(task)
+        self._summarizing.discard(conversation_id)
+
+    async def save_turn(self, conversation_id, user_message, reply, exact=True):
+        """Save a user/bot turn to history with token counts cached, and to the transcript"""
+        await self._offload(self._save, conversation_id, user_message, reply, exact)
+
+    async def _refresh_summary(self, conversation_id, dropped):
+        """Update the cached summary with history turns that fell out of the context window"""
+        try:
+            prompt, pending = self._summary_prompt(conversation_id, dropped)
+            if prompt is not None:
+                self._summarized(conversation_id, await self.summarize(prompt), pending)
+        except Exception as e:
+            self.log.warning("summary_failed", conversation_id=conversation_id, error=str(e))
+
+    def system_message(self):
+        """The system prompt as a message with its token count, counted on first use"""
+        if self._system_message is None:
+            self._system_message = make_message("system", self.system_prompt)
+        return self._system_message
+
+    def _load(self, conversation_id):
+        with self.tracer.span("history"):
+            return self.history.get(conversation_id) or self._restore(conversation_id)
+
+    def _restore(self, conversation_id):
+        """A conversation's last turns from the transcript, put back into the history store"""
+        if self.transcript is None:
+            return []
+        history = self.transcript.tail(conversation_id, self.max_messages, since=time.time() - self.ttl)
+        if history:
+            self.history.extend(conversation_id, history)
+            self.log.info("history_restored", conversation_id=conversation_id, messages=len(history))
+        return history
+
+    def _context(self, conversation_id, history, user_message, exact, knowledge):
+        summary = self.summaries.get(conversation_id) if self.summaries is not None else None
+        return build_context(self.system_message(), history, user_message, self.token_budget, summary, exact, knowledge)
+
+    def _needs_summary(self, conversation_id, dropped):
+        """Claim the summary refresh of a conversation with turns that no longer fit"""
+        if self.summaries is None or not dropped or conversation_id in self._summarizing:
+            return False
+        self._summarizing.add(conversation_id)
+        return True
+
+    def _save(self, conversation_id, user_message, reply, exact):
+        turn = [make_message("user", user_message, exact), make_message("assistant", reply, exact)]
+        self.history.extend(conversation_id, turn)
+        if self.transcript is not None:
+            self.transcript.extend(conversation_id, turn)
+
+    def _summary_prompt(self, conversation_id, dropped):
+        """The prompt folding the dropped turns the summary does not cover yet into it (None: nothing new)"""
+        pending = self.summaries.pending(conversation_id, dropped)
+        if not pending:
+            return None, None
+        return build_summary_prompt(self.summaries.get(conversation_id), pending), pending
+
+    def _summarized(self, conversation_id, summary, pending):
+        if summary:
+            self.summaries.set(conversation_id, summary, pending[-1])
+            self.log.info("summary_updated", conversation_id=conversation_id, folded=len(pending))
@@ -0,0 +1,185 @@
+"""
+Deduplication of redelivered Activities
+
+The Bot Framework redelivers an Activity when the messages endpoint
+answers too slowly. The index remembers (conversation id, activity id)
+pairs for `ttl` seconds so a redelivery is acknowledged without a second
+LLM call or reply. Keys are stored as 64-bit BLAKE2b hashes. A bloom
+filter would be smaller, but its false positives would drop genuine
+messages.
+
+Backends:
+  memory   ring of per-time-slice hash sets, per process
+  sqlite   local file shared by the worker processes of one host
+  redis    shared by scaled-out instances (needs the optional redis package)
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "teams_bot_dedup.db")
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class DedupIndex:
+    """Interface for dedup backends"""
+
+    durable = True  # kept in a file or a server (its calls do I/O)
+
+    def __init__(self):
+        self.stats = {"duplicates": 0}
+
+    def seen(self, key):
+        """Record the key; True if it was already recorded within the TTL
+
+        Fails open: if the backend is unreachable the Activity is processed.
+        """
+        try:
+            duplicate = self._check_and_add(key)
+        except Exception as e:
+            logger.warning(f"Dedup index unavailable: {e}")
+            return False
+        if duplicate:
+            self.stats["duplicates"] += 1
+        return duplicate
+
+    def _check_and_add(self, key):
+        raise NotImplementedError
+
+    def forget(self, key):
+        """Drop a key again, e.g. when processing the Activity failed and a redelivery should be handled"""
+        try:
+            self._remove(key)
+        except Exception as e:
+            logger.warning(f"Dedup index unavailable: {e}")
+
+    def _remove(self, key):
+        raise NotImplementedError
+
+
+class MemoryDedupIndex(DedupIndex):
+    """Hash sets for `generations` consecutive time slices; the oldest slice is dropped as a whole"""
+
+    durable = False
+
+    def __init__(self, ttl=600, generations=10, max_entries=200000, clock=time.monotonic):
+        super().__init__()
+        self.ttl = ttl
+        self.generations = generations
+        self.max_entries = max_entries
+        self.clock = clock
+        self._slice = ttl / generations
+        self._ring = deque()  # (slice number, set of key hashes), oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _drop_oldest(self):
+        _, keys = self._ring.popleft()
+        self._size -= len(keys)
+
+    def _check_and_add(self, key):
+        digest = _hash(key)
+        current = int(self.clock() / self._slice)
+        with self._lock:
+            while self._ring and (self._ring[0][0] <= current - self.generations or self._size >= self.max_entries):
+                self._drop_oldest()
+            if any(digest in keys for _, keys in self._ring):
+                return True
+            if not self._ring or self._ring[-1][0] != current:
+                self._ring.append((current, set()))
+            self._ring[-1][1].add(digest)
+            self._size += 1
+            return False
+
+    def _remove(self, key):
+        digest = _hash(key)
+        with self._lock:
+            for _, keys in self._ring:
+                if digest in keys:
+                    keys.discard(digest)
+                    self._size -= 1
+
+    def __len__(self):
+        return self._size
+
+
+class SqliteDedupIndex(DedupIndex):
+    """Index in a local SQLite file (WAL mode, safe across processes); expired rows purged every `purge_every` inserts"""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, ttl=600, purge_every=1000):
+        super().__init__()
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._inserts = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS activities (key INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+
+    def _check_and_add(self, key):
+        now = time.time()
+        with self._lock:
+            # Inserts a new key or revives an expired one; no change means a live duplicate
+            cursor = self._conn.execute(
+                "INSERT INTO activities (key, seen_at) VALUES (?, ?)"
+                " ON CONFLICT (key) DO UPDATE SET seen_at = excluded.seen_at WHERE activities.seen_at < ?",
+                (_hash(key), now, now - self.ttl)
+            )
+            if cursor.rowcount == 0:
+                return True
+            self._inserts += 1
+            if self._inserts % self.purge_every == 0:
+                self._conn.execute("DELETE FROM activities WHERE seen_at < ?", (now - self.ttl,))
+            return False
+
+    def _remove(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM activities WHERE key = ?", (_hash(key),))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+
+class RedisDedupIndex(DedupIndex):
+    """Index shared by every instance through Redis (SET NX with expiry)"""
+
+    def __init__(self, client, ttl=600, prefix="teams-bot:dedup:"):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _check_and_add(self, key):
+        return not self.client.set(f"{self.prefix}{_hash(key):x}", 1, nx=True, ex=self.ttl)
+
+    def _remove(self, key):
+        self.client.delete(f"{self.prefix}{_hash(key):x}")
+
+
+def create_dedup_index(kind="memory", ttl=600, sqlite_path=DEFAULT_SQLITE_PATH, redis_url=""):
+    """Create a dedup index by name ("memory", "sqlite" or "redis")"""
+    kind = (kind or "memory").lower()
+    if kind == "sqlite":
+        return SqliteDedupIndex(sqlite_path or DEFAULT_SQLITE_PATH, ttl)
+    if kind == "redis":
+        try:
+            import redis
+            return RedisDedupIndex(redis.Redis.from_url(redis_url), ttl)
+        except ImportError:
+            logger.warning("redis package not installed - falling back to in-memory dedup index")
+    elif kind != "memory":
+        logger.warning(f"Unknown dedup backend: {kind}, falling back to memory")
+    return MemoryDedupIndex(ttl)
@@ -0,0 +1,314 @@
+"""
+The bot engine: Bot Framework Activity handling shared by every host
+
+The hosts are thin adapters: they hand the request's Content-Type,
+Authorization header and body to handle_request() (or an Activity to
+handle()) and turn the returned EngineResponse into their HTTP response.
+function_app.py (Azure Functions) awaits them on its event loop,
+app_simple.py (Flask, gunicorn) runs them on the loop thread of a
+bot.ThreadedBot. Everything else happens here, the same way for both:
+parsing into a compact Activity (activity.py), the channel's JWT
+(auth.py), redelivery suppression, replies to messages (inline or through
+the work queue, behind admission control) including the text of their
+attachments (attachments.py), the welcome message when the bot is added
+to a conversation, delivery through the Connector, and the conversation
+reference of every Activity for proactive notifications (notify.py).
+
+handle() is also the transport-free entry point: benchmarks and load
+tests call it in-process to profile the engine without an HTTP server in
+front (benchmarks/bench_engine.py).
+
+The reply text comes from the provider layer (assistant.py): the coroutine
+`reply(text, conversation_id)` returns it. With `stream(text,
+conversation_id)`, an async generator of chunks, the reply is posted
+progressively instead.
+"""
+
+import asyncio
+import logging
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+
+from bot_core.activity import as_activity, parse_activity
+from bot_core.admission import Rejected
+from bot_core.attachments import with_documents
+from bot_core.auth import Unauthorized
+from bot_core.metrics import Tracer
+from bot_core.streaming import ProgressiveReply
+from bot_core.structured_log import StructuredLogger
+from bot_core.work_queue import PermanentError, WorkQueue
+
+logger = logging.getLogger(__name__)
+
+BOT_NAME = "Fresh Bot"
+WELCOME_MESSAGE = "Szia! Én vagyok a Fresh Bot! 👋 Írj bármit és segíteni fogok!"
+
+# Replies to messages that were not admitted
+REJECTION_REPLIES = {
+    "user_quota": "Kicsit túl sok üzenet érkezett tőled rövid idő alatt. Kérlek, próbáld újra egy perc múlva! ⏳",
+    "tenant_quota": "A szervezetedből most túl sok kérés érkezik. Kérlek, próbáld újra néhány perc múlva! ⏳",
+    "overloaded": "Most nagyon leterhelt vagyok, kérlek, próbáld újra egy kicsit később! ⏳",
+    "timeout": "Most nagyon leterhelt vagyok, kérlek, próbáld újra egy kicsit később! ⏳"
+}
+
+
+@dataclass
+class EngineResponse:
+    """What the host answers the channel with: HTTP status, optional JSON body, extra headers"""
+    status_code: int
+    body: dict = None
+    headers: dict = field(default_factory=dict)
+
+
+class BotEngine:
+    """Activity handling; `reply` is a coroutine function, `stream` an async generator"""
+
+    def __init__(self, connector, reply, validator=None, attachments=None, admission=None, dedup_index=None,
+                 queue_backend=None, queue_workers=4, notifier=None, home_tenant_id=None, bot_name=BOT_NAME, welcome=WELCOME_MESSAGE, rejection_replies=REJECTION_REPLIES,
+                 stream=None, stream_interval=1.0, tracer=None, log=None):
+        self.connector = connector
+        self.reply = reply
+        self.stream = stream
+        self.stream_interval = stream_interval
+        self.validator = validator
+        self.attachments = attachments
+        self.admission = admission
+        self.dedup_index = dedup_index
+        self.notifier = notifier
+        self.home_tenant_id = home_tenant_id
+        self.bot_name = bot_name
+        self.welcome = welcome
+        self.rejection_replies = rejection_replies
+        self.tracer = tracer or Tracer()
+        self.log = log or StructuredLogger(__name__)
+        self.stats = {"activities": 0, "unauthorized": 0, "messages": 0, "duplicates": 0, "queued": 0, "queue_full": 0, "rejected": 0,
+                      "welcomes": 0, "ignored": 0, "failed": 0}
+        # Background reply workers; without a backend messages are answered inline
+        self.work_queue = None
+        if queue_backend is not None:
+            self.work_queue = WorkQueue(queue_backend, self.tracer.traced("queue")(self.process_message),
+                                        workers=queue_workers)
+
+    async def handle_request(self, content_type, data, authorization=None):
+        """The messaging endpoint minus HTTP: Content-Type, Authorization and raw body in, EngineResponse out"""
+        activity, refused = self.parse(content_type, data)
+        if refused is not None:
+            return refused
+        if self.validator is not None:
+            try:
+                with self.tracer.span("auth"):
+                    await self.validator.validate(authorization, activity)
+            except Exception as e:
+                return self._unauthorized(e)
+        return await self.handle(activity)
+
+    async def handle(self, activity):
+        """Handle one incoming Activity (or its dict)"""
+        self.stats["activities"] += 1
+        try:
+            activity = as_activity(activity)
+            if self.notifier is not None:
+                await self.notifier.record(activity)
+            if activity.type == "message":
+                response = await self._accept_message(activity)
+                if response is not None:
+                    return response
+                try:
+                    await self.process_message(activity)
+                except PermanentError:
+                    # Part of the reply is posted: a redelivery must not post another one
+                    raise
+                except Exception:
+                    await self.forget(activity)
+                    raise
+                return EngineResponse(200)
+            if activity.type == "conversationUpdate":
+                if self._bot_added(activity):
+                    await self.connector.send(activity.service_url, activity.conversation_id,
+                                              self.make_reply_activity(self.welcome))
+                return EngineResponse(200)
+            return self._ignored(activity.type)
+        except Exception as e:
+            return self._failed(e)
+
+    async def process_message(self, activity):
+        """Generate the AI reply for a message Activity (or its dict) and post it to the conversation"""
+        activity = as_activity(activity)
+
+        # Fetch the token while the reply is generated if none is cached yet
+        self.connector.tokens.prefetch(self.connector.tenant_id)
+
+        user_message = await self.message_text(activity)
+        try:
+            return await self.reply_to_message(user_message, activity)
+        except Rejected as e:
+            reply = self._rejected(e, activity.conversation_id, activity.user_id, activity.tenant_id)
+            return await self.connector.send(activity.service_url, activity.conversation_id, reply)
+
+    async def message_text(self, activity):
+        """The text to answer: the message followed by the content of its attachments"""
+        if self.attachments is None or not activity.attachments:
+            return activity.text
+        return with_documents(activity.text, await self.attachments.read(activity))
+
+    async def reply_to_message(self, user_message, activity):
+        """Generate the AI reply and post it, streamed or as one message
+
+        Only the generation holds an admission slot: the reply is posted (with
+        the Connector's retries) after the slot is released.
+        """
+        if self.stream is not None:
+            return await self.stream_reply(user_message, activity)
+        conversation_id = activity.conversation_id
+        async with self.admitted(activity):
+            bot_reply = await self.reply(user_message, conversation_id)
+        success = await self.connector.send(activity.service_url, conversation_id, self.make_reply_activity(bot_reply))
+        self._log_reply(conversation_id, success, bot_reply)
+        return success
+
+    async def stream_reply(self, user_message, activity):
+        """Post the AI reply progressively, updating one message as chunks arrive"""
+        conversation_id = activity.conversation_id
+        service_url = activity.service_url
+        reply = ProgressiveReply(
+            post=lambda activity: self.connector.post(service_url, conversation_id, activity),
+            update=lambda activity_id, activity: self.connector.update(service_url, conversation_id, activity_id, activity),
+            make_activity=self.make_reply_activity,
+            interval=self.stream_interval
+        )
+        await reply.start()
+        try:
+            # The slot is held while the reply is generated; the updates throttled in between go out as it streams
+            async with self.admitted(activity):
+                async for chunk in self.stream(user_message, conversation_id):
+                    await reply.append(chunk)
+            success = await reply.finish()
+        except Exception as e:
+            # Once part of the reply is in the conversation, running the message again would post a second one
+            if reply.activity_id is None:
+                raise
+            raise PermanentError(f"reply failed after it was partly posted: {e}") from e
+        self.log.info("reply_sent", conversation_id=conversation_id, success=success, updates=reply.updates, reply=reply.text)
+        return success
+
+    def make_reply_activity(self, text):
+        """Create Bot Framework response activity"""
+        return {"type": "message", "text": text, "from": {"id": self.connector.app_id, "name": self.bot_name}}
+
+    def parse(self, content_type, data):
+        """(Activity, None) from a request body, or (None, the EngineResponse refusing it)"""
+        if "application/json" not in (content_type or ""):
+            self.log.warning("invalid_content_type", content_type=content_type or "")
+            return None, EngineResponse(415)
+        with self.tracer.span("parse"):
+            try:
+                return parse_activity(data), None
+            except ValueError as e:
+                self.log.warning("invalid_json", error=str(e))
+                return None, EngineResponse(400)
+
+    def _unauthorized(self, error):
+        """The response to a request whose token could not be checked (401, or 503 while no keys are available)"""
+        self.stats["unauthorized"] += 1
+        if isinstance(error, Unauthorized):
+            self.log.warning("unauthorized", reason=error.reason)
+            return EngineResponse(401)
+        self.log.error("auth_unavailable", error=str(error))
+        return EngineResponse(503, headers={"Retry-After": "5"})
+
+    async def is_duplicate(self, activity):
+        """Record a message Activity; True if it is a redelivery of one already being handled"""
+        key = activity.key if self.dedup_index is not None else None
+        if key is None or not await self._dedup_call(self.dedup_index.seen, key):
+            return False
+        self.stats["duplicates"] += 1
+        self.log.info("duplicate_suppressed", activity_id=activity.id, conversation_id=activity.conversation_id)
+        return True
+
+    async def forget(self, activity):
+        """Let a redelivery of this Activity be processed again (it was not handled)"""
+        key = activity.key if self.dedup_index is not None else None
+        if key is not None:
+            await self._dedup_call(self.dedup_index.forget, key)
+
+    async def _dedup_call(self, method, key):
+        # A durable index is a SQLite file or a Redis server: its calls run on a thread, off the event loop
+        if self.dedup_index.durable:
+            return await asyncio.to_thread(method, key)
+        return method(key)
+
+    def log_activity(self, activity):
+        """Log a received message Activity as one event (text and user identifiers redacted by default)"""
+        self.log.info(
+            "activity_received",
+            activity_id=activity.id,
+            conversation_id=activity.conversation_id,
+            tenant_id=activity.tenant_id or None,
+            home_tenant=activity.tenant_id == self.home_tenant_id,
+            domain=activity.domain or None,
+            user_id=activity.from_id or None,
+            aad_object_id=activity.aad_object_id or None,
+            upn=activity.upn or None,
+            user_name=activity.from_name or None,
+            text=activity.text
+        )
+
+    async def _accept_message(self, activity):
+        """The response for a message Activity that needs no inline processing (duplicate, queued), else None"""
+        self.stats["messages"] += 1
+        # A redelivery of an Activity that is already handled gets no second reply
+        if await self.is_duplicate(activity):
+            return EngineResponse(200)
+        self.log_activity(activity)
+        if self.work_queue is None:
+            return None
+        if not await self.work_queue.submit(activity.to_dict()):
+            self.stats["queue_full"] += 1
+            self.log.error("work_queue_full", activity_id=activity.id)
+            await self.forget(activity)
+            return EngineResponse(503, headers={"Retry-After": "1"})
+        self.stats["queued"] += 1
+        self.log.debug("activity_queued", activity_id=activity.id)
+        return EngineResponse(202)
+
+    def _bot_added(self, activity):
+        """True if a conversationUpdate adds the bot itself to the conversation"""
+        self.log.info("conversation_update", members_added=len(activity.members_added))
+        # Teams names the bot "28:<app id>", the same id it is addressed by as the recipient
+        bot_ids = {self.connector.app_id, activity.recipient_id}
+        if not any(member_id in bot_ids for member_id in activity.members_added):
+            return False
+        self.stats["welcomes"] += 1
+        self.log.info("bot_added", conversation_id=activity.conversation_id)
+        return True
+
+    def _ignored(self, activity_type):
+        self.stats["ignored"] += 1
+        self.log.debug("activity_ignored", type=activity_type)
+        return EngineResponse(200)
+
+    def _failed(self, error):
+        self.stats["failed"] += 1
+        self.log.error("message_failed", exc_info=True, error=str(error))
+        return EngineResponse(500, {"error": str(error)})
+
+    def admitted(self, activity):
+        """A slot for generating the reply to `activity` (Rejected if not admitted), a no-op without admission control"""
+        if self.admission is None:
+            return nullcontext()
+        return self.admission.admit(activity.user_id, activity.tenant_id)
+
+    def _rejected(self, error, conversation_id, user_id, tenant_id):
+        self.stats["rejected"] += 1
+        self.log.warning("message_rejected", reason=error.reason, conversation_id=conversation_id, user_id=user_id,
+                         tenant_id=tenant_id)
+        return self.make_reply_activity(self.rejection_replies[error.reason])
+
+    def _log_reply(self, conversation_id, success, reply):
+        if success:
+            self.log.info("reply_sent", conversation_id=conversation_id, success=True, reply=reply)
+        else:
+            self.log.error("reply_failed", conversation_id=conversation_id)
+
+    def snapshot(self):
+        return dict(self.stats, queue_size=self.work_queue.size() if self.work_queue else 0)
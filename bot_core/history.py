@@ -0,0 +1,236 @@
+"""
+Conversation history stores
+
+Messages are dicts with "role" and "content", plus an optional cached
+"tokens" count (see bot_core.context). Both stores keep the last
+`max_messages` messages per conversation and evict whole conversations
+that were not touched for `ttl` seconds or that fall off the
+least-recently-used end once `max_conversations` is reached.
+
+MemoryHistoryStore is per process; SqliteHistoryStore keeps history in a
+local file that survives restarts and is shared by every worker process on
+the host.
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "teams_bot_history.db")
+
+
+class HistoryStore:
+    """Interface for conversation history backends"""
+
+    durable = True  # kept in a file (its calls do I/O)
+
+    def get(self, conversation_id):
+        """Return the stored messages of a conversation, oldest first"""
+        raise NotImplementedError
+
+    def append(self, conversation_id, role, content):
+        """Add one message to a conversation"""
+        self.extend(conversation_id, [{"role": role, "content": content}])
+
+    def extend(self, conversation_id, messages):
+        """Add several messages to a conversation"""
+        raise NotImplementedError
+
+    def clear(self, conversation_id):
+        """Forget a conversation"""
+        raise NotImplementedError
+
+    def __len__(self):
+        """Number of conversations currently stored"""
+        raise NotImplementedError
+
+
+class MemoryHistoryStore(HistoryStore):
+    """In-process store: one bounded deque per conversation in an LRU OrderedDict"""
+
+    durable = False
+
+    def __init__(self, max_messages=10, max_conversations=10000, ttl=86400, clock=time.monotonic):
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.clock = clock
+        self._conversations = OrderedDict()  # conversation_id -> [deque, last_access]
+        self._lock = threading.Lock()
+
+    def _evict(self, now):
+        # Entries are ordered by last access, so expired ones are all at the front
+        while self._conversations:
+            conversation_id, (_, last_access) = next(iter(self._conversations.items()))
+            if len(self._conversations) <= self.max_conversations and now - last_access < self.ttl:
+                break
+            del self._conversations[conversation_id]
+
+    def get(self, conversation_id):
+        now = self.clock()
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None:
+                return []
+            if now - entry[1] >= self.ttl:
+                del self._conversations[conversation_id]
+                return []
+            entry[1] = now
+            self._conversations.move_to_end(conversation_id)
+            return list(entry[0])
+
+    def extend(self, conversation_id, messages):
+        now = self.clock()
+        with self._lock:
+            entry = self._conversations.get(conversation_id)
+            if entry is None or now - entry[1] >= self.ttl:
+                entry = [deque(maxlen=self.max_messages), now]
+                self._conversations[conversation_id] = entry
+            entry[0].extend(messages)
+            entry[1] = now
+            self._conversations.move_to_end(conversation_id)
+            self._evict(now)
+
+    def clear(self, conversation_id):
+        with self._lock:
+            self._conversations.pop(conversation_id, None)
+
+    def __len__(self):
+        return len(self._conversations)
+
+
+class SqliteHistoryStore(HistoryStore):
+    """Shared store in a local SQLite file (WAL mode, safe across processes)
+
+    Trimming to `max_messages` happens on every write; TTL and LRU eviction
+    run every `purge_every` writes.
+    """
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, max_messages=10, max_conversations=10000, ttl=86400, purge_every=500):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " conversation_id TEXT PRIMARY KEY,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_last_access ON conversations (last_access)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " conversation_id TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " tokens INTEGER)"
+        )
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(messages)")]
+        if "tokens" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN tokens INTEGER")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, seq)")
+
+    def get(self, conversation_id):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_access FROM conversations WHERE conversation_id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None or now - row[0] >= self.ttl:
+                return []
+            rows = self._conn.execute(
+                "SELECT role, content, tokens FROM messages WHERE conversation_id = ?"
+                " ORDER BY seq DESC LIMIT ?",
+                (conversation_id, self.max_messages)
+            ).fetchall()
+            self._conn.execute(
+                "UPDATE conversations SET last_access = ? WHERE conversation_id = ?", (now, conversation_id)
+            )
+        messages = []
+        for role, content, tokens in reversed(rows):
+            message = {"role": role, "content": content}
+            if tokens is not None:
+                message["tokens"] = tokens
+            messages.append(message)
+        return messages
+
+    def extend(self, conversation_id, messages):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT last_access FROM conversations WHERE conversation_id = ?", (conversation_id,)
+                ).fetchone()
+                if row is not None and now - row[0] >= self.ttl:
+                    self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                self._conn.execute(
+                    "INSERT INTO conversations (conversation_id, last_access) VALUES (?, ?)"
+                    " ON CONFLICT (conversation_id) DO UPDATE SET last_access = excluded.last_access",
+                    (conversation_id, now)
+                )
+                self._conn.executemany(
+                    "INSERT INTO messages (conversation_id, role, content, tokens) VALUES (?, ?, ?, ?)",
+                    [(conversation_id, m["role"], m["content"], m.get("tokens")) for m in messages]
+                )
+                self._conn.execute(
+                    "DELETE FROM messages WHERE conversation_id = ? AND seq <= ("
+                    " SELECT seq FROM messages WHERE conversation_id = ?"
+                    " ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                    (conversation_id, conversation_id, self.max_messages)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                self._purge(now)
+
+    def _purge(self, now):
+        """Drop expired conversations and the least recently used ones beyond the cap"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "DELETE FROM conversations WHERE last_access < ? OR conversation_id IN ("
+                " SELECT conversation_id FROM conversations ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.max_conversations)
+            )
+            self._conn.execute(
+                "DELETE FROM messages WHERE conversation_id NOT IN (SELECT conversation_id FROM conversations)"
+            )
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def clear(self, conversation_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+            self._conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+def create_history_store(kind="memory", max_messages=10, max_conversations=10000, ttl=86400, sqlite_path=DEFAULT_SQLITE_PATH):
+    """Create a history store by name ("memory" or "sqlite")"""
+    kind = (kind or "memory").lower()
+    if kind == "sqlite":
+        return SqliteHistoryStore(sqlite_path or DEFAULT_SQLITE_PATH, max_messages, max_conversations, ttl)
+    if kind != "memory":
+        logger.warning(f"Unknown history backend: {kind}, falling back to memory")
+    return MemoryHistoryStore(max_messages, max_conversations, ttl)
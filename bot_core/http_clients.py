@@ -0,0 +1,56 @@
+"""
+Long-lived async HTTP clients, one per upstream
+
+Every upstream (token endpoint, Bot Connector, Ollama, Azure OpenAI) gets
+its own httpx.AsyncClient so connections and TLS sessions are reused across
+requests. Limits come from the environment and can be overridden per
+upstream, e.g. HTTP_MAX_CONNECTIONS_OLLAMA=8.
+"""
+
+import logging
+import os
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+
+
+def _setting(name, upstream, default):
+    return os.environ.get(f"{name}_{upstream.upper()}", os.environ.get(name, default))
+
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def get_client(upstream, timeout=30.0):
+    """Return the shared AsyncClient for an upstream, creating it on first use"""
+    client = _clients.get(upstream)
+    if client is not None and not client.is_closed:
+        return client
+
+    limits = httpx.Limits(
+        max_connections=int(_setting("HTTP_MAX_CONNECTIONS", upstream, "100")),
+        max_keepalive_connections=int(_setting("HTTP_MAX_KEEPALIVE_CONNECTIONS", upstream, "20")),
+        keepalive_expiry=float(_setting("HTTP_KEEPALIVE_EXPIRY", upstream, "60"))
+    )
+    # HTTP/2 is negotiated via ALPN, so plain-http upstreams (Ollama) stay on HTTP/1.1
+    http2 = _setting("HTTP2_ENABLED", upstream, "true").lower() == "true" and _http2_available()
+
+    client = httpx.AsyncClient(limits=limits, http2=http2, timeout=timeout)
+    _clients[upstream] = client
+    logger.info(f"HTTP client for {upstream} created (max_connections={limits.max_connections}, http2={http2})")
+    return client
+
+
+async def close_clients():
+    """Close all pooled clients (on shutdown)"""
+    for client in list(_clients.values()):
+        await client.aclose()
+    _clients.clear()
@@ -0,0 +1,338 @@
+"""
+Latency-aware routing over several LLM backends
+
+Each backend (an Ollama host or an Azure OpenAI deployment) keeps an EWMA
+of its latency and error rate plus a circuit breaker. A request goes to
+the healthy backend with the lowest expected latency and fails over to
+the next one on errors. A non-streaming call that is still running after
+the backend's observed p95 latency is hedged: the same request is sent to
+the next backend, the first answer wins and the other call is cancelled
+(freeing its micro-batcher slot before the answer is returned). Backends
+whose micro-batcher has no free slot are not hedged to: the copy would
+only queue behind other users' requests.
+
+Streams fail over only until their first chunk and are never hedged, as
+the user would otherwise see two replies mixed into one message.
+
+A breaker opens after `failure_threshold` consecutive failures. After
+`reset_timeout` seconds one probe request is let through (half-open) and
+its outcome closes or re-opens the breaker.
+
+`observe(stage, seconds, provider, status)`, if given, is called with the
+duration of every attempt ("llm_total") and the first chunk of every
+stream ("llm_first_token"), e.g. to feed latency histograms.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+ERROR_PENALTY = 4.0  # score = latency * (1 + ERROR_PENALTY * error rate)
+
+
+class NoBackendAvailable(Exception):
+    """Every backend is failing or has an open circuit breaker"""
+
+
+def is_retryable(error):
+    """Whether another backend might succeed where this error occurred
+
+    Client errors (bad request, content filter, auth) would fail the same
+    way everywhere, so they are neither retried nor counted against the
+    backend; 408/429 and 5xx are.
+    """
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status is None or status >= 500 or status in (408, 429)
+
+
+def _status_label(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return str(status) if status is not None else type(error).__name__
+
+
+class LatencyStats:
+    """EWMA latency plus a window of recent samples for percentiles"""
+
+    def __init__(self, alpha=0.2, window=200):
+        self.alpha = alpha
+        self.ewma = None
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.ewma = seconds if self.ewma is None else self.ewma + self.alpha * (seconds - self.ewma)
+        self.samples.append(seconds)
+
+    def percentile(self, pct, min_samples=20):
+        """The pct-th percentile of recent samples, None until there are enough"""
+        if len(self.samples) < min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class CircuitBreaker:
+    """closed -> open after repeated failures -> half-open probe -> closed/open"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def available(self):
+        """Whether a request could be sent now (without claiming the half-open probe)"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and not self._probing)
+
+    def acquire(self):
+        """Claim permission to send a request; in half-open state only one probe passes"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self):
+        """Give back a probe whose request ended without an outcome (cancelled, or rejected as invalid)"""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing or self.failures >= self.failure_threshold:
+            self.opened_at = self.clock()
+        self._probing = False
+
+
+class Backend:
+    """One LLM endpoint: coroutine `chat(messages) -> str` and optional async generator `stream(messages)`
+
+    `warm_up()`, if given, is awaited before the first request to load the
+    client and open a connection. `saturated()`, if given, says whether a
+    request would now have to queue for capacity (a full micro-batcher).
+    """
+
+    def __init__(self, name, model, chat, stream=None, kind="", warm_up=None, saturated=None):
+        self.name = name
+        self.model = model
+        self.kind = kind
+        self.chat = chat
+        self.stream = stream
+        self.warm_up = warm_up
+        self.saturated = saturated or (lambda: False)
+        self.breaker = None
+        self.latency = {"chat": None, "stream": None}
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+
+
+class LLMRouter:
+    """Sends each request to the fastest healthy backend, with failover, hedging and circuit breakers"""
+
+    def __init__(self, backends, hedging=True, hedge_min_delay=0.5, alpha=0.2, explore=0.05,
+                 failure_threshold=5, reset_timeout=30.0, clock=time.monotonic, rng=random.random, observe=None):
+        if not backends:
+            raise ValueError("LLMRouter needs at least one backend")
+        self.backends = backends
+        self.hedging = hedging
+        self.hedge_min_delay = hedge_min_delay
+        self.alpha = alpha
+        self.explore = explore
+        self.clock = clock
+        self.rng = rng
+        self.observe = observe
+        self.stats = {"hedged": 0, "hedge_wins": 0, "failovers": 0}
+        for backend in backends:
+            backend.breaker = CircuitBreaker(failure_threshold, reset_timeout, clock)
+            backend.latency = {"chat": LatencyStats(alpha), "stream": LatencyStats(alpha)}
+        self.model = "|".join(sorted({backend.model for backend in backends}))
+
+    async def _attempt(self, backend, messages):
+        backend.requests += 1
+        start = self.clock()
+        try:
+            reply = await backend.chat(messages)
+        except asyncio.CancelledError:
+            backend.breaker.release()
+            self._observe("llm_total", self.clock() - start, backend, "cancelled")
+            raise
+        except Exception as e:
+            if is_retryable(e):
+                self._record_failure(backend, e)
+            else:
+                # A rejected request says nothing about the backend's health: only give the probe back
+                backend.breaker.release()
+            self._observe("llm_total", self.clock() - start, backend, _status_label(e))
+            raise
+        latency = self.clock() - start
+        self._record_success(backend, "chat", latency)
+        self._observe("llm_total", latency, backend, "ok")
+        return reply
+
+    async def chat(self, messages):
+        """Return the reply of the first backend that answers successfully"""
+        queue = self._candidates("chat")
+        pending = {}  # task -> backend
+        last_error = None
+        hedged = False
+
+        def launch(hedge=False):
+            for backend in list(queue):
+                if hedge and backend.saturated():
+                    continue  # still there to fail over to
+                queue.remove(backend)
+                if backend.breaker.acquire():
+                    pending[asyncio.ensure_future(self._attempt(backend, messages))] = backend
+                    return backend
+            return None
+
+        primary = launch()
+        try:
+            while pending:
+                delay = None
+                if self.hedging and not hedged and queue and len(pending) == 1:
+                    delay = self._hedge_delay(primary)
+                done, _ = await asyncio.wait(pending, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if launch(hedge=True) is not None:
+                        self.stats["hedged"] += 1
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    error = task.exception()
+                    if error is None:
+                        if backend is not primary:
+                            self.stats["hedge_wins" if hedged else "failovers"] += 1
+                        return task.result()
+                    if not is_retryable(error):
+                        raise error
+                    last_error = error
+                if not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                # Let the losers unwind now: their batcher slots and breaker probes are free once this returns
+                await asyncio.wait(pending)
+                for task in pending:
+                    if not task.cancelled():
+                        task.exception()  # retrieved: _attempt already recorded it
+        raise last_error or NoBackendAvailable("No LLM backend available")
+
+    async def stream(self, messages):
+        """Yield reply chunks, failing over to the next backend until the first chunk arrived"""
+        last_error = None
+        for index, backend in enumerate(self._candidates("stream")):
+            if not backend.breaker.acquire():
+                continue
+            backend.requests += 1
+            start = self.clock()
+            latency = None
+            try:
+                async for chunk in backend.stream(messages):
+                    if latency is None:
+                        latency = self.clock() - start
+                        self._observe("llm_first_token", latency, backend, "ok")
+                    yield chunk
+            except (asyncio.CancelledError, GeneratorExit):
+                backend.breaker.release()
+                self._observe("llm_total", self.clock() - start, backend, "cancelled")
+                raise
+            except Exception as e:
+                self._observe("llm_total", self.clock() - start, backend, _status_label(e))
+                if not is_retryable(e):
+                    # A rejected request says nothing about the backend's health: only give the probe back
+                    backend.breaker.release()
+                    raise
+                self._record_failure(backend, e)
+                if latency is not None:
+                    raise
+                last_error = e
+                continue
+            self._record_success(backend, "stream", latency)
+            self._observe("llm_total", self.clock() - start, backend, "ok")
+            if index:
+                self.stats["failovers"] += 1
+            return
+        raise last_error or NoBackendAvailable("No LLM backend available")
+
+    def _score(self, backend, mode):
+        # Backends without measurements sort first, so new ones get probed
+        latency = backend.latency[mode].ewma
+        if latency is None:
+            return 0.0
+        return latency * (1 + ERROR_PENALTY * backend.error_rate)
+
+    def _candidates(self, mode):
+        """Available backends, best first; occasionally a random one first to keep estimates fresh"""
+        candidates = [b for b in self.backends if (mode == "chat" or b.stream) and b.breaker.available()]
+        candidates.sort(key=lambda b: self._score(b, mode))
+        if len(candidates) > 1 and self.rng() < self.explore:
+            candidates.insert(0, candidates.pop(int(self.rng() * (len(candidates) - 1)) + 1))
+        return candidates
+
+    def _record_success(self, backend, mode, latency):
+        if latency is not None:
+            backend.latency[mode].observe(latency)
+        backend.error_rate -= self.alpha * backend.error_rate
+        backend.breaker.record_success()
+
+    def _record_failure(self, backend, error):
+        backend.failures += 1
+        backend.error_rate += self.alpha * (1.0 - backend.error_rate)
+        backend.breaker.record_failure()
+        logger.warning(f"LLM backend {backend.name} failed: {error!r} (breaker {backend.breaker.state})")
+
+    def _observe(self, stage, seconds, backend, status):
+        if self.observe is not None:
+            self.observe(stage, seconds, backend.name, status)
+
+    def _hedge_delay(self, backend):
+        p95 = backend.latency["chat"].percentile(95)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def snapshot(self):
+        """Per-backend health and latency, e.g. for the health endpoint"""
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 1)
+
+        return dict(self.stats, backends=[
+            {
+                "name": backend.name,
+                "state": backend.breaker.state,
+                "latency_ms": ms(backend.latency["chat"].ewma),
+                "p95_ms": ms(backend.latency["chat"].percentile(95)),
+                "first_chunk_ms": ms(backend.latency["stream"].ewma),
+                "error_rate": round(backend.error_rate, 3),
+                "requests": backend.requests,
+                "failures": backend.failures
+            }
+            for backend in self.backends
+        ])
@@ -0,0 +1,309 @@
+"""
+Latency tracing and Prometheus-style metrics
+
+Stages of a request (JSON parse, token acquisition, history lookup, LLM
+time to first token and total, Connector post) are timed with
+`tracer.span(stage)` and land in one histogram labelled by stage,
+provider and status. `tracer.trace(name)` (or the `@tracer.traced(name)`
+decorator) wraps a whole request: it collects the request's spans and
+logs them as one JSON line when the request was slower than `slow_ms`. MetricsRegistry.render() produces the
+Prometheus text format for a /metrics route.
+
+With OpenTelemetry installed, enable_opentelemetry() additionally exports
+every span through OTLP (endpoint and headers from the standard OTEL_*
+environment variables).
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _response_status(result):
+    """HTTP status of a view's return value (response object or Flask-style tuple)"""
+    if isinstance(result, tuple) and len(result) > 1 and isinstance(result[1], int):
+        return result[1]
+    return getattr(result, "status_code", "ok")
+
+
+def _error_status(error):
+    """Status label of a failed stage: the HTTP status if the error carries one"""
+    if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return str(status) if status is not None else "error"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at render time
+
+    The callback may also return a dict (e.g. a component's `stats`); its
+    numeric entries become one series each, labelled with `labelname`.
+    """
+
+    def __init__(self, name, help, read, labelname="key"):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelname = labelname
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} failed: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if isinstance(value, dict):
+            for key, item in sorted(value.items()):
+                if isinstance(item, (int, float)) and not isinstance(item, bool):
+                    lines.append(f"{self.name}{_labels((self.labelname,), (key,))} {item}")
+        elif value is not None:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), series[:-2] + [None]):
+                    cumulative = series[-1] if count is None else cumulative + count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, read, labelname="key"):
+        return self._register(Gauge(name, help, read, labelname))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Spans of the request being handled in the current context (task or thread)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    __slots__ = ("stage", "provider", "status", "attributes")
+
+    def __init__(self, stage, provider="", attributes=None):
+        self.stage = stage
+        self.provider = provider
+        self.status = "ok"
+        self.attributes = attributes or {}
+
+    def set(self, **attributes):
+        """Set status/provider or extra attributes while the span is open"""
+        for name in ("status", "provider"):
+            if name in attributes:
+                setattr(self, name, str(attributes.pop(name)))
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Times request stages into histograms (and OpenTelemetry spans when enabled)"""
+
+    def __init__(self, registry=REGISTRY, slow_ms=None, clock=time.perf_counter):
+        self.slow_ms = slow_ms
+        self.clock = clock
+        self.stage_seconds = registry.histogram(
+            "bot_stage_duration_seconds", "Duration of request stages", ("stage", "provider", "status")
+        )
+        self.request_seconds = registry.histogram(
+            "bot_request_duration_seconds", "Duration of whole requests", ("route", "status")
+        )
+        self._otel = None
+
+    def enable_opentelemetry(self, service_name="teams-bot"):
+        """Export spans through OTLP if the OpenTelemetry SDK and exporter are installed"""
+        try:
+            from opentelemetry import trace
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        except ImportError:
+            logger.warning("OpenTelemetry SDK/OTLP exporter not installed - spans are not exported")
+            return False
+        provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        self._otel = trace.get_tracer("bot_core.metrics")
+        return True
+
+    def _record(self, stage, seconds, provider, status):
+        self.stage_seconds.observe(seconds, stage=stage, provider=provider, status=status)
+        spans = _current_trace.get()
+        if spans is not None:
+            spans.append({"stage": stage, "provider": provider, "status": status, "ms": round(seconds * 1000, 1)})
+
+    @contextmanager
+    def span(self, stage, provider="", **attributes):
+        """Time a block as one stage; an exception sets its status (HTTP status or "error") unless set otherwise"""
+        span = Span(stage, provider, attributes)
+        otel = self._otel.start_as_current_span(stage) if self._otel else None
+        otel_span = otel.__enter__() if otel else None
+        start = self.clock()
+        try:
+            yield span
+        except BaseException as e:
+            if span.status == "ok":
+                span.status = _error_status(e)
+            raise
+        finally:
+            seconds = self.clock() - start
+            self._record(stage, seconds, span.provider, span.status)
+            if otel:
+                otel_span.set_attributes({"provider": span.provider, "status": span.status, **{
+                    name: value for name, value in span.attributes.items() if isinstance(value, (str, bool, int, float))
+                }})
+                otel.__exit__(None, None, None)
+
+    def observe(self, stage, seconds, provider="", status="ok"):
+        """Record a stage that was timed elsewhere (e.g. by the LLM router)"""
+        self._record(stage, seconds, provider, status)
+        if self._otel:
+            end = time.time_ns()
+            otel_span = self._otel.start_span(stage, start_time=end - int(seconds * 1e9))
+            otel_span.set_attributes({"provider": provider, "status": status})
+            otel_span.end(end_time=end)
+
+    @contextmanager
+    def trace(self, route, **attributes):
+        """Wrap a whole request: time it and collect its spans for the slow-request log"""
+        spans = []
+        token = _current_trace.set(spans)
+        span = Span(route, attributes=attributes)
+        start = self.clock()
+        try:
+            yield span
+        except BaseException:
+            if span.status == "ok":
+                span.status = "error"
+            raise
+        finally:
+            _current_trace.reset(token)
+            seconds = self.clock() - start
+            self.request_seconds.observe(seconds, route=route, status=span.status)
+            if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+                logger.warning("Slow request: " + json.dumps({
+                    "trace_id": uuid.uuid4().hex[:16],
+                    "route": route,
+                    "status": span.status,
+                    "total_ms": round(seconds * 1000, 1),
+                    "spans": spans,
+                    **span.attributes
+                }, ensure_ascii=False, default=str))
+
+    def traced(self, route):
+        """Decorator running a (sync or async) handler inside trace(route), labelled with the response status"""
+        def decorate(handler):
+            if inspect.iscoroutinefunction(handler):
+                @functools.wraps(handler)
+                async def wrapper(*args, **kwargs):
+                    with self.trace(route) as span:
+                        result = await handler(*args, **kwargs)
+                        span.set(status=_response_status(result))
+                        return result
+            else:
+                @functools.wraps(handler)
+                def wrapper(*args, **kwargs):
+                    with self.trace(route) as span:
+                        result = handler(*args, **kwargs)
+                        span.set(status=_response_status(result))
+                        return result
+            return wrapper
+        return decorate
@@ -0,0 +1,604 @@
+"""
+Proactive notifications: conversation references and resumable broadcast jobs
+
+The bot can only post into a conversation it knows the reference of (the
+Connector's service URL and the conversation id). ConversationRegistry
+keeps one row per personal (1:1) conversation, recorded from every
+incoming Activity: the service URL (stored once per distinct URL), the
+tenant, the user's AAD object id and the domain of their UPN, with
+indexes for selecting by tenant, domain or users. A reference already
+written within `refresh` seconds is skipped in memory, so the messages of
+an active conversation cost no write.
+
+A broadcast is a job in the same SQLite file. Creating it snapshots the
+selected conversations into the job's target list; a runner then posts
+the activity to each through the connector's OutboundSender (the same
+bot-wide rate limits, retries and dead-letter log as every other send),
+`concurrency` sends in flight, and writes the outcome of each target back
+once per `flush_interval`. The process running a job holds a lease that
+those writes renew; a job whose runner died (or stopped with pending
+targets) is picked up again, within `lease` seconds, by any process using
+the file, and only its pending targets are sent. A crash can therefore
+repeat the sends of the last flush interval, never skip one.
+
+The resuming watcher and the runners are tasks on the loop that first
+calls start(), record() or an endpoint; the SQLite reads and writes run
+on threads, off the loop.
+handle_request() and progress() are the /notify endpoint minus HTTP; the
+caller authenticates with `Authorization: Bearer <api key>`.
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from bot_core.connector import activities_url
+from bot_core.engine import BOT_NAME, EngineResponse
+from bot_core.metrics import Tracer
+from bot_core.structured_log import StructuredLogger
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "teams_bot_notify.db")
+
+# Teams conversation types a user can be notified in ("" when the channel does not say, e.g. the Emulator)
+PERSONAL_CONVERSATION_TYPES = {"personal", ""}
+
+# States of a job's targets
+PENDING, SENT, FAILED = 0, 1, 2
+
+# Most SQLite host parameters per statement on older builds is 999
+_CHUNK = 500
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class ConversationRegistry:
+    """Conversation references of the users the bot can notify, in a local SQLite file (WAL mode, safe across processes)"""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, refresh=86400, max_cached=100000, clock=time.monotonic):
+        self.path = path
+        self.refresh = refresh
+        self.max_cached = max_cached
+        self.clock = clock
+        self.stats = {"recorded": 0, "unchanged": 0, "not_personal": 0, "record_errors": 0}
+        self._recent = OrderedDict()  # conversation_id -> (reference, recorded at)
+        self._service_urls = {}  # url -> id
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS service_urls (id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            " conversation_id TEXT PRIMARY KEY,"
+            " service_url INTEGER NOT NULL,"
+            " tenant_id TEXT NOT NULL,"
+            " aad_object_id TEXT NOT NULL,"
+            " domain TEXT NOT NULL,"
+            " updated REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_tenant ON conversations (tenant_id, domain)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_domain ON conversations (domain)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS conversations_user ON conversations (aad_object_id)")
+
+    def _service_url_id(self, url):
+        url_id = self._service_urls.get(url)
+        if url_id is None:
+            self._conn.execute("INSERT OR IGNORE INTO service_urls (url) VALUES (?)", (url,))
+            url_id = self._service_urls[url] = self._conn.execute(
+                "SELECT id FROM service_urls WHERE url = ?", (url,)
+            ).fetchone()[0]
+        return url_id
+
+    def record(self, activity):
+        """Remember the reference of the Activity's conversation if it is a personal one
+
+        Fails open: an unavailable file only costs the reference.
+        """
+        reference = self.pending(activity)
+        if reference is not None:
+            self.store(activity.conversation_id, reference)
+
+    def pending(self, activity):
+        """The reference of the Activity's conversation if it must be written, None if not personal or unchanged"""
+        if not activity.conversation_id or not activity.service_url:
+            return None
+        if activity.conversation_type not in PERSONAL_CONVERSATION_TYPES:
+            self.stats["not_personal"] += 1
+            return None
+        reference = (activity.service_url, activity.tenant_id, activity.aad_object_id, activity.domain.lower())
+        with self._lock:
+            recent = self._recent.get(activity.conversation_id)
+            if recent is not None and recent[0] == reference and self.clock() - recent[1] < self.refresh:
+                self.stats["unchanged"] += 1
+                return None
+        return reference
+
+    def store(self, conversation_id, reference):
+        """Write a conversation reference (service URL, tenant, user, domain)"""
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO conversations (conversation_id, service_url, tenant_id, aad_object_id, domain, updated)"
+                    " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (conversation_id) DO UPDATE SET"
+                    " service_url = excluded.service_url, tenant_id = excluded.tenant_id,"
+                    " aad_object_id = excluded.aad_object_id, domain = excluded.domain, updated = excluded.updated",
+                    (conversation_id, self._service_url_id(reference[0]), *reference[1:], time.time())
+                )
+            except sqlite3.Error as e:
+                self.stats["record_errors"] += 1
+                logger.warning(f"Conversation registry unavailable: {e}")
+                return
+            self.stats["recorded"] += 1
+            self._recent[conversation_id] = (reference, self.clock())
+            self._recent.move_to_end(conversation_id)
+            while len(self._recent) > self.max_cached:
+                self._recent.popitem(last=False)
+
+    def select(self, tenant=None, domain=None, users=None):
+        """(conversation_id, service_url) of the conversations matching every given selector
+
+        `users` is a list of AAD object ids; the conversations of the users not
+        in the registry are simply not selected.
+        """
+        conditions, params = [], []
+        if tenant:
+            conditions.append("c.tenant_id = ?")
+            params.append(tenant)
+        if domain:
+            conditions.append("c.domain = ?")
+            params.append(domain.lower())
+        query = "SELECT c.conversation_id, u.url FROM conversations c JOIN service_urls u ON u.id = c.service_url"
+        with self._lock:
+            if users is None:
+                where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+                return self._conn.execute(query + where, params).fetchall()
+            users = list(dict.fromkeys(users))
+            rows = []
+            for start in range(0, len(users), _CHUNK):
+                chunk = users[start:start + _CHUNK]
+                where = " AND ".join(conditions + [f"c.aad_object_id IN ({', '.join('?' * len(chunk))})"])
+                rows += self._conn.execute(f"{query} WHERE {where}", params + chunk).fetchall()
+            return rows
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+class JobStore:
+    """Broadcast jobs and the outcome of each of their targets, in the registry's SQLite file"""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, retention=7 * 86400):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = _connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " activity TEXT NOT NULL,"
+            " selector TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " total INTEGER NOT NULL,"
+            " sent INTEGER NOT NULL DEFAULT 0,"
+            " failed INTEGER NOT NULL DEFAULT 0,"
+            " created REAL NOT NULL,"
+            " started REAL,"
+            " updated REAL NOT NULL,"
+            " owner TEXT,"
+            " heartbeat REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, heartbeat)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_targets ("
+            " job_id TEXT NOT NULL,"
+            " seq INTEGER NOT NULL,"
+            " conversation_id TEXT NOT NULL,"
+            " service_url TEXT NOT NULL,"
+            " state INTEGER NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (job_id, seq)) WITHOUT ROWID"
+        )
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = work()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def create(self, activity, selector, targets):
+        """Store a new job for `targets` [(conversation_id, service_url)], returning its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+
+        def work():
+            # Finished jobs are kept for `retention` seconds
+            expired = [row[0] for row in self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'done' AND updated < ?", (now - self.retention,)
+            )]
+            for expired_id in expired:
+                self._conn.execute("DELETE FROM job_targets WHERE job_id = ?", (expired_id,))
+                self._conn.execute("DELETE FROM jobs WHERE job_id = ?", (expired_id,))
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, activity, selector, status, total, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, json.dumps(activity, ensure_ascii=False), json.dumps(selector, ensure_ascii=False),
+                 "queued" if targets else "done", len(targets), now, now)
+            )
+            self._conn.executemany(
+                "INSERT INTO job_targets (job_id, seq, conversation_id, service_url) VALUES (?, ?, ?, ?)",
+                ((job_id, seq, conversation_id, service_url) for seq, (conversation_id, service_url) in enumerate(targets))
+            )
+
+        self._transaction(work)
+        return job_id
+
+    def claim(self, job_id, owner, lease):
+        """Take over an unfinished job that nobody else holds a live lease on
+
+        Returns (activity, pending targets [(seq, conversation_id, service_url)]),
+        or None if the job is finished or running elsewhere.
+        """
+        now = time.time()
+
+        def work():
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat = ?, started = COALESCE(started, ?)"
+                " WHERE job_id = ? AND status != 'done' AND (owner IS NULL OR owner = ? OR heartbeat < ?)",
+                (owner, now, now, job_id, owner, now - lease)
+            )
+            if cursor.rowcount == 0:
+                return None
+            activity = self._conn.execute("SELECT activity FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+            targets = self._conn.execute(
+                "SELECT seq, conversation_id, service_url FROM job_targets WHERE job_id = ? AND state = ? ORDER BY seq",
+                (job_id, PENDING)
+            ).fetchall()
+            return json.loads(activity), targets
+
+        return self._transaction(work)
+
+    def record(self, job_id, owner, results):
+        """Write the outcomes [(seq, delivered)] of a job's sends and renew the lease
+
+        Returns False if the job is no longer held by `owner` (its lease
+        expired and another process took it over).
+        """
+        now = time.time()
+
+        def work():
+            sent = sum(1 for _, delivered in results if delivered)
+            cursor = self._conn.execute(
+                "UPDATE jobs SET sent = sent + ?, failed = failed + ?, updated = ?, heartbeat = ?"
+                " WHERE job_id = ? AND owner = ?",
+                (sent, len(results) - sent, now, now, job_id, owner)
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._conn.executemany(
+                "UPDATE job_targets SET state = ? WHERE job_id = ? AND seq = ?",
+                ((SENT if delivered else FAILED, job_id, seq) for seq, delivered in results)
+            )
+            return True
+
+        return self._transaction(work)
+
+    def release(self, job_id, owner):
+        """Give a job up: done once no target is pending, otherwise free for any process to resume"""
+        now = time.time()
+
+        def work():
+            self._conn.execute(
+                "UPDATE jobs SET owner = NULL, heartbeat = NULL, updated = ?,"
+                " status = CASE WHEN sent + failed >= total THEN 'done' ELSE 'queued' END"
+                " WHERE job_id = ? AND owner = ?",
+                (now, job_id, owner)
+            )
+            # Delivered targets are no longer needed; failed ones stay for inspection
+            self._conn.execute(
+                "DELETE FROM job_targets WHERE job_id = ? AND state = ?"
+                " AND (SELECT status FROM jobs WHERE job_id = ?) = 'done'",
+                (job_id, SENT, job_id)
+            )
+
+        self._transaction(work)
+
+    def orphans(self, lease):
+        """Ids of unfinished jobs nobody holds a live lease on"""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status != 'done' AND (owner IS NULL OR heartbeat < ?) ORDER BY created",
+                (time.time() - lease,)
+            )]
+
+    def get(self, job_id):
+        """Progress of a job as a dict, None if there is no such job"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, selector, status, total, sent, failed, created, started, updated FROM jobs"
+                " WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return self._progress(row) if row else None
+
+    def recent(self, limit=20):
+        """Progress of the most recently created jobs"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id, selector, status, total, sent, failed, created, started, updated FROM jobs"
+                " ORDER BY created DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [self._progress(row) for row in rows]
+
+    @staticmethod
+    def _progress(row):
+        job_id, selector, status, total, sent, failed, created, started, updated = row
+        pending = total - sent - failed
+        progress = {"job_id": job_id, "status": status, "selector": json.loads(selector), "total": total,
+                    "sent": sent, "failed": failed, "pending": pending, "created": created, "started": started,
+                    "updated": updated, "eta_seconds": None}
+        done = sent + failed
+        if status == "running" and done and pending:
+            # At the rate so far
+            progress["eta_seconds"] = round((updated - started) / done * pending, 1)
+        return progress
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status != 'done'").fetchone()[0]
+
+
+class Notifier:
+    """Proactive notifications; runs on the bot's event loop"""
+
+    def __init__(self, connector, path=DEFAULT_SQLITE_PATH, api_key="", concurrency=50, lease=60, flush_interval=1.0,
+                 bot_name=BOT_NAME, tracer=None, log=None):
+        self.connector = connector
+        self.api_key = api_key
+        self.concurrency = concurrency
+        self.lease = lease
+        self.flush_interval = flush_interval
+        self.bot_name = bot_name
+        self.tracer = tracer or Tracer()
+        self.log = log or StructuredLogger(__name__)
+        self.registry = ConversationRegistry(path or DEFAULT_SQLITE_PATH)
+        self.jobs = JobStore(path or DEFAULT_SQLITE_PATH)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.stats = {"jobs": 0, "resumed": 0, "sent": 0, "failed": 0, "unauthorized": 0, "invalid": 0}
+        self._running = set()  # ids of the jobs this process is sending
+        self._lost = set()  # ids of running jobs whose lease another process took over
+        self._closed = threading.Event()
+        self._claim_lock = threading.Lock()
+        self._tasks = set()
+        self._watcher = None
+
+    def start(self):
+        """Resume orphaned jobs now and then on the running loop (idempotent)"""
+        if self._watcher is None and not self._closed.is_set():
+            self._watcher = asyncio.get_running_loop().create_task(self._watch(), name="notify-watcher")
+
+    async def record(self, activity):
+        """Record the Activity's conversation reference; a new or changed one is written on a thread"""
+        reference = self.registry.pending(activity)
+        if reference is not None:
+            await asyncio.to_thread(self.registry.store, activity.conversation_id, reference)
+        self.start()
+
+    async def handle_request(self, content_type, data, authorization=None):
+        """The /notify POST endpoint minus HTTP: authenticate, create the job, start sending; 202 with its progress"""
+        if not self.authorized(authorization):
+            return EngineResponse(401)
+        activity, selector = self.parse(content_type, data)
+        if activity is None:
+            return selector
+        self.start()
+        progress = await asyncio.to_thread(self.create, activity, selector)
+        self._launch(progress["job_id"])
+        return EngineResponse(202, progress)
+
+    def _launch(self, job_id, resumed=False):
+        task = asyncio.get_running_loop().create_task(self._run(job_id, resumed), name=f"notify-{job_id[:8]}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _watch(self):
+        while not self._closed.is_set():
+            try:
+                for job_id in await asyncio.to_thread(self.jobs.orphans, self.lease):
+                    if job_id not in self._running:
+                        self._launch(job_id, resumed=True)
+            except sqlite3.Error as e:
+                self.log.warning("notify_watch_failed", error=str(e))
+            await asyncio.sleep(self.lease / 3)
+
+    async def _run(self, job_id, resumed):
+        # The job store is SQLite: its calls run on a thread, off the event loop
+        claimed = await asyncio.to_thread(self._claim, job_id, resumed)
+        if claimed is None:
+            return
+        activity, targets = claimed
+        started = time.monotonic()
+        results = []
+        pending = iter(targets)
+
+        async def worker():
+            for seq, conversation_id, service_url in pending:
+                if self._stopping(job_id):
+                    return
+                try:
+                    delivered = await self.connector.outbound.send(
+                        "POST", activities_url(service_url, conversation_id), activity, conversation_id, broadcast=True
+                    ) is not None
+                except Exception as e:
+                    delivered = self._send_failed(job_id, conversation_id, e)
+                self._sent(results, seq, delivered)
+
+        try:
+            workers = asyncio.gather(*(worker() for _ in range(max(1, min(self.concurrency, len(targets))))))
+            while not workers.done():
+                await asyncio.wait((workers,), timeout=self.flush_interval)
+                await asyncio.to_thread(self._flush, job_id, results)
+        finally:
+            if results:
+                await asyncio.to_thread(self._flush, job_id, results)
+            await asyncio.to_thread(self._finish, job_id, started)
+
+    def close(self):
+        """Stop sending; unfinished jobs are resumed by the next process"""
+        self._closed.set()
+        if self._watcher is not None:
+            self._watcher.cancel()
+
+    async def drain(self, timeout=10.0):
+        """Wait for the runners stopped by close() to write their progress; False if some are still running"""
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+        return not self._tasks
+
+    def make_activity(self, text, attachments=None):
+        """The message Activity posted to every target"""
+        activity = {"type": "message", "text": text, "from": {"id": self.connector.app_id, "name": self.bot_name}}
+        if attachments:
+            activity["attachments"] = attachments
+        return activity
+
+    def authorized(self, authorization):
+        """Whether the Authorization header carries the API key (never, while no key is configured)"""
+        scheme, _, key = (authorization or "").partition(" ")
+        if self.api_key and scheme.lower() == "bearer" and hmac.compare_digest(key.strip().encode(), self.api_key.encode()):
+            return True
+        self.stats["unauthorized"] += 1
+        self.log.warning("notify_unauthorized", configured=bool(self.api_key))
+        return False
+
+    def _invalid(self, reason):
+        self.stats["invalid"] += 1
+        self.log.warning("notify_invalid", reason=reason)
+        return EngineResponse(400, {"error": reason})
+
+    def parse(self, content_type, data):
+        """(activity, selector) from a /notify request body, or (None, the EngineResponse refusing it)
+
+        The body is {"text": ..., "attachments": [...], "tenant": ..., "domain": ..., "users": [aad object ids]};
+        at least one of tenant, domain and users, which narrow each other.
+        """
+        if "application/json" not in (content_type or ""):
+            return None, EngineResponse(415)
+        try:
+            body = json.loads(data)
+        except ValueError as e:
+            return None, self._invalid(f"invalid JSON: {e}")
+        if not isinstance(body, dict):
+            return None, self._invalid("expected a JSON object")
+        text = body.get("text") or ""
+        attachments = body.get("attachments") or None
+        if not isinstance(text, str) or (attachments is not None and not isinstance(attachments, list)):
+            return None, self._invalid("text must be a string and attachments a list")
+        if not text and not attachments:
+            return None, self._invalid("nothing to send: text or attachments required")
+        selector = {key: body[key] for key in ("tenant", "domain", "users") if body.get(key)}
+        if not selector:
+            return None, self._invalid("no target: tenant, domain or users required")
+        if not all(isinstance(selector.get(key, ""), str) for key in ("tenant", "domain")):
+            return None, self._invalid("tenant and domain must be strings")
+        users = selector.get("users")
+        if users is not None and not (isinstance(users, list) and all(isinstance(user, str) for user in users)):
+            return None, self._invalid("users must be a list of AAD object ids")
+        return self.make_activity(text, attachments), selector
+
+    def create(self, activity, selector):
+        """Snapshot the selected conversations into a new job; returns its progress"""
+        with self.tracer.span("notify_select"):
+            targets = self.registry.select(**selector)
+            job_id = self.jobs.create(activity, selector, targets)
+        self.stats["jobs"] += 1
+        self.log.info("notify_job_created", job_id=job_id, targets=len(targets), **{
+            key: value for key, value in selector.items() if key != "users"}, users=len(selector.get("users", ())))
+        return self.jobs.get(job_id)
+
+    async def progress(self, job_id, authorization):
+        """The /notify GET endpoint minus HTTP: one job's progress, or the recent jobs without an id"""
+        self.start()
+        if not self.authorized(authorization):
+            return EngineResponse(401)
+        # The job store and the registry are SQLite files: read them on a thread
+        if job_id is None:
+            jobs = await asyncio.to_thread(self.jobs.recent)
+            return EngineResponse(200, {"jobs": jobs, "conversations": await asyncio.to_thread(len, self.registry)})
+        progress = await asyncio.to_thread(self.jobs.get, job_id)
+        return EngineResponse(200, progress) if progress else EngineResponse(404)
+
+    def _claim(self, job_id, resumed):
+        """(activity, pending targets) of a job this process now runs, None if it should not"""
+        with self._claim_lock:
+            if self._closed.is_set() or job_id in self._running:
+                return None
+            claimed = self.jobs.claim(job_id, self.owner, self.lease)
+            if claimed is None:
+                return None
+            self._running.add(job_id)
+        if resumed:
+            self.stats["resumed"] += 1
+            self.log.info("notify_job_resumed", job_id=job_id, pending=len(claimed[1]))
+        return claimed
+
+    def _flush(self, job_id, results):
+        """Write the outcomes collected so far; False once the job's lease is lost"""
+        batch = results[:]
+        del results[:len(batch)]
+        try:
+            if self.jobs.record(job_id, self.owner, batch):
+                return True
+        except sqlite3.Error as e:
+            # Keep sending: the lease may still be renewed by a later flush
+            results[:0] = batch
+            self.log.warning("notify_progress_failed", job_id=job_id, error=str(e))
+            return True
+        self._lost.add(job_id)
+        self.log.warning("notify_lease_lost", job_id=job_id)
+        return False
+
+    def _stopping(self, job_id):
+        return self._closed.is_set() or job_id in self._lost
+
+    def _sent(self, results, seq, delivered):
+        self.stats["sent" if delivered else "failed"] += 1
+        results.append((seq, delivered))
+
+    def _send_failed(self, job_id, conversation_id, error):
+        self.log.error("notify_send_failed", exc_info=True, job_id=job_id, conversation_id=conversation_id,
+                       error=str(error))
+        return False
+
+    def _finish(self, job_id, started):
+        self._running.discard(job_id)
+        if job_id in self._lost:
+            self._lost.discard(job_id)
+            return
+        try:
+            self.jobs.release(job_id, self.owner)
+        except sqlite3.Error as e:
+            self.log.warning("notify_release_failed", job_id=job_id, error=str(e))
+        progress = self.jobs.get(job_id) or {}
+        self.log.info("notify_job_" + ("finished" if progress.get("status") == "done" else "paused"), job_id=job_id,
+                      sent=progress.get("sent"), failed=progress.get("failed"), pending=progress.get("pending"),
+                      seconds=round(time.monotonic() - started, 1))
+
+    def snapshot(self):
+        return dict(self.stats, **self.registry.stats, running=len(self._running))
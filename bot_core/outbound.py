@@ -0,0 +1,220 @@
+"""
+Outbound Bot Connector delivery: rate limits, retries and a dead-letter log
+
+Every send waits for a token from the bucket of its conversation and then
+from the bot-wide bucket, which keeps bursts and broadcasts under the Teams
+throttling limits instead of running into 429s. Failed sends (429, 5xx,
+timeouts, connection errors) are retried with jittered exponential backoff;
+a Retry-After header is honoured and also pauses the conversation (or, for
+broadcasts, the whole bot) for that long, at most `max_delay`. A send that
+still fails, fails with a non-retryable status or is asked to wait longer
+than `max_delay` is appended to the dead-letter log.
+
+`request(method, url, activity)` performs one HTTP call and raises on
+errors (an httpx exception carrying the response); it is a coroutine
+function.
+"""
+
+import asyncio
+import email.utils
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Reservation-based token bucket: reserve() takes a token and says how long to wait for it
+
+    The sliding-window maximum is `capacity + rate` calls in any second.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()  # in the future while blocked
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def reserve(self):
+        now = self.clock()
+        self._refill(now)
+        self.tokens -= 1
+        deficit = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(0.0, self.updated - now + deficit)
+
+    def available(self):
+        """Whether a token could be taken right now"""
+        now = self.clock()
+        self._refill(now)
+        return now >= self.updated and self.tokens >= 1
+
+    def take(self):
+        """Take a token only if one is available right now; False means over the limit"""
+        if not self.available():
+            return False
+        self.tokens -= 1
+        return True
+
+    def block(self, seconds):
+        """Start refilling from empty only after `seconds` (e.g. after a 429)"""
+        now = self.clock()
+        self._refill(now)
+        if now + seconds > self.updated:
+            self.tokens = min(self.tokens, 0)
+            self.updated = now + seconds
+
+    def idle(self):
+        """Whether the bucket is full again, i.e. forgetting it changes nothing"""
+        now = self.clock()
+        return now >= self.updated and self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def _status(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def retry_after(error, now=None):
+    """Seconds from a Retry-After header on the error's response (delta or HTTP date), else None"""
+    response = getattr(error, "response", None)
+    value = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when - (now if now is not None else time.time()))
+
+
+class OutboundSender:
+    """Rate-limited, retrying delivery for a coroutine `request`"""
+
+    def __init__(self, request, global_rate=40.0, global_burst=10, conversation_rate=1.0, conversation_burst=6,
+                 max_attempts=5, base_delay=0.5, max_delay=30.0, dead_letter_path="", max_conversations=10000,
+                 clock=time.monotonic, rng=random.random):
+        self.request = request
+        self.conversation_rate = conversation_rate
+        self.conversation_burst = conversation_burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.dead_letter_path = dead_letter_path
+        self.max_conversations = max_conversations
+        self.clock = clock
+        self.rng = rng
+        self.stats = {"sent": 0, "retried": 0, "throttled": 0, "dead_lettered": 0}
+        self.global_bucket = TokenBucket(global_rate, global_burst, clock)
+        self._buckets = OrderedDict()  # conversation_id -> TokenBucket
+
+    async def send(self, method, url, activity, conversation_id, broadcast=False):
+        """Deliver one activity; returns the response, or None once it was dead-lettered"""
+        attempt = 0
+        while True:
+            attempt += 1
+            await asyncio.sleep(self._bucket(conversation_id).reserve())
+            await asyncio.sleep(self.global_bucket.reserve())
+            try:
+                response = await self.request(method, url, activity)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, conversation_id, broadcast)
+                if delay is None:
+                    self._give_up(method, url, activity, conversation_id, e, attempt)
+                    return None
+                logger.warning(f"Sending activity to {conversation_id} failed ({e}) - retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.stats["sent"] += 1
+            return response
+
+    async def broadcast(self, sends, concurrency=50):
+        """Deliver many (method, url, activity, conversation_id) tuples as fast as the limits allow
+
+        `sends` may be a generator; at most `concurrency` sends are in flight.
+        Returns {"sent": n, "failed": n}.
+        """
+        result = {"sent": 0, "failed": 0}
+        sends = iter(sends)
+
+        async def worker():
+            for method, url, activity, conversation_id in sends:
+                response = await self.send(method, url, activity, conversation_id, broadcast=True)
+                result["sent" if response is not None else "failed"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return result
+
+    def _bucket(self, conversation_id):
+        bucket = self._buckets.get(conversation_id)
+        if bucket is None:
+            # Forget idle conversations first; their buckets are full anyway
+            while len(self._buckets) >= self.max_conversations:
+                oldest, oldest_bucket = next(iter(self._buckets.items()))
+                if not oldest_bucket.idle():
+                    break
+                del self._buckets[oldest]
+            bucket = self._buckets[conversation_id] = TokenBucket(self.conversation_rate, self.conversation_burst, self.clock)
+        self._buckets.move_to_end(conversation_id)
+        return bucket
+
+    def _retry_delay(self, error, attempt, conversation_id, broadcast):
+        """Seconds to wait before the next attempt, or None if the send should be given up"""
+        status = _status(error)
+        if status is not None and status < 500 and status not in (408, 429):
+            return None
+        delay = retry_after(error)
+        if status == 429:
+            self.stats["throttled"] += 1
+            pause = delay if delay is not None else self.base_delay * 2 ** attempt
+            (self.global_bucket if broadcast else self._bucket(conversation_id)).block(min(pause, self.max_delay))
+        if attempt >= self.max_attempts:
+            return None
+        if delay is not None and delay > self.max_delay:
+            # Waiting that long would hold the request (or a broadcast worker) for minutes: dead-letter it instead
+            logger.warning(f"Retry-After of {delay:.0f}s for {conversation_id} exceeds {self.max_delay:.0f}s - giving up")
+            return None
+        self.stats["retried"] += 1
+        if delay is None:
+            # Full jitter keeps retries of a burst from arriving together
+            delay = self.rng() * min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay
+
+    def _give_up(self, method, url, activity, conversation_id, error, attempts):
+        self.stats["dead_lettered"] += 1
+        body = getattr(getattr(error, "response", None), "text", "")
+        logger.error(f"Failed to send activity to {conversation_id} after {attempts} attempt(s): {error}"
+                     + (f" - Response: {body}" if body else ""))
+        if not self.dead_letter_path:
+            return
+        record = {
+            "time": time.time(),
+            "method": method,
+            "url": url,
+            "conversation_id": conversation_id,
+            "activity": activity,
+            "status": _status(error),
+            "error": str(error),
+            "attempts": attempts
+        }
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write dead letter: {e}")
+
+    def snapshot(self):
+        """Counters plus the number of tracked conversations"""
+        return dict(self.stats, conversations=len(self._buckets))
@@ -0,0 +1,92 @@
+"""
+Provider client registry with config hot-reload
+
+Creating an SDK client per message throws away its connection pool and
+TLS sessions. The registry keeps one client per provider slot and only
+rebuilds it when the slot's configuration tuple (e.g. endpoint, key,
+api_version) changes. SettingsWatcher reloads local.settings.json into the
+environment when its mtime changes, so config edits still take effect
+without a restart.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderRegistry:
+    """One client per provider slot, rebuilt only when its config changes
+
+    `factories` maps a slot name to a callable that builds a client from
+    the config tuple; slots of the same kind of client (one per endpoint)
+    pass `kind` to share a factory. A replaced client is not closed: requests
+    of other threads (or tasks) may still be using it, so it is dropped and
+    its connections go when the last of them lets go of it.
+    """
+
+    def __init__(self, factories):
+        self.factories = factories
+        self.builds = 0
+        self._clients = {}  # slot -> (config, client)
+        self._lock = threading.Lock()
+
+    def get(self, slot, config, kind=None):
+        entry = self._clients.get(slot)
+        if entry is not None and entry[0] == config:
+            return entry[1]
+        with self._lock:
+            entry = self._clients.get(slot)
+            if entry is not None and entry[0] == config:
+                return entry[1]
+            client = self.factories[kind or slot](*config)
+            self._clients[slot] = (config, client)
+            self.builds += 1
+            if entry is not None:
+                logger.info(f"Configuration of {slot} changed - client rebuilt")
+            return client
+
+
+class SettingsWatcher:
+    """Loads the Values of a local.settings.json into os.environ, again whenever the file changes
+
+    The file is stat()-ed at most once per `check_interval` seconds.
+    """
+
+    def __init__(self, path, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        """Reload the file if it changed; returns True when values were (re)loaded"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                return False
+            if mtime == self._mtime:
+                return False
+            try:
+                with open(self.path, 'r') as f:
+                    settings = json.load(f)
+            except Exception as e:
+                logger.warning(f"Failed to load {self.path}: {e}")
+                return False
+            # Load ALL values, overwriting if needed (empty values are skipped)
+            for key, value in settings.get('Values', {}).items():
+                if value:
+                    os.environ[key] = str(value)
+            if self._mtime is not None:
+                logger.info(f"{os.path.basename(self.path)} changed - settings reloaded")
+            self._mtime = mtime
+            return True
@@ -0,0 +1,124 @@
+"""
+LLM provider calls shared by the hosts: Ollama /api/chat and /api/embed, Azure OpenAI chat completions
+
+Request parameters, timeouts and reply parsing live here once. The
+functions take an httpx.AsyncClient or AsyncAzureOpenAI client and are
+coroutines. `slot` is an optional async context manager (a micro-batcher
+slot) held while the Ollama request is in flight.
+
+failure_reply() turns an exception of either stack into the message the
+user gets instead of a reply.
+"""
+
+import contextlib
+import logging
+
+from bot_core.metrics import REGISTRY
+from bot_core.streaming import iter_ollama_chunks, iter_openai_chunks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LLM_PROVIDER = "azure"
+
+CHAT_TIMEOUT_SECONDS = 30
+EMBED_TIMEOUT_SECONDS = 10
+AZURE_CHAT_OPTIONS = {"temperature": 0.7, "max_tokens": 500}
+
+# What the user gets when no reply could be generated
+FAILURE_REPLIES = {
+    "empty": "Sajnálom, üres válasz érkezett az AI-tól",
+    "timeout": "Sajnálom, az AI szerver nem válaszol időben",
+    "unreachable": "Sajnálom, nem tudom elérni az AI szervert",
+    "failed": "Sajnálom, hiba történt az AI válasz generálása során"
+}
+
+# Exception class names (httpx, requests, openai, LLMRouter) by failure kind; matched by name so
+# neither HTTP stack has to be imported by a host that doesn't use it
+_TIMEOUT_ERRORS = {"TimeoutException", "Timeout", "APITimeoutError", "TimeoutError"}
+_UNREACHABLE_ERRORS = {"ConnectError", "ConnectionError", "APIConnectionError", "NoBackendAvailable"}
+
+# Generated tokens and generation time as reported by Ollama: rate() of the tokens is the tokens/s throughput
+_ollama_eval_tokens = REGISTRY.counter("bot_ollama_eval_tokens_total", "Tokens generated by Ollama (eval_count)", ("host",))
+_ollama_eval_seconds = REGISTRY.counter("bot_ollama_eval_seconds_total", "Ollama generation time (eval_duration)", ("host",))
+
+
+def failure_kind(error):
+    """"timeout", "unreachable" or "failed" for an exception raised by an LLM call"""
+    names = {cls.__name__ for cls in type(error).__mro__}
+    if names & _TIMEOUT_ERRORS:
+        return "timeout"
+    if names & _UNREACHABLE_ERRORS:
+        return "unreachable"
+    return "failed"
+
+
+def failure_reply(error, log=None, **fields):
+    """The message the user gets instead of a reply; the failure is logged as llm_<kind> on `log` (a StructuredLogger)"""
+    kind = failure_kind(error)
+    if log is not None:
+        log.error(f"llm_{kind}", error=str(error), **fields)
+    return FAILURE_REPLIES[kind]
+
+
+def ollama_host(base_url):
+    return base_url.split("//")[-1]
+
+
+def record_ollama_eval(base_url, data):
+    """Count the tokens and generation time of a finished Ollama reply"""
+    host = ollama_host(base_url)
+    _ollama_eval_tokens.inc(data.get("eval_count", 0), host=host)
+    _ollama_eval_seconds.inc(data.get("eval_duration", 0) / 1e9, host=host)
+
+
+def _ollama_reply(base_url, data):
+    record_ollama_eval(base_url, data)
+    return data.get("message", {}).get("content", "")
+
+
+async def ollama_chat(client, base_url, model, messages, slot=None):
+    """Send chat messages to an Ollama host and return the reply text"""
+    async with slot or contextlib.nullcontext():
+        response = await client.post(f"{base_url}/api/chat", json={"model": model, "messages": messages, "stream": False},
+                                     timeout=CHAT_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return _ollama_reply(base_url, response.json())
+
+
+async def ollama_stream(client, base_url, model, messages, slot=None):
+    """Stream the reply of an Ollama host chunk by chunk (NDJSON)"""
+    async with slot or contextlib.nullcontext():
+        async with client.stream("POST", f"{base_url}/api/chat", json={"model": model, "messages": messages, "stream": True},
+                                 timeout=CHAT_TIMEOUT_SECONDS) as response:
+            response.raise_for_status()
+            async for chunk in iter_ollama_chunks(response, on_done=lambda done: record_ollama_eval(base_url, done)):
+                yield chunk
+
+
+async def ollama_embed(client, base_url, model, text):
+    """Embedding of a text by an Ollama host"""
+    response = await client.post(f"{base_url}/api/embed", json={"model": model, "input": text},
+                                 timeout=EMBED_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json()["embeddings"][0]
+
+
+async def azure_openai_chat(client, deployment, messages):
+    """Send chat messages to an Azure OpenAI deployment and return the reply text"""
+    response = await client.chat.completions.create(model=deployment, messages=messages, timeout=CHAT_TIMEOUT_SECONDS,
+                                                    **AZURE_CHAT_OPTIONS)
+    return response.choices[0].message.content
+
+
+async def azure_openai_stream(client, deployment, messages):
+    """Stream the reply of an Azure OpenAI deployment chunk by chunk"""
+    stream = await client.chat.completions.create(model=deployment, messages=messages, timeout=CHAT_TIMEOUT_SECONDS,
+                                                  stream=True, **AZURE_CHAT_OPTIONS)
+    async for chunk in iter_openai_chunks(stream):
+        yield chunk
+
+
+async def azure_openai_embed(client, deployment, text):
+    """Embedding of a text by an Azure OpenAI deployment"""
+    response = await client.embeddings.create(model=deployment, input=text)
+    return response.data[0].embedding
@@ -0,0 +1,402 @@
+"""
+Retrieval-augmented answers from a local document index
+
+An offline indexer chunks Markdown and text documents along their headings
+and writes the index to a directory:
+
+  meta.json          embedding model and dimension, chunk count, BM25 parameters
+  chunks.jsonl       one chunk per line: source file, heading path, text, token count
+  embeddings.npy     float32 unit vectors, one row per chunk (not with --provider none)
+  bm25_terms.json    term -> [offset, count] into the two posting arrays (not with --no-bm25)
+  bm25_docs.npy      chunk number of each posting
+  bm25_weights.npy   BM25 weight of each posting (idf and length normalization included)
+
+At query time the arrays are memory-mapped (NumPy, optional dependency):
+loading costs nothing and the pages are shared between worker processes.
+A search is one matrix-vector product for the query embedding and/or a
+scatter-add over the postings of the query terms, then argpartition for
+the top k, so a few milliseconds even for tens of thousands of chunks.
+When both rankings are available they are merged by reciprocal rank fusion.
+
+knowledge_message() turns the hits into one system message within a token
+budget, and build_context() places it after the system prompt.
+
+Build an index with embeddings from the bot's embedding backend
+(EMBEDDING_BACKEND, LLM_BACKENDS or LLM_PROVIDER, read from the environment):
+
+    python -m bot_core.rag "Teams Connentor for Future Generations.md" docs/ --out rag_index
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import time
+from collections import Counter
+
+from .context import count_tokens, make_message
+
+logger = logging.getLogger(__name__)
+
+DOCUMENT_SUFFIXES = (".md", ".markdown", ".txt")
+
+KNOWLEDGE_PREFIX = "Belső dokumentáció részletei (csak akkor használd, ha a kérdéshez kapcsolódnak):"
+
+# Reciprocal rank fusion constant: the usual 60 keeps neighbouring ranks close in weight
+RRF_K = 60
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_TERM = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """BM25 terms: lowercase words of at least two characters"""
+    return [term for term in _TERM.findall(text.lower()) if len(term) > 1]
+
+
+def _split_long(paragraph, max_tokens):
+    """Pieces of a paragraph longer than a chunk, cut at word boundaries"""
+    pieces, words = [], []
+    for word in paragraph.split():
+        words.append(word)
+        if count_tokens(" ".join(words), exact=False) >= max_tokens:
+            pieces.append(" ".join(words))
+            words = []
+    if words:
+        pieces.append(" ".join(words))
+    return pieces
+
+
+def _sections(text):
+    """(heading path, paragraphs) of each section that has text"""
+    sections = []
+    headings, paragraphs, block = [], [], []
+    fenced = False
+    for line in text.splitlines() + [""]:
+        if line.lstrip().startswith("```"):
+            fenced = not fenced
+        heading = None if fenced else _HEADING.match(line)
+        if (heading or not line.strip()) and not fenced:
+            if block:
+                paragraphs.append("\n".join(block))
+                block = []
+        else:
+            block.append(line.rstrip())
+        if heading:
+            if paragraphs:
+                sections.append((" > ".join(title for _, title in headings), paragraphs))
+                paragraphs = []
+            level = len(heading.group(1))
+            headings = [(lvl, title) for lvl, title in headings if lvl < level] + [(level, heading.group(2))]
+    if paragraphs:
+        sections.append((" > ".join(title for _, title in headings), paragraphs))
+    return sections
+
+
+def chunk_markdown(text, source, max_tokens=300):
+    """Chunks of a Markdown (or plain text) document: its paragraphs grouped per section up to `max_tokens`
+
+    Each chunk is {"source", "title", "text", "tokens"}, the title being the
+    heading path ("Lépések > Dev Tunnel"). Fenced code blocks are not split
+    at blank lines and their comments are not taken for headings.
+    """
+    chunks = []
+    for title, paragraphs in _sections(text):
+        bodies, current = [], []
+        for paragraph in paragraphs:
+            too_long = count_tokens(paragraph, exact=False) > max_tokens
+            for piece in _split_long(paragraph, max_tokens) if too_long else [paragraph]:
+                if current and count_tokens("\n\n".join(current + [piece]), exact=False) > max_tokens:
+                    bodies.append("\n\n".join(current))
+                    current = []
+                current.append(piece)
+        if current:
+            bodies.append("\n\n".join(current))
+        chunks.extend(
+            {"source": source, "title": title, "text": body, "tokens": count_tokens(body, exact=False)}
+            for body in bodies
+        )
+    return chunks
+
+
+def _indexed_text(chunk):
+    """What is embedded and BM25-indexed: the heading path gives the chunk its context"""
+    return f"{chunk['title']}\n{chunk['text']}" if chunk["title"] else chunk["text"]
+
+
+def _document_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.lower().endswith(DOCUMENT_SUFFIXES):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def build_index(paths, out, embed=None, model="", max_tokens=300, bm25=True, batch_size=32):
+    """Chunk the documents under `paths` and write the index directory `out`
+
+    `embed` is a callable list of texts -> list of vectors (None: BM25 only).
+    Returns the meta.json contents.
+    """
+    import numpy as np
+
+    chunks = []
+    for path in _document_files(paths):
+        with open(path, encoding="utf-8") as f:
+            chunks.extend(chunk_markdown(f.read(), os.path.basename(path), max_tokens))
+    if not chunks:
+        raise ValueError(f"No {'/'.join(DOCUMENT_SUFFIXES)} documents with text under {', '.join(paths)}")
+    texts = [_indexed_text(chunk) for chunk in chunks]
+
+    os.makedirs(out, exist_ok=True)
+    meta = {"version": 1, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "chunks": len(chunks),
+            "max_tokens": max_tokens, "model": None, "dim": None, "bm25": None}
+    with open(os.path.join(out, "chunks.jsonl"), "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+    if embed is not None:
+        vectors = []
+        for start in range(0, len(texts), batch_size):
+            vectors.extend(embed(texts[start:start + batch_size]))
+            logger.info(f"Embedded {len(vectors)}/{len(texts)} chunks")
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        np.save(os.path.join(out, "embeddings.npy"), matrix)
+        meta.update(model=model, dim=int(matrix.shape[1]))
+
+    if bm25:
+        documents = [Counter(tokenize(text)) for text in texts]
+        lengths = [sum(terms.values()) for terms in documents]
+        average = sum(lengths) / len(lengths) or 1.0
+        postings = {}
+        for number, terms in enumerate(documents):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[number] / average)
+            for term, tf in terms.items():
+                postings.setdefault(term, []).append((number, tf * (BM25_K1 + 1) / (tf + norm)))
+        terms, docs, weights = {}, [], []
+        for term in sorted(postings):
+            entries = postings[term]
+            idf = math.log(1 + (len(documents) - len(entries) + 0.5) / (len(entries) + 0.5))
+            terms[term] = [len(docs), len(entries)]
+            docs.extend(number for number, _ in entries)
+            weights.extend(idf * weight for _, weight in entries)
+        with open(os.path.join(out, "bm25_terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        np.save(os.path.join(out, "bm25_docs.npy"), np.asarray(docs, dtype=np.int32))
+        np.save(os.path.join(out, "bm25_weights.npy"), np.asarray(weights, dtype=np.float32))
+        meta["bm25"] = {"k1": BM25_K1, "b": BM25_B, "terms": len(terms), "average_length": round(average, 1)}
+
+    with open(os.path.join(out, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+class DocumentIndex:
+    """Top-k retrieval over a memory-mapped index directory (see build_index)"""
+
+    def __init__(self, np, chunks, meta, vectors=None, terms=None, docs=None, weights=None):
+        self.np = np
+        self.chunks = chunks
+        self.meta = meta
+        self.vectors = vectors
+        self.terms = terms
+        self.docs = docs
+        self.weights = weights
+        self.stats = {"searches": 0, "hits": 0, "seconds": 0.0}
+
+    @property
+    def has_vectors(self):
+        return self.vectors is not None
+
+    @property
+    def has_bm25(self):
+        return self.terms is not None
+
+    def _top(self, scores, k):
+        k = min(k, len(scores))
+        top = self.np.argpartition(-scores, k - 1)[:k]
+        return top[self.np.argsort(-scores[top])]
+
+    def search(self, text=None, vector=None, k=4, min_similarity=0.0):
+        """The k most relevant chunks for a query text (BM25) and/or its embedding
+
+        Returns copies of the chunks with a "score": the cosine similarity or
+        BM25 score when one ranking was used, the fused score when both.
+        """
+        np = self.np
+        start = time.perf_counter()
+        rankings = []
+        candidates = k * 4
+        if vector is not None and self.has_vectors:
+            query = np.asarray(vector, dtype=np.float32)
+            norm = float(np.linalg.norm(query))
+            if query.shape == (self.vectors.shape[1],) and norm > 0:
+                scores = self.vectors @ (query / norm)
+                top = self._top(scores, candidates)
+                rankings.append({int(i): float(scores[i]) for i in top if scores[i] >= min_similarity})
+            else:
+                logger.warning(f"Query embedding of dimension {query.shape} does not match the index ({self.vectors.shape[1]})")
+        if text and self.has_bm25:
+            scores = np.zeros(len(self.chunks), dtype=np.float32)
+            for term in set(tokenize(text)):
+                entry = self.terms.get(term)
+                if entry:
+                    postings = slice(entry[0], entry[0] + entry[1])
+                    scores[self.docs[postings]] += self.weights[postings]  # a term's postings are distinct chunks
+            top = self._top(scores, candidates)
+            rankings.append({int(i): float(scores[i]) for i in top if scores[i] > 0})
+
+        if len(rankings) == 1:
+            ranked = list(rankings[0].items())[:k]
+        else:
+            fused = {}
+            for ranking in rankings:
+                for rank, number in enumerate(ranking):
+                    fused[number] = fused.get(number, 0.0) + 1 / (RRF_K + rank + 1)
+            ranked = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        hits = [dict(self.chunks[number], score=round(score, 4)) for number, score in ranked]
+
+        self.stats["searches"] += 1
+        self.stats["hits"] += bool(hits)
+        self.stats["seconds"] += time.perf_counter() - start
+        return hits
+
+    def snapshot(self):
+        """Counters plus the index size and the mean search time"""
+        searches = self.stats["searches"]
+        return {
+            "chunks": len(self.chunks),
+            "model": self.meta.get("model"),
+            "bm25": self.has_bm25,
+            "searches": searches,
+            "hits": self.stats["hits"],
+            "mean_search_ms": round(self.stats["seconds"] / searches * 1000, 2) if searches else 0.0
+        }
+
+
+def load_document_index(path, embedding_model=""):
+    """Open an index directory written by build_index (None when it is missing or NumPy is not installed)
+
+    Embeddings from another model than `embedding_model` would not be
+    comparable with the query embeddings, so the index is then BM25 only.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        logger.warning("NumPy not installed - document retrieval disabled")
+        return None
+    try:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as f:
+            chunks = [json.loads(line) for line in f]
+    except OSError as e:
+        logger.warning(f"Document index not loaded ({e}) - document retrieval disabled")
+        return None
+
+    vectors = None
+    if meta.get("model"):
+        if embedding_model and meta["model"] != embedding_model:
+            logger.warning(f"Document index embedded with {meta['model']}, not {embedding_model} - using BM25 only")
+        else:
+            vectors = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+    terms = docs = weights = None
+    if meta.get("bm25"):
+        with open(os.path.join(path, "bm25_terms.json"), encoding="utf-8") as f:
+            terms = json.load(f)
+        docs = np.load(os.path.join(path, "bm25_docs.npy"), mmap_mode="r")
+        weights = np.load(os.path.join(path, "bm25_weights.npy"), mmap_mode="r")
+    logger.info(f"Document index loaded: {len(chunks)} chunks, "
+                f"embeddings: {meta['model'] if vectors is not None else 'no'}, BM25: {'yes' if terms else 'no'}")
+    return DocumentIndex(np, chunks, meta, vectors, terms, docs, weights)
+
+
+def knowledge_message(hits, budget, exact=True):
+    """One system message with the retrieved chunks, most relevant first, within `budget` tokens (None: nothing fits)"""
+    parts = []
+    used = count_tokens(KNOWLEDGE_PREFIX, exact)
+    for hit in hits:
+        source = f"{hit['source']} / {hit['title']}" if hit["title"] else hit["source"]
+        part = f"[{source}]\n{hit['text']}"
+        tokens = count_tokens(part, exact)
+        if used + tokens <= budget:
+            parts.append(part)
+            used += tokens
+    if not parts:
+        return None
+    return make_message("system", "\n\n".join([KNOWLEDGE_PREFIX] + parts), exact)
+
+
+def _http_embedder(provider):
+    """(model, embed) for the indexer, calling the embedding backend like the bot does (Settings.embedding)"""
+    import httpx
+
+    from .settings import EmbeddingBackend, Settings
+
+    settings = Settings()
+    backend = settings.embedding
+    if backend.kind != provider:  # --provider picked the other kind: the host and model of its settings
+        backend = (EmbeddingBackend("ollama", settings.llama3_embedding_model, settings.llama3_api_url.rstrip("/"), None)
+                   if provider == "ollama" else
+                   EmbeddingBackend("azure", settings.azure_openai_embedding_deployment, settings.azure_openai_endpoint,
+                                    None))
+    model = backend.model
+
+    if provider == "ollama":
+        def embed(texts):
+            response = httpx.post(f"{backend.url}/api/embed", json={"model": model, "input": texts}, timeout=120)
+            response.raise_for_status()
+            return response.json()["embeddings"]
+    else:
+        endpoint = backend.url.rstrip("/")
+        api_key = settings.environ.get(backend.api_key_env, "") if backend.api_key_env else settings.azure_openai_api_key
+        if not endpoint or not api_key:
+            raise SystemExit("AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY must be set (or use --provider none)")
+
+        def embed(texts):
+            response = httpx.post(f"{endpoint}/openai/deployments/{model}/embeddings",
+                                  params={"api-version": settings.azure_openai_api_version}, headers={"api-key": api_key},
+                                  json={"input": texts}, timeout=120)
+            response.raise_for_status()
+            return [item["embedding"] for item in sorted(response.json()["data"], key=lambda item: item["index"])]
+    return model, embed
+
+
+def main():
+    from .settings import Settings
+
+    settings = Settings()
+    default_provider = settings.embedding.kind if settings.llm_backends.strip() or settings.embedding_backend.strip() \
+        else {"llama3": "ollama", "azure": "azure"}.get(settings.llm_provider, "none")
+    parser = argparse.ArgumentParser(description="Build the document index for retrieval-augmented answers")
+    parser.add_argument("paths", nargs="+", help=f"documents or directories ({', '.join(DOCUMENT_SUFFIXES)})")
+    parser.add_argument("--out", default="rag_index", help="index directory (RAG_INDEX_PATH)")
+    parser.add_argument("--provider", choices=["ollama", "azure", "none"], default=default_provider,
+                        help="embedding provider (default: the bot's embedding backend; none: BM25 only)")
+    parser.add_argument("--chunk-tokens", type=int, default=300)
+    parser.add_argument("--no-bm25", action="store_true", help="skip the BM25 index")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    model, embed = _http_embedder(args.provider) if args.provider != "none" else ("", None)
+    if embed is None and args.no_bm25:
+        raise SystemExit("Nothing to index with: --provider none and --no-bm25")
+    started = time.perf_counter()
+    meta = build_index(args.paths, args.out, embed, model, args.chunk_tokens, bm25=not args.no_bm25)
+    print(f"{meta['chunks']} chunks indexed into {args.out} in {time.perf_counter() - started:.1f}s "
+          f"(embeddings: {meta['model'] or 'none'}, BM25: {'yes' if meta['bm25'] else 'no'})")
+
+
+if __name__ == "__main__":
+    main()
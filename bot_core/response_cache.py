@@ -0,0 +1,194 @@
+"""
+Response cache in front of the LLM providers
+
+Two tiers:
+  exact      the normalized prompt (all messages) + model, in an LRU dict
+  semantic   optional; embeddings of the user message in a NumPy matrix,
+             a hit is the most similar cached question above a threshold
+
+Only prompts without conversation history are cached by default
+(scope "stateless"): once a conversation has context, the same question can
+need a different answer. Scope "always" also caches exact matches of the
+full prompt including history. Entries expire after `ttl` seconds and the
+cache holds at most `max_entries` answers.
+"""
+
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+
+
+def normalize_text(text):
+    """Case/whitespace/trailing punctuation insensitive form of a message"""
+    return _TRAILING_PUNCTUATION.sub("", _WHITESPACE.sub(" ", text.strip().lower()))
+
+
+class CacheTicket:
+    """What a lookup learned about a prompt, so a later store() needs no recomputation"""
+
+    __slots__ = ("key", "namespace", "embedding")
+
+    def __init__(self, key, namespace, embedding=None):
+        self.key = key
+        self.namespace = namespace
+        self.embedding = embedding
+
+
+class _VectorIndex:
+    """Fixed-capacity matrix of unit vectors with a free-slot list"""
+
+    def __init__(self, np, capacity, dim):
+        self.np = np
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.namespaces = np.zeros(capacity, dtype=np.int64)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.keys = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def add(self, key, namespace, vector):
+        if not self.free:
+            return None
+        slot = self.free.pop()
+        self.vectors[slot] = vector
+        self.namespaces[slot] = namespace
+        self.valid[slot] = True
+        self.keys[slot] = key
+        return slot
+
+    def remove(self, slot):
+        self.valid[slot] = False
+        self.keys[slot] = None
+        self.free.append(slot)
+
+    def search(self, namespace, vector):
+        scores = self.vectors @ vector
+        scores[~self.valid | (self.namespaces != namespace)] = -1.0
+        slot = int(self.np.argmax(scores))
+        return self.keys[slot], float(scores[slot])
+
+
+class ResponseCache:
+    """Exact + optional embedding-similarity cache of LLM replies
+
+    `embed` is an async callable text -> list of floats; without it (or
+    without NumPy) only the exact tier is used.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600, scope="stateless", embed=None, similarity=0.92, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.scope = scope
+        self.embed = embed
+        self.similarity = similarity
+        self.clock = clock
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "bypassed": 0}
+        self._entries = OrderedDict()  # key -> [reply, expires_at, slot]
+        self._index = None
+        self._np = None
+        if embed is not None:
+            try:
+                import numpy
+                self._np = numpy
+            except ImportError:
+                logger.warning("NumPy not installed - semantic response cache disabled")
+                self.embed = None
+
+    async def lookup(self, messages, model):
+        """Return (reply or None, ticket); pass the ticket to store() after a miss"""
+        reply, ticket = self._exact(messages, model)
+        if reply is None and self._matches_meaning(ticket, messages):
+            try:
+                reply = self._similar(ticket, await self.embed(normalize_text(messages[-1]["content"])))
+            except Exception as e:
+                logger.warning(f"Embedding for response cache failed: {e}")
+        return self._missed(reply, ticket)
+
+    def _ticket(self, messages, model):
+        if self.scope != "always" and any(m["role"] == "assistant" for m in messages):
+            return None
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        namespace = int.from_bytes(hashlib.blake2b(f"{model}\0{system}".encode(), digest_size=8).digest(), "big", signed=True)
+        normalized = [[m["role"], normalize_text(m["content"]) if m["role"] == "user" else m["content"]] for m in messages]
+        key = hashlib.blake2b(json.dumps([model, normalized], ensure_ascii=False).encode(), digest_size=16).hexdigest()
+        return CacheTicket(key, namespace)
+
+    def _get_entry(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now >= entry[1]:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[2] is not None:
+            self._index.remove(entry[2])
+
+    def _exact(self, messages, model):
+        """(reply or None, ticket) from the exact tier"""
+        ticket = self._ticket(messages, model)
+        if ticket is None:
+            self.stats["bypassed"] += 1
+            return None, None
+        reply = self._get_entry(ticket.key, self.clock())
+        if reply is not None:
+            self.stats["exact_hits"] += 1
+        return reply, ticket
+
+    def _matches_meaning(self, ticket, messages):
+        # Only questions without conversation context are matched by meaning
+        return ticket is not None and self.embed is not None and all(m["role"] != "assistant" for m in messages)
+
+    def _similar(self, ticket, vector):
+        """The reply cached for the most similar question, given the embedding of this one"""
+        vector = self._np.asarray(vector, dtype=self._np.float32)
+        norm = float(self._np.linalg.norm(vector))
+        if norm > 0:
+            ticket.embedding = vector / norm
+        if ticket.embedding is None:
+            return None
+        reply = None
+        if self._index is not None and self._index.vectors.shape[1] == ticket.embedding.shape[0]:
+            key, score = self._index.search(ticket.namespace, ticket.embedding)
+            if key is not None and score >= self.similarity:
+                reply = self._get_entry(key, self.clock())
+        if reply is not None:
+            self.stats["semantic_hits"] += 1
+        return reply
+
+    def _missed(self, reply, ticket):
+        if reply is None and ticket is not None:
+            self.stats["misses"] += 1
+        return reply, ticket
+
+    def store(self, ticket, reply):
+        """Remember the reply for a prompt that missed"""
+        if ticket is None or not reply:
+            return
+        self._remove(ticket.key)
+        while len(self._entries) >= self.max_entries:
+            self._remove(next(iter(self._entries)))
+        slot = None
+        if ticket.embedding is not None:
+            if self._index is None:
+                self._index = _VectorIndex(self._np, self.max_entries, ticket.embedding.shape[0])
+            if self._index.vectors.shape[1] == ticket.embedding.shape[0]:
+                slot = self._index.add(ticket.key, ticket.namespace, ticket.embedding)
+        self._entries[ticket.key] = [reply, self.clock() + self.ttl, slot]
+
+    def snapshot(self):
+        """Counters plus current size, e.g. for the health endpoint"""
+        lookups = sum(self.stats.values()) - self.stats["bypassed"]
+        hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+        return dict(self.stats, size=len(self._entries), hit_ratio=round(hits / lookups, 3) if lookups else 0.0)
@@ -0,0 +1,280 @@
+"""
+Configuration of the bot, read from the environment once for both hosts
+
+function_app.py gets its settings from the Functions host, app_simple.py
+loads local.settings.json into the environment first (and again when the
+file changes, see provider_registry.SettingsWatcher). Either way the same
+variables configure the same bot, so they are read here. Settings that
+only concern one host (gunicorn workers, the warm-up timer) stay in it.
+
+A host passes `defaults` (variable name -> default value) for the few
+variables whose default differs between the hosts.
+
+embedding names the backend the texts are embedded with (semantic
+response cache, retrieval): EMBEDDING_BACKEND, else the first of
+LLM_BACKENDS, else the provider selected by LLM_PROVIDER.
+
+per_process() and per_process_rate() split a limit meant for the whole
+host between the processes serving the bot (gunicorn workers).
+"""
+
+import os
+from collections import namedtuple
+
+from bot_core.auth import OPENID_METADATA_URL
+from bot_core.connector import DEFAULT_TOKEN_ENDPOINT
+from bot_core.providers import DEFAULT_LLM_PROVIDER
+
+# Grepton's own tenant (users from other tenants are logged as external)
+GREPTON_TENANT_ID = "5363c28c-cdab-42ce-86c6-1b35f030504b"
+
+SYSTEM_PROMPT = "Te egy barátságos Teams bot vagy. Válaszolj röviden és segítőkészen magyarul."
+
+
+# kind "ollama" or "azure"; url: the Ollama host or the Azure OpenAI endpoint; api_key_env: variable holding its key
+EmbeddingBackend = namedtuple("EmbeddingBackend", "kind model url api_key_env")
+
+
+def per_process(limit, processes):
+    """One process's share of a limit meant for the whole host"""
+    return max(1, -(-limit // processes))
+
+
+def per_process_rate(rate, burst, processes):
+    """One process's share of a host-wide token bucket (rate, burst), rounded down so the sum stays within it"""
+    return rate / processes, max(1, burst // processes)
+
+
+class Settings:
+    """Every variable the bot reads, as attributes named like the variable in lower case"""
+
+    def __init__(self, defaults=None, environ=None):
+        self.defaults = dict(defaults or {})
+        self.environ = os.environ if environ is None else environ
+        get, flag, integer, number = self._get, self._flag, self._int, self._float
+
+        # Bot credentials
+        self.app_id = get("MicrosoftAppId", "")
+        self.app_password = get("MicrosoftAppPassword", "")
+        self.app_type = get("MicrosoftAppType", "SingleTenant")
+        self.home_tenant_id = GREPTON_TENANT_ID
+
+        # Tenant the bot's tokens are issued by: its own tenant for SingleTenant bots, botframework.com for MultiTenant
+        self.bot_tenant_id = get("MicrosoftAppTenantId",
+                                 "botframework.com" if self.app_type.lower() == "multitenant" else GREPTON_TENANT_ID)
+        # Tokens are refreshed in the background this many seconds before they expire
+        self.token_refresh_margin_seconds = integer("TOKEN_REFRESH_MARGIN_SECONDS", "300")
+        # Entra ID token endpoint ({tenant_id} is filled in); overridden by the load tests to point at a mock
+        self.bot_token_endpoint = get("BOT_TOKEN_ENDPOINT", DEFAULT_TOKEN_ENDPOINT)
+        # Incoming requests must carry the Bot Framework channel's JWT (not checked without an app id, e.g. in the Emulator)
+        self.bot_auth_enabled = flag("BOT_AUTH_ENABLED", "true")
+        # OpenID metadata listing the channel's signing keys, and how often the keys are fetched again
+        self.bot_openid_metadata_url = get("BOT_OPENID_METADATA_URL", OPENID_METADATA_URL)
+        self.bot_auth_keys_refresh_seconds = integer("BOT_AUTH_KEYS_REFRESH_SECONDS", "86400")
+
+        # LLM Provider selection
+        self.llm_provider = get("LLM_PROVIDER", DEFAULT_LLM_PROVIDER).lower()
+
+        # Azure OpenAI configuration
+        self.azure_openai_endpoint = get("AZURE_OPENAI_ENDPOINT", "")
+        self.azure_openai_api_key = get("AZURE_OPENAI_API_KEY", "")
+        self.azure_openai_api_version = get("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
+        self.azure_openai_chat_deployment = get("AZURE_OPENAI_CHAT_DEPLOYMENT", "gpt-4o-mini")
+        self.azure_openai_embedding_deployment = get("AZURE_OPENAI_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+
+        # Llama3 configuration
+        self.llama3_api_url = get("LLAMA3_API_URL", "http://localhost:11434")
+        self.llama3_model = get("LLAMA3_MODEL", "llama3")
+        self.llama3_embedding_model = get("LLAMA3_EMBEDDING_MODEL", "nomic-embed-text")
+
+        # Ollama micro-batching: per host, requests arriving within OLLAMA_BATCH_WINDOW_MS are released together
+        # (at most OLLAMA_BATCH_MAX_SIZE, 0 = OLLAMA_NUM_PARALLEL) and at most OLLAMA_NUM_PARALLEL are in flight;
+        # set it to the host's own OLLAMA_NUM_PARALLEL
+        self.ollama_batching_enabled = flag("OLLAMA_BATCHING_ENABLED", "true")
+        self.ollama_num_parallel = integer("OLLAMA_NUM_PARALLEL", "4")
+        self.ollama_batch_window_ms = integer("OLLAMA_BATCH_WINDOW_MS", "10")
+        self.ollama_batch_max_size = integer("OLLAMA_BATCH_MAX_SIZE", "0")
+
+        # LLM backends behind the router, comma-separated: "ollama:<url>[|model]" or
+        # "azure:<deployment>[|endpoint|env var holding its API key]";
+        # empty = the single backend selected by LLM_PROVIDER
+        self.llm_backends = get("LLM_BACKENDS", "")
+        self.llm_hedging_enabled = flag("LLM_HEDGING_ENABLED", "true")
+        self.llm_hedge_min_ms = integer("LLM_HEDGE_MIN_MS", "500")
+        self.llm_breaker_failures = integer("LLM_BREAKER_FAILURES", "5")
+        self.llm_breaker_reset_seconds = integer("LLM_BREAKER_RESET_SECONDS", "30")
+        # Embedding backend, like an LLM_BACKENDS entry but naming the embedding model: "ollama:<url>[|model]" or
+        # "azure:<deployment>[|endpoint|env var holding its API key]"; empty = the host of the first LLM_BACKENDS
+        # entry (or of LLM_PROVIDER) with LLAMA3_EMBEDDING_MODEL / AZURE_OPENAI_EMBEDDING_DEPLOYMENT
+        self.embedding_backend = get("EMBEDDING_BACKEND", "")
+
+        # Admission control for LLM capacity: quotas per user and per tenant, fair queuing across tenants
+        # (priority tenants weigh ADMISSION_PRIORITY_WEIGHT times as much), and a concurrency limit that adapts
+        # to the backends' latency; 0 = 4 per LLM backend. Messages over quota or beyond ADMISSION_MAX_WAIT_SECONDS
+        # of queueing get a short "try again later" reply instead of waiting
+        self.admission_enabled = flag("ADMISSION_ENABLED", "true")
+        self.admission_max_concurrency = integer("ADMISSION_MAX_CONCURRENCY", "0")
+        self.admission_adaptive = flag("ADMISSION_ADAPTIVE", "true")
+        self.admission_max_queue = integer("ADMISSION_MAX_QUEUE", "50")
+        self.admission_max_wait_seconds = number("ADMISSION_MAX_WAIT_SECONDS", "20")
+        self.admission_user_rate_per_minute = number("ADMISSION_USER_RATE_PER_MINUTE", "20")
+        self.admission_user_burst = integer("ADMISSION_USER_BURST", "10")
+        self.admission_tenant_rate_per_minute = number("ADMISSION_TENANT_RATE_PER_MINUTE", "600")
+        self.admission_tenant_burst = integer("ADMISSION_TENANT_BURST", "100")
+        self.admission_priority_tenants = [tenant.strip() for tenant in get("ADMISSION_PRIORITY_TENANTS", GREPTON_TENANT_ID).split(",")
+                                           if tenant.strip()]
+        self.admission_priority_weight = number("ADMISSION_PRIORITY_WEIGHT", "4")
+
+        self.system_prompt = SYSTEM_PROMPT
+
+        # Streaming: show the reply while it is generated, editing the message at most once per interval
+        self.llm_streaming = flag("LLM_STREAMING", "false")
+        self.stream_update_interval_ms = integer("STREAM_UPDATE_INTERVAL_MS", "1000")
+
+        # Conversation history store: "memory" (per process) or "sqlite" (shared file)
+        self.history_backend = get("HISTORY_BACKEND", "memory").lower()
+        self.history_max_messages = integer("HISTORY_MAX_MESSAGES", "50")
+        self.history_max_conversations = integer("HISTORY_MAX_CONVERSATIONS", "10000")
+        self.history_ttl_seconds = integer("HISTORY_TTL_SECONDS", "86400")
+        self.history_sqlite_path = get("HISTORY_SQLITE_PATH", "")
+
+        # Durable transcript of every turn (segment files in TRANSCRIPT_PATH, records older than TRANSCRIPT_RETENTION_DAYS
+        # dropped when segments are compacted); a conversation the history store does not know (restart, new instance)
+        # gets its last turns within HISTORY_TTL_SECONDS back from it. Print it with `python -m bot_core.transcript <path>`.
+        # Empty path = off
+        self.transcript_path = get("TRANSCRIPT_PATH", "")
+        self.transcript_segment_mb = integer("TRANSCRIPT_SEGMENT_MB", "16")
+        self.transcript_retention_days = number("TRANSCRIPT_RETENTION_DAYS", "90")
+        self.transcript_fsync = flag("TRANSCRIPT_FSYNC", "false")
+
+        # Prompt context: history is added newest-first until the token budget is used up;
+        # with summaries enabled, turns that no longer fit are replaced by a rolling summary
+        self.context_token_budget = integer("CONTEXT_TOKEN_BUDGET", "3000")
+        self.context_summary_enabled = flag("CONTEXT_SUMMARY_ENABLED", "false")
+
+        # Retrieval-augmented answers: the chunks of the document index in RAG_INDEX_PATH (built with
+        # `python -m bot_core.rag <documents> --out <dir>`, needs NumPy) most relevant to the message go into the prompt,
+        # at most RAG_TOP_K within RAG_TOKEN_BUDGET tokens of the context budget. RAG_RETRIEVAL: "hybrid" (embedding
+        # and BM25), "vector" or "bm25" (no embedding call per message). Empty path = off
+        self.rag_index_path = get("RAG_INDEX_PATH", "")
+        self.rag_retrieval = get("RAG_RETRIEVAL", "hybrid").lower()
+        self.rag_top_k = integer("RAG_TOP_K", "4")
+        self.rag_token_budget = integer("RAG_TOKEN_BUDGET", "800")
+        self.rag_min_similarity = number("RAG_MIN_SIMILARITY", "0.3")
+
+        # Files and cards sent with a message: files up to ATTACHMENT_MAX_BYTES are streamed to a spooled temp file
+        # (at most ATTACHMENT_MAX_DOWNLOADS at once) and their text (plain text, DOCX, PDF with the optional pypdf)
+        # goes into the prompt; documents longer than ATTACHMENT_INLINE_TOKENS are summarized by the LLM in chunks of
+        # ATTACHMENT_CHUNK_TOKENS, ATTACHMENT_SUMMARY_CONCURRENCY at a time, reading at most ATTACHMENT_MAX_CHUNKS
+        self.attachments_enabled = flag("ATTACHMENTS_ENABLED", "true")
+        self.attachment_max_bytes = integer("ATTACHMENT_MAX_BYTES", str(25 * 1024 * 1024))
+        self.attachment_max_downloads = integer("ATTACHMENT_MAX_DOWNLOADS", "4")
+        self.attachment_inline_tokens = integer("ATTACHMENT_INLINE_TOKENS", "1500")
+        self.attachment_chunk_tokens = integer("ATTACHMENT_CHUNK_TOKENS", "2000")
+        self.attachment_max_chunks = integer("ATTACHMENT_MAX_CHUNKS", "20")
+        self.attachment_summary_concurrency = integer("ATTACHMENT_SUMMARY_CONCURRENCY", "4")
+
+        # Response cache: exact prompt matches, optionally also similar questions by embedding
+        self.response_cache_enabled = flag("RESPONSE_CACHE_ENABLED", "false")
+        self.response_cache_max_entries = integer("RESPONSE_CACHE_MAX_ENTRIES", "1000")
+        self.response_cache_ttl_seconds = integer("RESPONSE_CACHE_TTL_SECONDS", "3600")
+        self.response_cache_scope = get("RESPONSE_CACHE_SCOPE", "stateless").lower()
+        self.response_cache_semantic = flag("RESPONSE_CACHE_SEMANTIC", "false")
+        self.response_cache_similarity = number("RESPONSE_CACHE_SIMILARITY", "0.92")
+
+        # Concurrent requests with an identical prompt (system prompt, history, message, model) share one LLM call
+        self.coalescing_enabled = flag("COALESCING_ENABLED", "true")
+
+        # Outbound Connector calls: token buckets per conversation and per bot (Teams throttling limits),
+        # retries with backoff honouring Retry-After, undeliverable activities appended to a JSON-lines file
+        # (rate + burst = most calls in any one second: 50 per bot, 7 per conversation)
+        self.outbound_global_rate = number("OUTBOUND_GLOBAL_RATE", "40")
+        self.outbound_global_burst = integer("OUTBOUND_GLOBAL_BURST", "10")
+        self.outbound_conversation_rate = number("OUTBOUND_CONVERSATION_RATE", "1")
+        self.outbound_conversation_burst = integer("OUTBOUND_CONVERSATION_BURST", "6")
+        self.outbound_max_attempts = integer("OUTBOUND_MAX_ATTEMPTS", "5")
+        self.outbound_dead_letter_path = get("OUTBOUND_DEAD_LETTER_PATH", "")
+        self.broadcast_concurrency = integer("BROADCAST_CONCURRENCY", "50")
+
+        # Proactive notifications: the conversation reference of every personal chat is kept in NOTIFY_SQLITE_PATH
+        # (a file on this host, like the other SQLite stores), and POST /api/notify with "Authorization: Bearer
+        # <NOTIFY_API_KEY>" and {"text", "tenant" / "domain" / "users"} sends a message to the selected users as a
+        # background job (BROADCAST_CONCURRENCY sends in flight, within the outbound rate limits above); GET
+        # /api/notify/<job id> reports its progress. Unfinished jobs resume after a restart. Empty key = every call refused
+        self.notify_enabled = flag("NOTIFY_ENABLED", "false")
+        self.notify_sqlite_path = get("NOTIFY_SQLITE_PATH", "")
+        self.notify_api_key = get("NOTIFY_API_KEY", "")
+
+        # Redelivered Activities (same conversation + activity id within the TTL) are acknowledged without a reply;
+        # backend "memory" (per process), "sqlite" (shared file) or "redis" (shared by scaled-out instances)
+        self.dedup_enabled = flag("DEDUP_ENABLED", "true")
+        self.dedup_backend = get("DEDUP_BACKEND", "memory").lower()
+        self.dedup_ttl_seconds = integer("DEDUP_TTL_SECONDS", "600")
+        self.dedup_sqlite_path = get("DEDUP_SQLITE_PATH", "")
+        self.dedup_redis_url = get("DEDUP_REDIS_URL", "")
+
+        # Latency tracing: per-stage histograms on /api/metrics, requests slower than TRACE_SLOW_MS log their spans;
+        # OTEL_ENABLED also exports spans through OTLP (OTEL_EXPORTER_OTLP_ENDPOINT, needs the optional opentelemetry packages)
+        self.trace_slow_ms = integer("TRACE_SLOW_MS", "5000")
+        self.otel_enabled = flag("OTEL_ENABLED", "false")
+        self.otel_service_name = get("OTEL_SERVICE_NAME", "fresh-teams-bot")
+
+        # Logging: one JSON event per step, message text and user identifiers redacted unless LOG_REDACT_PII=false;
+        # per level a sampling rate (fraction kept, e.g. "DEBUG:0.1") and a limit in events per second
+        self.log_level = get("LOG_LEVEL", "INFO").upper()
+        self.log_redact_pii = flag("LOG_REDACT_PII", "true")
+        self.log_sample_rates = get("LOG_SAMPLE_RATES", "")
+        self.log_rate_limits = get("LOG_RATE_LIMITS", "DEBUG:20,INFO:20,WARNING:20")
+
+        # Message processing mode: "sync" replies before returning 200,
+        # "queue" acknowledges with 202 and lets background workers reply
+        self.message_processing_mode = get("MESSAGE_PROCESSING_MODE", "sync").lower()
+        self.work_queue_backend = get("WORK_QUEUE_BACKEND", "memory").lower()
+        self.work_queue_maxsize = integer("WORK_QUEUE_MAXSIZE", "1000")
+        self.work_queue_workers = integer("WORK_QUEUE_WORKERS", "4")
+        self.work_queue_sqlite_path = get("WORK_QUEUE_SQLITE_PATH", "")
+
+    @property
+    def azure_openai_configured(self):
+        return bool(self.azure_openai_endpoint and self.azure_openai_api_key)
+
+    @property
+    def embedding(self):
+        """The EmbeddingBackend for the semantic response cache and retrieval"""
+        entry = self.embedding_backend.strip()
+        named = bool(entry)  # only EMBEDDING_BACKEND names an embedding model, LLM_BACKENDS name chat models
+        if not named:
+            entry = next(filter(None, (part.strip() for part in self.llm_backends.split(","))), "")
+        kind, _, target = entry.partition(":")
+        fields = target.split("|")
+        if kind == "azure":
+            return EmbeddingBackend("azure", fields[0] if named and fields[0] else self.azure_openai_embedding_deployment,
+                                    fields[1] if len(fields) > 1 and fields[1] else self.azure_openai_endpoint,
+                                    fields[2] if len(fields) > 2 and fields[2] else None)
+        if kind == "ollama":
+            return EmbeddingBackend("ollama", fields[1] if named and len(fields) > 1 and fields[1]
+                                    else self.llama3_embedding_model, fields[0].rstrip("/"), None)
+        if self.llm_provider == "azure":
+            return EmbeddingBackend("azure", self.azure_openai_embedding_deployment, self.azure_openai_endpoint, None)
+        return EmbeddingBackend("ollama", self.llama3_embedding_model, self.llama3_api_url.rstrip("/"), None)
+
+    @property
+    def embedding_model(self):
+        """The model texts are embedded with (compared with the one a document index was built with)"""
+        return self.embedding.model
+
+    def reread(self):
+        """The settings read again from the environment (after local.settings.json was reloaded), same defaults"""
+        return Settings(self.defaults, self.environ)
+
+    def _get(self, name, default):
+        return self.environ.get(name, self.defaults.get(name, default))
+
+    def _flag(self, name, default):
+        return self._get(name, default).lower() == "true"
+
+    def _int(self, name, default):
+        return int(self._get(name, default))
+
+    def _float(self, name, default):
+        return float(self._get(name, default))
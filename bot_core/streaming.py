@@ -0,0 +1,107 @@
+"""
+Streaming helpers: incremental LLM output and progressive Teams messages
+
+The reply is shown as soon as the first tokens arrive: a typing indicator
+is sent first, the first chunk is posted as a new message, and that same
+activity is then updated in place (Connector PUT) at a throttled cadence
+so Teams' per-conversation rate limits are respected.
+"""
+
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def _ollama_line(line):
+    """The content delta of one line of an Ollama /api/chat NDJSON stream, and the chunk itself"""
+    chunk = json.loads(line)
+    if chunk.get("error"):
+        raise RuntimeError(chunk["error"])
+    return chunk.get("message", {}).get("content", ""), chunk
+
+
+async def iter_ollama_chunks(response, on_done=None):
+    """Yield content deltas from an Ollama /api/chat NDJSON stream
+
+    `on_done` is called with the final chunk, which carries the eval statistics.
+    """
+    async for line in response.aiter_lines():
+        if not line.strip():
+            continue
+        content, chunk = _ollama_line(line)
+        if content:
+            yield content
+        if chunk.get("done"):
+            if on_done is not None:
+                on_done(chunk)
+            break
+
+
+def _openai_delta(chunk):
+    # Azure sends prompt-filter results as chunks without choices
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+
+async def iter_openai_chunks(stream):
+    """Yield content deltas from an OpenAI chat completion stream"""
+    async for chunk in stream:
+        content = _openai_delta(chunk)
+        if content:
+            yield content
+
+
+class ProgressiveReply:
+    """Accumulates streamed text and mirrors it into a single Teams message
+
+    `post(activity)` must create an activity and return its id (or None),
+    `update(activity_id, activity)` must replace it; both are coroutines.
+    """
+
+    def __init__(self, post, update, make_activity, interval=1.0, clock=time.monotonic):
+        self.post = post
+        self.update = update
+        self.make_activity = make_activity
+        self.interval = interval
+        self.clock = clock
+        self.text = ""
+        self.activity_id = None
+        self.updates = 0
+        self._flushed_text = ""
+        self._last_flush = None
+
+    async def start(self):
+        """Show a typing indicator until the first chunk arrives"""
+        await self.post({"type": "typing"})
+
+    async def append(self, delta):
+        """Add a chunk; flushes to Teams when the throttle interval has passed"""
+        self.text += delta
+        if self._due():
+            await self._flush()
+
+    async def finish(self):
+        """Send the final text; returns True if it reached Teams"""
+        if self.activity_id is None:
+            self.activity_id = await self.post(self.make_activity(self.text))
+            return self.activity_id is not None
+        if self.text != self._flushed_text:
+            return await self._flush()
+        return True
+
+    async def _flush(self):
+        self._last_flush = self.clock()
+        if self.activity_id is None:
+            self.activity_id = await self.post(self.make_activity(self.text))
+            ok = self.activity_id is not None
+        else:
+            ok = await self.update(self.activity_id, self.make_activity(self.text))
+            self.updates += 1
+        if ok:
+            self._flushed_text = self.text
+        return ok
+
+    def _due(self):
+        # The first chunk is shown immediately, later ones at most once per interval
+        return self._last_flush is None or self.clock() - self._last_flush >= self.interval
@@ -0,0 +1,147 @@
+"""
+Structured, cheap logging for the request hot path
+
+`log.info("reply_sent", conversation_id=..., text=...)` logs one JSON
+object per event instead of a series of f-strings. Nothing is formatted
+unless a handler actually emits the record: disabled levels return after
+one check, and the JSON is only built when the record's message is read.
+
+Per level, events can be sampled (keep a fraction) and rate limited
+(at most n per second; the number dropped is logged once the next second
+starts). Message bodies are redacted to their length and user identifiers
+replaced by a short hash unless redaction is turned off, so logs can be
+correlated per user without storing who the user is or what they wrote.
+"""
+
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+
+# Free text written by or for the user: logged as its length only
+REDACTED_FIELDS = frozenset({"text", "reply", "user_message", "prompt", "user_name"})
+# Identifiers of a person: logged as a stable short hash
+HASHED_FIELDS = frozenset({"user_id", "aad_object_id", "upn", "email"})
+
+MAX_FIELD_LENGTH = 200
+
+
+def parse_level_map(spec):
+    """Parse "INFO:20,DEBUG:5" into {logging.INFO: 20.0, logging.DEBUG: 5.0}"""
+    levels = {}
+    for entry in (spec or "").split(","):
+        name, _, value = entry.strip().partition(":")
+        level = logging.getLevelName(name.strip().upper())
+        if isinstance(level, int) and value.strip():
+            levels[level] = float(value)
+    return levels
+
+
+def _pseudonym(value):
+    return "h:" + hashlib.blake2b(str(value).encode(), digest_size=6).hexdigest()
+
+
+def redact(fields):
+    """Copy of `fields` with message bodies and user identifiers removed"""
+    clean = {}
+    for name, value in fields.items():
+        if value is None or value == "":
+            clean[name] = value
+        elif name in REDACTED_FIELDS:
+            clean[name] = f"<{len(str(value))} chars>"
+        elif name in HASHED_FIELDS:
+            clean[name] = _pseudonym(value)
+        else:
+            clean[name] = value
+    return clean
+
+
+class _Event:
+    """Log message rendered to JSON only when a handler formats the record"""
+
+    __slots__ = ("event", "fields", "redact")
+
+    def __init__(self, event, fields, redact):
+        self.event = event
+        self.fields = fields
+        self.redact = redact
+
+    def __str__(self):
+        fields = redact(self.fields) if self.redact else self.fields
+        record = {"event": self.event}
+        for name, value in fields.items():
+            if isinstance(value, str) and len(value) > MAX_FIELD_LENGTH:
+                value = value[:MAX_FIELD_LENGTH] + "..."
+            record[name] = value
+        return json.dumps(record, ensure_ascii=False, default=str)
+
+
+class LogPolicy:
+    """Sampling rates and per-second limits by level, plus the redaction switch
+
+    Levels missing from `sample_rates`/`rate_limits` are always logged.
+    """
+
+    def __init__(self, sample_rates=None, rate_limits=None, redact=True, clock=time.monotonic, rng=random.random):
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limits = dict(rate_limits or {})
+        self.redact = redact
+        self.clock = clock
+        self.rng = rng
+        self.stats = {"sampled_out": 0, "rate_limited": 0}
+        self._windows = {}  # level -> [second, count, dropped]
+        self._lock = threading.Lock()
+
+    def allow(self, level):
+        """Whether an event of this level is logged; returns (allowed, events dropped in the previous second)"""
+        rate = self.sample_rates.get(level)
+        if rate is not None and self.rng() >= rate:
+            self.stats["sampled_out"] += 1
+            return False, 0
+        limit = self.rate_limits.get(level)
+        if limit is None:
+            return True, 0
+        second = int(self.clock())
+        with self._lock:
+            window = self._windows.get(level)
+            dropped = 0
+            if window is None or window[0] != second:
+                dropped = window[2] if window else 0
+                window = self._windows[level] = [second, 0, 0]
+            if window[1] >= limit:
+                window[2] += 1
+                self.stats["rate_limited"] += 1
+                return False, dropped
+            window[1] += 1
+            return True, dropped
+
+
+class StructuredLogger:
+    """Event logger on top of a standard logger; fields are keyword arguments"""
+
+    def __init__(self, name, policy=None):
+        self.logger = logging.getLogger(name)
+        self.policy = policy or LogPolicy()
+
+    def _log(self, level, event, fields, exc_info=False):
+        if not self.logger.isEnabledFor(level):
+            return
+        allowed, dropped = self.policy.allow(level)
+        if dropped:
+            self.logger.log(level, _Event("log_suppressed", {"level": logging.getLevelName(level), "dropped": dropped}, False))
+        if allowed:
+            self.logger.log(level, _Event(event, fields, self.policy.redact), exc_info=exc_info, stacklevel=3)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self._log(logging.ERROR, event, fields, exc_info)
@@ -0,0 +1,147 @@
+"""
+Bot Framework access tokens, fetched once and refreshed ahead of expiry
+
+Tokens are cached per (tenant, scope). Concurrent requests for a missing
+or expired token share a single call to the token endpoint (single
+flight). A token is refreshed in the background once it enters the last
+`refresh_margin` seconds of its real `expires_in` lifetime (at most half
+of it), both on a timer and whenever it is read inside that window, so
+requests keep getting the current token while the new one is fetched.
+A failed background refresh is retried every `retry_interval` seconds
+until the old token expires.
+
+`fetch(tenant_id, scope)` returns the token endpoint's JSON (a dict with
+"access_token" and "expires_in") and is a coroutine function; the
+refreshes run as tasks on the running loop.
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+BOT_FRAMEWORK_SCOPE = "https://api.botframework.com/.default"
+DEFAULT_EXPIRES_IN = 3599
+
+
+class _Token:
+    __slots__ = ("value", "expires_at", "refresh_at")
+
+    def __init__(self, value, expires_at, refresh_at):
+        self.value = value
+        self.expires_at = expires_at
+        self.refresh_at = refresh_at
+
+
+class AsyncTokenManager:
+    """Token cache for a coroutine fetch function, refreshed by tasks on the running event loop"""
+
+    def __init__(self, fetch, refresh_margin=300, retry_interval=30, clock=time.time):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.clock = clock
+        self.stats = {"fetches": 0, "failures": 0, "background_refreshes": 0}
+        self._tokens = {}  # (tenant_id, scope) -> _Token
+        self._inflight = {}  # key -> Task
+        self._timers = {}  # key -> TimerHandle
+
+    async def get(self, tenant_id, scope=BOT_FRAMEWORK_SCOPE):
+        """Return a valid token, fetching it only if none is cached"""
+        key = (tenant_id, scope)
+        now = self.clock()
+        token = self._valid(key, now)
+        if token is not None:
+            if now >= token.refresh_at:
+                self._refresh_in_background(key)
+            return token.value
+        # shield: a caller that gets cancelled must not cancel the shared fetch
+        return (await asyncio.shield(self._start(key))).value
+
+    def prefetch(self, tenant_id, scope=BOT_FRAMEWORK_SCOPE):
+        """Start fetching the token in the background unless a fresh one is cached (requires a running loop)"""
+        key = (tenant_id, scope)
+        if not self._fresh(key, self.clock()):
+            self._refresh_in_background(key)
+
+    def _refresh_in_background(self, key):
+        if key not in self._inflight:
+            self.stats["background_refreshes"] += 1
+        self._start(key).add_done_callback(self._background_done)
+
+    def _start(self, key):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._fetch(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch(self, key):
+        self.stats["fetches"] += 1
+        try:
+            token_data = await self.fetch(*key)
+        except Exception as e:
+            self.stats["failures"] += 1
+            delay = self._retry_delay(key, self.clock())
+            if delay is not None:
+                logger.warning(f"Background token refresh for tenant {key[0]} failed: {e}")
+                self._schedule(key, delay)
+            raise
+        token = self._store(key, token_data, self.clock())
+        self._schedule(key, token.refresh_at - self.clock())
+        return token
+
+    def _store(self, key, token_data, now):
+        expires_in = int(token_data.get("expires_in") or DEFAULT_EXPIRES_IN)
+        token = _Token(
+            token_data["access_token"],
+            now + expires_in,
+            now + expires_in - min(self.refresh_margin, expires_in / 2)
+        )
+        self._tokens[key] = token
+        logger.info(f"Bot access token refreshed for tenant {key[0]} (expires in {expires_in}s)")
+        return token
+
+    def _valid(self, key, now):
+        token = self._tokens.get(key)
+        return token if token is not None and now < token.expires_at else None
+
+    def _fresh(self, key, now):
+        """Whether the cached token is valid and not yet due for refresh"""
+        token = self._valid(key, now)
+        return token is not None and now < token.refresh_at
+
+    def _retry_delay(self, key, now):
+        """Seconds until the next background attempt after a failure, None once the token expired"""
+        token = self._valid(key, now)
+        return None if token is None else min(self.retry_interval, token.expires_at - now)
+
+    def _background_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug(f"Token prefetch failed: {task.exception()}")
+
+    def _schedule(self, key, delay):
+        previous = self._timers.get(key)
+        if previous is not None:
+            previous.cancel()
+        self._timers[key] = asyncio.get_running_loop().call_later(max(delay, 0), self._timer_fired, key)
+
+    def _timer_fired(self, key):
+        self._timers.pop(key, None)
+        self._refresh_in_background(key)
+
+    def close(self):
+        """Stop the refresh timers"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+
+    def snapshot(self):
+        """Counters plus seconds left per cached token"""
+        now = self.clock()
+        return dict(self.stats, tokens={
+            f"{tenant_id} {scope}": round(token.expires_at - now)
+            for (tenant_id, scope), token in self._tokens.items()
+        })
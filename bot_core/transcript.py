@@ -0,0 +1,626 @@
+"""
+Durable conversation transcript: an append-only log of every user and bot turn
+
+The history stores keep the recent messages the prompt needs and forget
+them after a TTL or a restart. TranscriptLog keeps every turn on disk, for
+audits and so that a new instance can restore a conversation's context.
+
+Records are appended to segment files in the log's directory, one record
+per message, length-prefixed:
+
+  <length u32><crc32 u32><time f64><JSON {"conversation_id", "role", "content", "tokens"}>
+
+A segment is sealed once it reaches `segment_bytes` (or the log is
+closed) and an .idx file is written next to it: the 64-bit hashes of its
+conversation ids, sorted, and per conversation the time and offset of its
+records. The .idx files are memory-mapped and nothing is loaded up front,
+so opening a log of any size takes milliseconds; tail() finds a
+conversation in each segment by binary search and reads its last N
+records through mmap. Only the entries of the segment being written (and
+of segments without an .idx: the tail of a process that did not shut
+down cleanly, scanned up to the first torn or corrupt record) are kept in
+memory.
+
+Every process appends to its own segments, named after a writer id and
+guarded by an flock on <writer>.lock while it runs, so the worker
+processes of a host (or instances sharing a file share) can use one
+directory. A process sees what was on disk when it opened plus its own
+records. It rescans the directory for the segments other processes have
+sealed or merged since then when tail() hits a segment that was compacted
+away, and at most once per `rescan_interval` seconds when tail() finds
+nothing.
+
+Once `compact_segments` segments can be compacted - this process's sealed
+segments and those of writers that are no longer running (POSIX locks;
+elsewhere only a process's own) - a background thread merges them into
+one segment, dropping records older than `retention` seconds. The merged
+segment's .idx names the segments it replaces, so an interrupted
+compaction never leaves duplicates.
+
+Print a transcript (for audits) as JSON lines:
+
+    python -m bot_core.transcript <directory> [--conversation ID] [--last N]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+
+try:
+    import orjson
+    _dumps, _loads = orjson.dumps, orjson.loads
+except ImportError:
+    _dumps = lambda value: json.dumps(value, ensure_ascii=False).encode("utf-8")
+    _loads = json.loads
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, foreign segments are left alone
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+LOCK_SUFFIX = ".lock"
+
+_HEADER = struct.Struct("<IId")        # payload length, crc32 of the payload, time
+_INDEX_MAGIC = b"TIX1"
+_INDEX_PREFIX = struct.Struct("<4sI")  # magic, length of the JSON header (padded to 8 bytes)
+_INDEX_COUNT = struct.Struct("<Q")     # number of conversations
+_INDEX_ENTRY = struct.Struct("<dQ")    # time, offset
+
+
+def _key(conversation_id):
+    return int.from_bytes(hashlib.blake2b(conversation_id.encode(), digest_size=8).digest(), "big", signed=True)
+
+
+class _Segment:
+    """A segment file; its entries come from the mmapped .idx or, while it has none, from memory"""
+
+    __slots__ = ("number", "name", "writer", "compacted", "first", "last", "size", "map", "entries", "index",
+                 "keys", "starts", "base")
+
+    def __init__(self, number, name, compacted=False, first=None, last=None, size=0):
+        self.number = number
+        self.name = name
+        self.writer = name.rsplit("-", 1)[0]
+        self.compacted = compacted
+        self.first = first
+        self.last = last
+        self.size = size
+        self.map = None
+        self.entries = {}  # conversation id -> packed (time, offset) entries
+        self.index = self.keys = self.starts = None
+        self.base = 0
+
+    def extend(self, timestamp, size):
+        self.first = timestamp if self.first is None else min(self.first, timestamp)
+        self.last = timestamp if self.last is None else max(self.last, timestamp)
+        self.size += size
+
+    def add(self, conversation_id, timestamp, offset):
+        self.entries.setdefault(conversation_id, bytearray()).extend(_INDEX_ENTRY.pack(timestamp, offset))
+
+    def attach_index(self, path):
+        """Use the .idx at `path` instead of in-memory entries; returns its JSON header"""
+        with open(path, "rb") as f:
+            index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, length = _INDEX_PREFIX.unpack_from(index, 0)
+            if magic != _INDEX_MAGIC:
+                raise ValueError("not a transcript index")
+            position = _INDEX_PREFIX.size + length
+            header = json.loads(index[_INDEX_PREFIX.size:position])
+            (count,) = _INDEX_COUNT.unpack_from(index, position)
+            position += _INDEX_COUNT.size
+            with memoryview(index) as view:
+                self.keys = view[position:position + 8 * count].cast("q")
+                position += 8 * count
+                self.starts = view[position:position + 8 * (count + 1)].cast("Q")
+            self.base = position + 8 * (count + 1)
+        except Exception:
+            self.release_index()
+            index.close()
+            raise
+        self.index = index
+        self.entries = None
+        return header
+
+    def lookup(self, key, conversation_id, n):
+        """The (time, offset) of a conversation's last `n` records in this segment"""
+        if self.entries is not None:
+            packed = self.entries.get(conversation_id)
+            return list(_INDEX_ENTRY.iter_unpack(packed[-n * _INDEX_ENTRY.size:])) if packed else []
+        i = bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return []
+        start, end = self.starts[i], self.starts[i + 1]
+        start = max(start, end - n)
+        return list(_INDEX_ENTRY.iter_unpack(self.index[self.base + start * _INDEX_ENTRY.size:
+                                                         self.base + end * _INDEX_ENTRY.size]))
+
+    def release_index(self):
+        for view in (self.keys, self.starts):
+            if view is not None:
+                view.release()
+        self.keys = self.starts = None
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.release_index()
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+
+def _encode(conversation_id, message, timestamp):
+    record = {"conversation_id": conversation_id, "role": message["role"], "content": message["content"]}
+    if message.get("tokens") is not None:
+        record["tokens"] = message["tokens"]
+    payload = _dumps(record)
+    return _HEADER.pack(len(payload), zlib.crc32(payload), timestamp) + payload
+
+
+def _decode(buffer, offset):
+    """(time, record dict, end offset) of the record at `offset`; ValueError if it is torn or corrupt"""
+    if offset + _HEADER.size > len(buffer):
+        raise ValueError("torn record header")
+    length, crc, timestamp = _HEADER.unpack_from(buffer, offset)
+    start, end = offset + _HEADER.size, offset + _HEADER.size + length
+    if end > len(buffer):
+        raise ValueError("torn record")
+    payload = buffer[start:end]
+    if zlib.crc32(payload) != crc:
+        raise ValueError("checksum mismatch")
+    return timestamp, _loads(payload), end
+
+
+def _message(record):
+    message = {"role": record["role"], "content": record["content"]}
+    if record.get("tokens") is not None:
+        message["tokens"] = record["tokens"]
+    return message
+
+
+def _records(path):
+    """(offset, time, record, raw bytes) of a segment's records up to the first torn or corrupt one"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            offset = 0
+            while offset < len(buffer):
+                try:
+                    timestamp, record, end = _decode(buffer, offset)
+                except ValueError as e:
+                    logger.warning(f"Transcript segment {os.path.basename(path)} ends at a bad record "
+                                   f"(offset {offset}): {e}")
+                    return
+                yield offset, timestamp, record, buffer[offset:end]
+                offset = end
+
+
+def _write_index(path, header, entries):
+    """Write an .idx file (atomically) for {conversation id: packed (time, offset) entries}"""
+    header = json.dumps(header).encode("utf-8")
+    header += b" " * (-(_INDEX_PREFIX.size + len(header)) % 8)
+    groups = sorted((_key(conversation_id), packed) for conversation_id, packed in entries.items())
+    keys, starts = array("q"), array("Q", [0])
+    for key, packed in groups:
+        keys.append(key)
+        starts.append(starts[-1] + len(packed) // _INDEX_ENTRY.size)
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(_INDEX_PREFIX.pack(_INDEX_MAGIC, len(header)) + header + _INDEX_COUNT.pack(len(keys)))
+        f.write(keys.tobytes())
+        f.write(starts.tobytes())
+        for _, packed in groups:
+            f.write(packed)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+class TranscriptLog:
+    """Append-only, segmented transcript of every conversation (thread-safe)"""
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, retention=90 * 86400, compact_segments=8,
+                 fsync=False, rescan_interval=5.0, clock=time.time):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.retention = retention
+        self.compact_segments = compact_segments
+        self.fsync = fsync
+        self.rescan_interval = rescan_interval
+        self.clock = clock
+        self.stats = {"appended": 0, "appended_bytes": 0, "append_failures": 0, "restored": 0, "replayed": 0,
+                      "unreadable": 0, "rescans": 0, "sealed": 0, "compactions": 0, "compacted_records": 0,
+                      "expired_bytes": 0, "compaction_failures": 0}
+        self._lock = threading.Lock()
+        self._segments = {}  # number -> _Segment
+        self._numbers = 0
+        self._compaction = None
+        self._rescanned_at = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self.writer = f"{int(clock() * 1000):013d}-{os.getpid()}"
+        self._writer_lock = self._lock_writer(self.writer)
+        self._sequence = 0
+        started = time.perf_counter()
+        self._load()
+        self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+        self._open_segment()
+        logger.info(f"Transcript log {directory}: {len(self._segments) - 1} segments opened in {self.load_ms}ms")
+        with self._lock:
+            self._maybe_compact()
+
+    def _path(self, name, suffix=SEGMENT_SUFFIX):
+        return os.path.join(self.directory, name + suffix)
+
+    def _add_segment(self, name, **fields):
+        segment = _Segment(self._numbers, name, **fields)
+        self._segments[segment.number] = segment
+        self._numbers += 1
+        return segment
+
+    def _lock_writer(self, writer):
+        """Hold the writer's lock file; None if another process holds it"""
+        if fcntl is None:
+            return -1 if writer == self.writer else None
+        fd = os.open(self._path(writer, LOCK_SUFFIX), os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    def _unlock_writer(self, writer, fd, remove=True):
+        if remove:
+            try:
+                os.remove(self._path(writer, LOCK_SUFFIX))
+            except OSError:
+                pass
+        if fd is not None and fd >= 0:
+            os.close(fd)
+
+    def _load(self):
+        names = set(os.listdir(self.directory))
+        replaced = set()
+        segments = []
+        for name in sorted(name[:-len(SEGMENT_SUFFIX)] for name in names if name.endswith(SEGMENT_SUFFIX)):
+            segment = self._add_segment(name)
+            segments.append(segment)
+            if name + INDEX_SUFFIX not in names:
+                continue
+            try:
+                header = segment.attach_index(self._path(name, INDEX_SUFFIX))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Transcript index {name}{INDEX_SUFFIX} unreadable, scanning the segment: {e}")
+                continue
+            segment.compacted = header.get("compacted", False)
+            segment.first, segment.last, segment.size = header["first"], header["last"], header["size"]
+            replaced.update(header.get("replaces", ()))
+        for segment in segments:
+            if segment.name in replaced:
+                # Left behind by a compaction that stopped before deleting them
+                self._drop(segment)
+            elif segment.entries is not None:
+                self._scan(segment)
+
+    def _scan(self, segment):
+        for offset, timestamp, record, raw in _records(self._path(segment.name)):
+            segment.add(record["conversation_id"], timestamp, offset)
+            segment.extend(timestamp, len(raw))
+
+    def _forget(self, segment):
+        segment.close()
+        self._segments.pop(segment.number, None)
+
+    def _drop(self, segment):
+        self._forget(segment)
+        for suffix in (SEGMENT_SUFFIX, INDEX_SUFFIX):
+            try:
+                os.remove(self._path(segment.name, suffix))
+            except OSError:
+                pass
+
+    def _open_segment(self):
+        self._sequence += 1
+        self._active = self._add_segment(f"{self.writer}-{self._sequence:06d}")
+        self._file = open(self._path(self._active.name), "ab", buffering=0)
+
+    def _seal(self):
+        """Close the active segment and write its .idx"""
+        segment = self._active
+        os.fsync(self._file.fileno())
+        self._file.close()
+        if segment.size == 0:
+            self._drop(segment)
+            return
+        path = self._path(segment.name, INDEX_SUFFIX)
+        _write_index(path, {"size": segment.size, "first": segment.first, "last": segment.last}, segment.entries)
+        segment.attach_index(path)
+        self.stats["sealed"] += 1
+
+    def append(self, conversation_id, role, content):
+        """Add one message to a conversation's transcript"""
+        self.extend(conversation_id, [{"role": role, "content": content}])
+
+    def extend(self, conversation_id, messages):
+        """Add messages (dicts with "role", "content" and optionally "tokens") in one write
+
+        A failed write is logged and counted, never raised: the transcript
+        does not fail a reply.
+        """
+        now = self.clock()
+        records = [_encode(conversation_id, message, now) for message in messages]
+        with self._lock:
+            segment = self._active
+            start = segment.size
+            try:
+                self._file.write(b"".join(records))
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except OSError as e:
+                self.stats["append_failures"] += 1
+                logger.warning(f"Transcript append failed for {conversation_id}: {e}")
+                try:
+                    self._file.truncate(start)  # no torn record in front of the next ones
+                except OSError:
+                    pass
+                return
+            for record in records:
+                segment.add(conversation_id, now, segment.size)
+                segment.extend(now, len(record))
+            self.stats["appended"] += len(records)
+            self.stats["appended_bytes"] += segment.size - start
+            if segment.size >= self.segment_bytes:
+                self._seal()
+                self._open_segment()
+                self._maybe_compact()
+
+    def _read(self, segment, offset):
+        if segment.map is None or len(segment.map) < segment.size:
+            # The active segment grows: map it again when a record lies past the current mapping
+            if segment.map is not None:
+                segment.map.close()
+            with open(self._path(segment.name), "rb") as f:
+                segment.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        timestamp, record, _ = _decode(segment.map, offset)
+        return timestamp, record
+
+    def tail(self, conversation_id, n, since=None):
+        """The last `n` messages of a conversation, oldest first; only those written after `since`"""
+        key = _key(conversation_id)
+        with self._lock:
+            messages, complete = self._tail(key, conversation_id, n, since)
+            if not complete or (not messages and time.monotonic() - self._rescanned_at >= self.rescan_interval):
+                # Segments other processes sealed or merged since the log was opened
+                if self._rescan():
+                    messages, _ = self._tail(key, conversation_id, n, since)
+            if messages:
+                self.stats["restored"] += 1
+                self.stats["replayed"] += len(messages)
+        messages.reverse()
+        return messages
+
+    def _tail(self, key, conversation_id, n, since):
+        """(a conversation's last messages, newest first; False if a segment was compacted away meanwhile)"""
+        messages = []
+        complete = True
+        found = []
+        for segment in self._segments.values():
+            found.extend((timestamp, segment.number, offset)
+                         for timestamp, offset in segment.lookup(key, conversation_id, n))
+        found.sort()
+        for timestamp, number, offset in reversed(found[-n:]):
+            if since is not None and timestamp < since:
+                break
+            try:
+                _, record = self._read(self._segments[number], offset)
+            except FileNotFoundError:
+                complete = False  # merged (or expired) by another process's compaction
+                continue
+            except (OSError, ValueError) as e:
+                self.stats["unreadable"] += 1
+                logger.warning(f"Transcript record of {conversation_id} unreadable: {e}")
+                break
+            if record["conversation_id"] == conversation_id:  # not a 64-bit hash collision
+                messages.append(_message(record))
+        return messages, complete
+
+    def _rescan(self):
+        """Follow other processes' seals and compactions on disk (called with the lock held); True if anything changed
+
+        A sealed or merged segment of another writer is opened once both its
+        file and its .idx are there; the segments a merged one replaces, and
+        those whose file is gone, are forgotten. This process's own segments
+        (including one its compaction is writing) are left to it.
+        """
+        self._rescanned_at = time.monotonic()
+        self.stats["rescans"] += 1
+        try:
+            names = set(os.listdir(self.directory))
+        except OSError as e:
+            logger.warning(f"Transcript directory {self.directory} unreadable: {e}")
+            return False
+        known = {segment.name: segment for segment in self._segments.values()}
+        replaced = set()
+        changed = False
+        for name in sorted(name[:-len(SEGMENT_SUFFIX)] for name in names if name.endswith(SEGMENT_SUFFIX)):
+            segment = known.get(name)
+            if (name + INDEX_SUFFIX not in names or name.rsplit("-", 1)[0] == self.writer
+                    or (segment is not None and segment.entries is None)):
+                continue
+            if segment is None:
+                segment = self._add_segment(name)
+            try:
+                header = segment.attach_index(self._path(name, INDEX_SUFFIX))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Transcript index {name}{INDEX_SUFFIX} unreadable: {e}")
+                if segment.entries is not None and name not in known:
+                    self._forget(segment)
+                continue
+            segment.compacted = header.get("compacted", False)
+            segment.first, segment.last, segment.size = header["first"], header["last"], header["size"]
+            replaced.update(header.get("replaces", ()))
+            changed = True
+        for segment in list(self._segments.values()):
+            if segment.writer == self.writer:
+                continue
+            if segment.name in replaced or segment.name + SEGMENT_SUFFIX not in names:
+                self._forget(segment)
+                changed = True
+        return changed
+
+    def _maybe_compact(self):
+        """Start a background compaction if enough segments can be merged (called with the lock held)"""
+        if self._compaction is not None or self.compact_segments <= 0:
+            return
+        cutoff = self.clock() - self.retention if self.retention else None
+        expired = lambda segment: cutoff is not None and segment.first is not None and segment.first < cutoff
+        candidates, adopted = [], {}
+        for segment in self._segments.values():
+            if segment is self._active:
+                continue
+            if segment.writer != self.writer and segment.writer not in adopted:
+                fd = self._lock_writer(segment.writer)
+                if fd is None:
+                    continue  # its writer is still running
+                adopted[segment.writer] = fd
+            if not segment.compacted or expired(segment):
+                candidates.append(segment)
+        if len(candidates) < self.compact_segments and not any(map(expired, candidates)):
+            for writer, fd in adopted.items():
+                self._unlock_writer(writer, fd, remove=False)
+            return
+        self._compaction = threading.Thread(target=self._compact, args=(candidates, adopted, cutoff),
+                                            name="transcript-compaction", daemon=True)
+        self._compaction.start()
+
+    def _compact(self, segments, adopted, cutoff):
+        started = time.perf_counter()
+        temporary = None
+        try:
+            with self._lock:
+                self._sequence += 1
+                merged = _Segment(-1, f"{self.writer}-{self._sequence:06d}", compacted=True)
+            kept, expired = 0, 0
+            temporary = self._path(merged.name) + ".tmp"
+            with open(temporary, "wb") as out:
+                for segment in segments:
+                    if cutoff is not None and segment.last is not None and segment.last < cutoff:
+                        expired += segment.size  # expired as a whole
+                        continue
+                    try:
+                        for _, timestamp, record, raw in _records(self._path(segment.name)):
+                            if cutoff is not None and timestamp < cutoff:
+                                expired += len(raw)
+                                continue
+                            merged.add(record["conversation_id"], timestamp, merged.size)
+                            merged.extend(timestamp, len(raw))
+                            out.write(raw)
+                            kept += 1
+                    except FileNotFoundError:
+                        continue  # compacted by another process in the meantime
+                out.flush()
+                os.fsync(out.fileno())
+            if merged.size:
+                # The .idx (naming the replaced segments) first: a merged segment never appears without it
+                path = self._path(merged.name, INDEX_SUFFIX)
+                _write_index(path, {"size": merged.size, "first": merged.first, "last": merged.last,
+                                    "compacted": True, "replaces": [segment.name for segment in segments]},
+                             merged.entries)
+                os.replace(temporary, self._path(merged.name))
+            else:
+                os.remove(temporary)
+
+            with self._lock:
+                if merged.size:
+                    segment = self._add_segment(merged.name, compacted=True, first=merged.first, last=merged.last,
+                                                size=merged.size)
+                    segment.attach_index(path)
+                for segment in segments:
+                    self._drop(segment)
+            self.stats["compactions"] += 1
+            self.stats["compacted_records"] += kept
+            self.stats["expired_bytes"] += expired
+            logger.info(f"Transcript compaction: {len(segments)} segments into {merged.size} bytes, {kept} records "
+                        f"kept, {expired} bytes expired, {(time.perf_counter() - started) * 1000:.0f}ms")
+        except Exception as e:
+            self.stats["compaction_failures"] += 1
+            logger.exception(f"Transcript compaction failed: {e}")
+            if temporary is not None and os.path.exists(temporary):
+                os.remove(temporary)
+        finally:
+            for writer, fd in adopted.items():
+                self._unlock_writer(writer, fd)
+            self._compaction = None
+
+    def compact(self, timeout=None):
+        """Seal the active segment, compact whatever can be merged and wait for it (up to `timeout` seconds)"""
+        with self._lock:
+            if self._active.size:
+                self._seal()
+                self._open_segment()
+            compact_segments, self.compact_segments = self.compact_segments, 1
+            try:
+                self._maybe_compact()
+            finally:
+                self.compact_segments = compact_segments
+            compaction = self._compaction
+        if compaction is not None:
+            compaction.join(timeout)
+
+    def close(self, timeout=30):
+        """Wait for a running compaction, seal the active segment and release the writer lock"""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join(timeout)
+        with self._lock:
+            self._seal()
+            for segment in self._segments.values():
+                segment.close()
+        self._unlock_writer(self.writer, self._writer_lock)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, segments=len(self._segments),
+                        bytes=sum(segment.size for segment in self._segments.values()), load_ms=self.load_ms,
+                        compacting=self._compaction is not None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a transcript log as JSON lines")
+    parser.add_argument("directory", help="transcript directory (TRANSCRIPT_PATH)")
+    parser.add_argument("--conversation", help="only this conversation id")
+    parser.add_argument("--last", type=int, default=0, help="only the last N records")
+    args = parser.parse_args()
+
+    records = []
+    for name in sorted(os.listdir(args.directory)):
+        if not name.endswith(SEGMENT_SUFFIX):
+            continue
+        for _, timestamp, record, _ in _records(os.path.join(args.directory, name)):
+            if args.conversation is None or record["conversation_id"] == args.conversation:
+                records.append((timestamp, record))
+    records.sort(key=lambda item: item[0])
+    for timestamp, record in records[-args.last:] if args.last else records:
+        sys.stdout.write(json.dumps({"time": timestamp, **record}, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
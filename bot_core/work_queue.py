@@ -0,0 +1,323 @@
+"""
+Bounded work queue for background reply generation
+
+The HTTP handlers put incoming Activities on the queue and acknowledge
+Teams with 202 right away; a pool of workers (asyncio tasks) produces the
+replies.
+The queue is either in-process (memory) or a local SQLite file that
+survives restarts and can be shared by several processes on one host.
+A job whose handler fails is retried after a jittered exponential backoff,
+unless the handler raises PermanentError (e.g. part of the reply is
+already in the conversation, so running it again would post a second one).
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "teams_bot_queue.db")
+
+
+@dataclass
+class Job:
+    """A queued unit of work"""
+    id: int
+    payload: dict
+    attempts: int = 0
+
+
+class PermanentError(Exception):
+    """Raised by a handler for a job that must not be run again"""
+
+
+class MemoryQueueBackend:
+    """In-process bounded FIFO, lost on restart; retried jobs wait out their delay on a heap"""
+
+    durable = False
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._delayed = []  # (due, job id, job) of retried jobs
+        self._ids = iter(range(1, 2**63))
+        self._lock = threading.Lock()
+
+    def put(self, payload):
+        with self._lock:
+            if self._queue.qsize() + len(self._delayed) >= self.maxsize:
+                return False
+            job_id = next(self._ids)
+        try:
+            self._queue.put_nowait(Job(job_id, payload))
+            return True
+        except queue.Full:
+            return False
+
+    def _release(self):
+        """Queue the retried jobs whose delay is over; when the next one is due (None if none is waiting)"""
+        with self._lock:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                entry = heapq.heappop(self._delayed)
+                try:
+                    self._queue.put_nowait(entry[2])
+                except queue.Full:
+                    heapq.heappush(self._delayed, entry)
+                    break
+            return self._delayed[0][0] if self._delayed else None
+
+    def get(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        while True:
+            due = self._release()
+            wait = (deadline if due is None else min(deadline, due)) - time.monotonic()
+            try:
+                return self._queue.get(timeout=max(0.0, wait))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    return None
+
+    def ack(self, job):
+        pass
+
+    def retry(self, job, delay=0.0):
+        job.attempts += 1
+        with self._lock:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, job.id, job))
+        return True
+
+    def size(self):
+        return self._queue.qsize() + len(self._delayed)
+
+
+class SqliteQueueBackend:
+    """Durable bounded FIFO in a local SQLite file
+
+    Jobs are claimed rather than deleted on get(); a claimed job that is not
+    acknowledged within `visibility_timeout` seconds (e.g. the worker died)
+    becomes visible again. A retried job is not claimed before its
+    `not_before` time.
+    """
+
+    durable = True
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, maxsize=1000, visibility_timeout=300, poll_interval=0.5):
+        self.path = path
+        self.maxsize = maxsize
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " payload TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " claimed_at REAL,"
+            " not_before REAL)"
+        )
+        # Queue files created before retries were delayed lack the column
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "not_before" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_claimed ON jobs (claimed_at, id)")
+
+    def put(self, payload):
+        data = json.dumps(payload)
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()
+            if count >= self.maxsize:
+                return False
+            self._conn.execute("INSERT INTO jobs (payload) VALUES (?)", (data,))
+            self._not_empty.notify()
+        return True
+
+    def _claim(self):
+        now = time.time()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute(
+                "SELECT id, payload, attempts FROM jobs"
+                " WHERE (claimed_at IS NULL OR claimed_at < ?) AND (not_before IS NULL OR not_before <= ?)"
+                " ORDER BY id LIMIT 1",
+                (now - self.visibility_timeout, now)
+            ).fetchone()
+            if row:
+                self._conn.execute("UPDATE jobs SET claimed_at = ? WHERE id = ?", (now, row[0]))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        if not row:
+            return None
+        return Job(row[0], json.loads(row[1]), row[2])
+
+    def get(self, timeout=1.0):
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                job = self._claim()
+                if job:
+                    return job
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                # Other processes may insert too, so never sleep longer than the poll interval
+                self._not_empty.wait(min(remaining, self.poll_interval))
+
+    def ack(self, job):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+
+    def retry(self, job, delay=0.0):
+        job.attempts += 1
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET claimed_at = NULL, attempts = ?, not_before = ? WHERE id = ?",
+                (job.attempts, time.time() + delay, job.id)
+            )
+            self._not_empty.notify()
+        return True
+
+    def size(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+
+def create_backend(kind="memory", maxsize=1000, sqlite_path=DEFAULT_SQLITE_PATH):
+    """Create a queue backend by name ("memory" or "sqlite")"""
+    kind = (kind or "memory").lower()
+    if kind == "sqlite":
+        return SqliteQueueBackend(sqlite_path or DEFAULT_SQLITE_PATH, maxsize=maxsize)
+    if kind != "memory":
+        logger.warning(f"Unknown work queue backend: {kind}, falling back to memory")
+    return MemoryQueueBackend(maxsize=maxsize)
+
+
+class WorkQueue:
+    """Bounded queue drained by a pool of workers
+
+    `handler` is a coroutine function awaited with each payload; if it
+    raises, the job is retried up to `max_attempts` times, the n-th retry
+    after a random delay of up to `retry_delay` * 2^(n-1) seconds (at most
+    `max_retry_delay`), before being dropped. A PermanentError drops it
+    right away. The workers are tasks of the loop that first calls submit().
+    """
+
+    def __init__(self, backend, handler, workers=4, max_attempts=3, retry_delay=2.0, max_retry_delay=60.0,
+                 name="bot-worker", poll_interval=0.5, rng=random.random):
+        self.backend = backend
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.rng = rng
+        self.name = name
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._busy = 0  # jobs being handled right now
+        self._wakeup = None
+        self._stopping = False
+
+    def start(self):
+        """Start the workers on the running loop (idempotent)"""
+        if self._tasks:
+            return
+        self._stopping = False
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        for i in range(self.workers):
+            self._tasks.append(loop.create_task(self._run(), name=f"{self.name}-{i}"))
+        logger.info(f"Work queue started with {self.workers} workers ({type(self.backend).__name__})")
+
+    def stop(self):
+        """Signal the workers to finish their current job and exit"""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        self._tasks = []
+
+    async def drain(self, timeout=30.0, poll_interval=0.1):
+        """Let the workers finish the jobs in hand, and those still queued in memory, then stop them
+
+        Jobs of a durable backend stay queued for the next process. Returns
+        True if everything was handled within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+
+        def pending():
+            return self._busy + (0 if self.backend.durable else self.backend.size())
+
+        while pending() and time.monotonic() < deadline:
+            await asyncio.sleep(poll_interval)
+        drained = not pending()
+        self.stop()
+        return drained
+
+    async def submit(self, payload):
+        """Enqueue a payload; returns False when the queue is full"""
+        if not self._tasks:
+            self.start()
+        accepted = await self._backend_call(self.backend.put, payload)
+        if accepted and self._wakeup is not None:
+            self._wakeup.set()
+        return accepted
+
+    def size(self):
+        return self.backend.size()
+
+    def _failed(self, job, error):
+        if isinstance(error, PermanentError):
+            # exc_info=error: this runs on a thread for a durable backend, outside the except block
+            logger.error(f"Job {job.id} dropped, not retried: {error}", exc_info=error)
+            self.backend.ack(job)
+        elif job.attempts + 1 < self.max_attempts:
+            # Full jitter keeps the jobs of a burst that failed together (e.g. an LLM outage) from retrying together
+            delay = self.rng() * min(self.max_retry_delay, self.retry_delay * 2 ** job.attempts)
+            logger.warning(f"Job {job.id} failed (attempt {job.attempts + 1}): {error} - retry in {delay:.1f}s")
+            if not self.backend.retry(job, delay):
+                logger.error(f"Job {job.id} dropped, queue is full")
+        else:
+            logger.error(f"Job {job.id} dropped after {job.attempts + 1} attempts: {error}", exc_info=error)
+            self.backend.ack(job)
+
+    async def _backend_call(self, method, *args):
+        # A durable backend is a SQLite file: its calls run on a thread, off the event loop
+        if self.backend.durable:
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def _run(self):
+        while not self._stopping:
+            # Clear before polling: submit() sets it on this loop after the put, so a wakeup can't be lost in between
+            self._wakeup.clear()
+            job = await self._backend_call(self.backend.get, 0)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._busy += 1
+            try:
+                await self.handler(job.payload)
+                await self._backend_call(self.backend.ack, job)
+            except Exception as e:
+                await self._backend_call(self._failed, job, e)
+            finally:
+                self._busy -= 1
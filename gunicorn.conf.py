@@ -0,0 +1,54 @@
+"""
+Production serving of app_simple.py (Flask) with gunicorn
+
+    gunicorn -c gunicorn.conf.py app_simple:app
+
+GUNICORN_WORKERS processes, each with GUNICORN_THREADS threads: a request
+thread waits while the worker's event loop thread generates its reply, so
+threads (gthread workers) carry the concurrency and processes add CPU and
+isolation. With more than one worker, app_simple.py
+moves conversation history, the dedup index and the work queue from the
+per-process "memory" backends to SQLite files shared on this host (see
+BOT_WORKER_PROCESSES there) and each worker takes its share of the
+host-wide limits: OLLAMA_NUM_PARALLEL, ADMISSION_MAX_CONCURRENCY,
+BROADCAST_CONCURRENCY and the per-bot outbound rate (OUTBOUND_GLOBAL_RATE,
+OUTBOUND_GLOBAL_BURST, split so the workers together stay within Teams'
+limit). Bot tokens, caches and counters stay per worker; each worker
+fetches its own token and /api/metrics shows the worker that answered the
+scrape.
+
+On SIGTERM a worker stops accepting connections, finishes its in-flight
+requests, then lets queued replies finish (worker_exit), all within
+GRACEFUL_TIMEOUT_SECONDS.
+"""
+
+import os
+import sys
+
+# Listen address and worker pool
+bind = f"0.0.0.0:{os.environ.get('PORT', '7071')}"
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "16"))
+
+# An LLM reply (30 s timeout) plus Connector retries must fit into one request
+timeout = int(os.environ.get("GUNICORN_TIMEOUT_SECONDS", "120"))
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT_SECONDS", "60"))
+keepalive = 75  # Bot Framework keeps connections open; stay above the front end's idle timeout
+
+# Every worker imports the app itself: its event loop thread (token refresh, reply workers) doesn't survive a fork
+preload_app = False
+
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("LOG_LEVEL", "info").lower()
+
+# Tell the app how many processes share the work (inherited by the forked workers)
+os.environ["BOT_WORKER_PROCESSES"] = str(workers)
+
+
+def worker_exit(server, worker):
+    """Let the exiting worker's queued replies finish"""
+    app_simple = sys.modules.get("app_simple")
+    if app_simple is not None:
+        app_simple.shutdown()
@@ -0,0 +1,92 @@
+"""AdmissionController: quotas, queueing and the wait timeout"""
+
+import asyncio
+
+import pytest
+
+from bot_core.admission import AdmissionController, Rejected
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def try_admit(admission, user_id, tenant_id):
+    try:
+        async with admission.admit(user_id, tenant_id):
+            return None
+    except Rejected as e:
+        return e.reason
+
+
+def test_user_quota_refills_over_time():
+    clock = Clock()
+    admission = AdmissionController(user_rate=1.0, user_burst=2, clock=clock)
+
+    async def run():
+        reasons = [await try_admit(admission, "user", "tenant") for _ in range(3)]
+        clock.now += 1.0
+        reasons.append(await try_admit(admission, "user", "tenant"))
+        return reasons
+
+    assert asyncio.run(run()) == [None, None, "user_quota", None]
+    assert admission.stats["user_quota"] == 1
+
+
+def test_tenant_rejection_does_not_use_up_the_user_quota():
+    clock = Clock()
+    admission = AdmissionController(user_rate=1e-9, user_burst=2, tenant_rate=1e-9, tenant_burst=1, clock=clock)
+
+    async def run():
+        return [await try_admit(admission, "user", "tenant"), await try_admit(admission, "user", "tenant"),
+                await try_admit(admission, "user", "other-tenant")]
+
+    # The tenant_quota rejection left the user's second message for the other tenant
+    assert asyncio.run(run()) == [None, "tenant_quota", None]
+
+
+def test_waiter_times_out_when_no_slot_frees_up():
+    admission = AdmissionController(max_concurrency=1, adaptive=False, max_wait=0.05)
+
+    async def run():
+        async with admission.admit("user-1", "tenant"):
+            with pytest.raises(Rejected) as rejected:
+                async with admission.admit("user-2", "tenant"):
+                    pass
+        return rejected.value.reason
+
+    assert asyncio.run(run()) == "timeout"
+    assert admission.active == 0
+    assert admission.snapshot()["waiting"] == 0
+
+
+def test_waiter_gets_the_slot_when_it_is_released():
+    admission = AdmissionController(max_concurrency=1, adaptive=False, max_wait=5)
+    order = []
+
+    async def job(name, seconds):
+        async with admission.admit(name, "tenant"):
+            order.append(name)
+            await asyncio.sleep(seconds)
+
+    async def run():
+        await asyncio.gather(job("first", 0.02), job("second", 0))
+
+    asyncio.run(run())
+    assert order == ["first", "second"]
+    assert admission.stats["queued"] == 1
+    assert admission.active == 0
+
+
+def test_full_queue_is_rejected_as_overloaded():
+    admission = AdmissionController(max_concurrency=1, adaptive=False, max_queue=0)
+
+    async def run():
+        async with admission.admit("user-1", "tenant"):
+            return await try_admit(admission, "user-2", "tenant")
+
+    assert asyncio.run(run()) == "overloaded"
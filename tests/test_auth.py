@@ -0,0 +1,81 @@
+"""JwtValidator against a generated key set (needs PyJWT[crypto])"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from bot_core.activity import as_activity
+from bot_core.auth import BOT_FRAMEWORK_ISSUER, JwtValidator, Unauthorized
+
+jwt = pytest.importorskip("jwt")
+rsa = pytest.importorskip("cryptography.hazmat.primitives.asymmetric.rsa")
+
+APP_ID = "4f9d1c2e-8a7b-4e3f-9c6d-5b2a1e8f7d6c"
+SERVICE_URL = "https://smba.trafficmanager.net/emea/"
+KID = "test-key"
+
+
+@pytest.fixture(scope="module")
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def validator(private_key):
+    public_jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    public_jwk.update(kid=KID, use="sig", endorsements=["msteams"])
+    validator = JwtValidator(APP_ID)
+    validator.load_keys({"keys": [public_jwk]})
+    return validator
+
+
+def token(private_key, **claims):
+    now = int(time.time())
+    claims = dict({"iss": BOT_FRAMEWORK_ISSUER, "aud": APP_ID, "serviceurl": SERVICE_URL, "nbf": now - 60,
+                   "exp": now + 3600}, **claims)
+    return "Bearer " + jwt.encode(claims, private_key, algorithm="RS256", headers={"kid": KID})
+
+
+def activity(channel_id="msteams", service_url=SERVICE_URL):
+    return as_activity({"type": "message", "id": "1", "channelId": channel_id, "serviceUrl": service_url,
+                        "conversation": {"id": "conversation-1"}, "from": {"id": "user-1"}})
+
+
+def reason(validator, authorization, incoming):
+    try:
+        asyncio.run(validator.validate(authorization, incoming))
+    except Unauthorized as e:
+        return e.reason
+    return None
+
+
+def test_valid_token_is_accepted_and_cached(validator, private_key):
+    authorization = token(private_key)
+    assert reason(validator, authorization, activity()) is None
+    assert reason(validator, authorization, activity()) is None
+    assert validator.stats["cache_hits"] == 1
+
+
+@pytest.mark.parametrize("claims, expected", [
+    ({"aud": "someone-else"}, "wrong_audience"),
+    ({"iss": "https://example.com"}, "wrong_issuer"),
+    ({"exp": int(time.time()) - 3600}, "expired"),
+])
+def test_bad_claims_are_rejected(validator, private_key, claims, expected):
+    assert reason(validator, token(private_key, **claims), activity()) == expected
+
+
+def test_token_must_match_the_activity(validator, private_key):
+    authorization = token(private_key)
+    assert reason(validator, authorization, activity(channel_id="webchat")) == "channel_not_endorsed"
+    assert reason(validator, authorization, activity(service_url="https://evil.example.com/")) == "service_url_mismatch"
+
+
+def test_missing_or_foreign_token_is_rejected(validator):
+    other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    assert reason(validator, None, activity()) is not None
+    assert reason(validator, "Bearer not-a-jwt", activity()) == "malformed_token"
+    assert reason(validator, token(other_key), activity()) == "invalid_signature"
+    assert validator.stats["rejected"] == 3
@@ -0,0 +1,66 @@
+"""MicroBatcher: parallelism, batches and callers that give up"""
+
+import asyncio
+
+from bot_core.batching import MicroBatcher
+
+
+def test_parallelism_is_never_exceeded():
+    batcher = MicroBatcher(parallelism=2, window=0.001)
+    running = []
+    peak = []
+
+    async def request():
+        async with batcher.slot():
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.005)
+            running.pop()
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(8)))
+        batcher.close()
+
+    asyncio.run(run())
+    assert max(peak) == 2
+    assert batcher.stats["requests"] == 8
+    assert batcher.in_flight == 0
+
+
+def test_requests_within_the_window_go_out_together():
+    batcher = MicroBatcher(parallelism=4, window=0.02)
+
+    async def request():
+        async with batcher.slot():
+            await asyncio.sleep(0)
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(4)))
+        batcher.close()
+
+    asyncio.run(run())
+    assert batcher.stats["batches"] == 1
+    assert batcher.snapshot()["mean_batch"] == 4
+
+
+def test_cancelled_waiter_does_not_take_a_slot():
+    batcher = MicroBatcher(parallelism=1, window=0)
+
+    async def hold(seconds):
+        async with batcher.slot():
+            await asyncio.sleep(seconds)
+
+    async def run():
+        holder = asyncio.ensure_future(hold(0.02))
+        await asyncio.sleep(0.005)
+        waiter = asyncio.ensure_future(hold(0))
+        await asyncio.sleep(0.005)
+        assert batcher.saturated()
+        waiter.cancel()
+        await holder
+        await asyncio.wait_for(hold(0), 1)
+        batcher.close()
+
+    asyncio.run(run())
+    assert batcher.in_flight == 0
+    assert batcher.stats["requests"] == 2
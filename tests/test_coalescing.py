@@ -0,0 +1,114 @@
+"""SingleFlight: shared calls and streams, and what happens when they are cancelled"""
+
+import asyncio
+
+import pytest
+
+from bot_core.coalescing import FlightCancelled, SingleFlight
+
+
+def test_concurrent_calls_share_one_flight():
+    flights = SingleFlight()
+    calls = []
+
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", call) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["reply"] * 5
+    assert len(calls) == 1
+    assert flights.stats == {"calls": 5, "flights": 1, "coalesced": 4}
+    assert flights.snapshot()["in_flight"] == 0
+
+
+def test_last_caller_leaving_lands_the_flight_at_once():
+    flights = SingleFlight()
+
+    async def run():
+        caller = asyncio.ensure_future(flights.do("key", lambda: asyncio.sleep(1)))
+        await asyncio.sleep(0)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        # No loop iteration in between: the cancelled flight must already be gone
+        assert flights.snapshot()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_new_caller_after_cancel_starts_a_new_flight():
+    flights = SingleFlight()
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(0.01)
+        return len(started)
+
+    async def run():
+        caller = asyncio.ensure_future(flights.do("key", call))
+        await asyncio.sleep(0)
+        caller.cancel()
+        follower = asyncio.ensure_future(flights.do("key", call))
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        return await follower
+
+    assert asyncio.run(run()) == 2
+
+
+def test_cancelled_flight_fails_its_waiters_with_flight_cancelled():
+    flights = SingleFlight()
+
+    async def run():
+        caller = asyncio.ensure_future(flights.do("key", lambda: asyncio.sleep(1)))
+        await asyncio.sleep(0)
+        flights._flights["key"].task.cancel()
+        with pytest.raises(FlightCancelled):
+            await caller
+
+    asyncio.run(run())
+
+
+def test_stream_is_replayed_to_late_readers():
+    flights = SingleFlight()
+
+    async def chunks():
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def read(delay):
+        await asyncio.sleep(delay)
+        return [chunk async for chunk in flights.stream("key", chunks)]
+
+    async def run():
+        return await asyncio.gather(read(0), read(0.015))
+
+    assert asyncio.run(run()) == [["a", "b", "c"], ["a", "b", "c"]]
+    assert flights.stats["flights"] == 1
+
+
+def test_readers_of_a_cancelled_stream_get_a_normal_exception():
+    flights = SingleFlight()
+
+    async def chunks():
+        yield "a"
+        await asyncio.sleep(1)
+        yield "b"
+
+    async def read():
+        return [chunk async for chunk in flights.stream("key", chunks)]
+
+    async def run():
+        reader = asyncio.ensure_future(read())
+        await asyncio.sleep(0.01)
+        flights._flights["key"].task.cancel()
+        with pytest.raises(FlightCancelled):
+            await reader
+
+    asyncio.run(run())
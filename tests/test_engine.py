@@ -0,0 +1,131 @@
+"""BotEngine end to end with a fake Connector and reply function"""
+
+import asyncio
+import json
+
+from bot_core.admission import AdmissionController
+from bot_core.dedup import MemoryDedupIndex
+from bot_core.engine import REJECTION_REPLIES, BotEngine
+from bot_core.work_queue import MemoryQueueBackend
+
+SERVICE_URL = "https://smba.trafficmanager.net/emea/"
+
+
+class FakeTokens:
+    def prefetch(self, tenant_id):
+        pass
+
+
+class FakeConnector:
+    """Records the Activities the engine sends instead of posting them"""
+
+    app_id = "bot-app-id"
+    tenant_id = "bot-tenant"
+
+    def __init__(self):
+        self.tokens = FakeTokens()
+        self.sent = []
+
+    async def send(self, service_url, conversation_id, activity):
+        self.sent.append((conversation_id, activity))
+        return True
+
+
+def message(text="Szia", activity_id="1", conversation_id="conversation-1", user_id="user-1"):
+    return {
+        "type": "message", "id": activity_id, "text": text, "serviceUrl": SERVICE_URL, "channelId": "msteams",
+        "conversation": {"id": conversation_id}, "from": {"id": user_id, "aadObjectId": user_id},
+        "recipient": {"id": "28:bot-app-id"}, "channelData": {"tenant": {"id": "tenant-1"}}
+    }
+
+
+async def echo(text, conversation_id):
+    return f"Echo: {text}"
+
+
+def test_message_is_answered():
+    connector = FakeConnector()
+    engine = BotEngine(connector, echo)
+    response = asyncio.run(engine.handle(message("Szia")))
+    assert response.status_code == 200
+    assert [(conversation, activity["text"]) for conversation, activity in connector.sent] == [
+        ("conversation-1", "Echo: Szia")]
+
+
+def test_handle_request_parses_the_body():
+    connector = FakeConnector()
+    engine = BotEngine(connector, echo)
+    response = asyncio.run(engine.handle_request("application/json", json.dumps(message("Helló")).encode()))
+    assert response.status_code == 200
+    assert connector.sent[0][1]["text"] == "Echo: Helló"
+
+
+def test_handle_request_refuses_bad_bodies():
+    engine = BotEngine(FakeConnector(), echo)
+    assert asyncio.run(engine.handle_request("text/plain", b"{}")).status_code == 415
+    assert asyncio.run(engine.handle_request("application/json", b"{not json")).status_code == 400
+
+
+def test_redelivery_is_not_answered_twice():
+    connector = FakeConnector()
+    engine = BotEngine(connector, echo, dedup_index=MemoryDedupIndex())
+
+    async def deliver_twice():
+        return [await engine.handle(message()), await engine.handle(message())]
+
+    assert [response.status_code for response in asyncio.run(deliver_twice())] == [200, 200]
+    assert len(connector.sent) == 1
+    assert engine.stats["duplicates"] == 1
+
+
+def test_failed_message_can_be_redelivered():
+    connector = FakeConnector()
+    calls = []
+
+    async def flaky(text, conversation_id):
+        calls.append(text)
+        if len(calls) == 1:
+            raise RuntimeError("LLM down")
+        return "ok"
+
+    engine = BotEngine(connector, flaky, dedup_index=MemoryDedupIndex())
+
+    async def deliver_twice():
+        return [await engine.handle(message()), await engine.handle(message())]
+
+    assert [response.status_code for response in asyncio.run(deliver_twice())] == [500, 200]
+    assert [activity["text"] for _, activity in connector.sent] == ["ok"]
+
+
+def test_queue_mode_acknowledges_and_replies_in_the_background():
+    connector = FakeConnector()
+    engine = BotEngine(connector, echo, queue_backend=MemoryQueueBackend(), queue_workers=1)
+
+    async def run():
+        response = await engine.handle(message("háttér"))
+        assert await engine.work_queue.drain(timeout=5)
+        return response
+
+    assert asyncio.run(run()).status_code == 202
+    assert connector.sent[0][1]["text"] == "Echo: háttér"
+
+
+def test_rejected_message_gets_the_rejection_reply():
+    connector = FakeConnector()
+    admission = AdmissionController(user_burst=1, user_rate=1e-9)
+    engine = BotEngine(connector, echo, admission=admission)
+
+    async def run():
+        await engine.handle(message("egy", activity_id="1"))
+        await engine.handle(message("kettő", activity_id="2"))
+
+    asyncio.run(run())
+    assert [activity["text"] for _, activity in connector.sent] == ["Echo: egy", REJECTION_REPLIES["user_quota"]]
+
+
+def test_welcome_when_the_bot_is_added():
+    connector = FakeConnector()
+    engine = BotEngine(connector, echo, welcome="Szia!")
+    update = dict(message(), type="conversationUpdate", membersAdded=[{"id": "28:bot-app-id"}])
+    assert asyncio.run(engine.handle(update)).status_code == 200
+    assert connector.sent[0][1]["text"] == "Szia!"
@@ -0,0 +1,39 @@
+"""TranscriptLog: tails across segments, compaction and reopening"""
+
+from bot_core.transcript import TranscriptLog
+
+
+def turn(n):
+    return [{"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}]
+
+
+def test_tail_returns_the_last_messages_oldest_first(tmp_path):
+    log = TranscriptLog(str(tmp_path))
+    for n in range(5):
+        log.extend("conversation-1", turn(n))
+        log.extend("conversation-2", turn(100 + n))
+    assert [m["content"] for m in log.tail("conversation-1", 3)] == ["answer 3", "question 4", "answer 4"]
+    assert log.tail("unknown", 3) == []
+    log.close()
+
+
+def test_compaction_keeps_every_conversation_readable(tmp_path):
+    log = TranscriptLog(str(tmp_path), segment_bytes=512, compact_segments=1000)
+    for n in range(50):
+        log.extend(f"conversation-{n % 5}", turn(n))
+    segments = log.snapshot()["segments"]
+    log.compact(timeout=10)
+    assert log.stats["compactions"] >= 1
+    assert log.snapshot()["segments"] < segments
+    assert [m["content"] for m in log.tail("conversation-3", 2)] == ["question 48", "answer 48"]
+    log.close()
+
+
+def test_reopened_log_finds_the_old_messages(tmp_path):
+    log = TranscriptLog(str(tmp_path), segment_bytes=512)
+    for n in range(20):
+        log.extend("conversation-1", turn(n))
+    log.close()
+    reopened = TranscriptLog(str(tmp_path), segment_bytes=512)
+    assert [m["content"] for m in reopened.tail("conversation-1", 2)] == ["question 19", "answer 19"]
+    reopened.close()
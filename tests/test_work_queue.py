@@ -0,0 +1,133 @@
+"""WorkQueue: retries with backoff, PermanentError and draining, on both backends"""
+
+import asyncio
+import os
+
+import pytest
+
+from bot_core.work_queue import MemoryQueueBackend, PermanentError, SqliteQueueBackend, WorkQueue
+
+
+class RecordingBackend(MemoryQueueBackend):
+    """Memory backend that remembers the retry delays and acknowledged jobs"""
+
+    def __init__(self):
+        super().__init__()
+        self.delays = []
+        self.acked = []
+
+    def retry(self, job, delay=0.0):
+        self.delays.append(delay)
+        return super().retry(job, delay)
+
+    def ack(self, job):
+        self.acked.append(job.id)
+
+
+def run_queue(work_queue, payloads, timeout=5):
+    async def run():
+        for payload in payloads:
+            assert await work_queue.submit(payload)
+        return await work_queue.drain(timeout, poll_interval=0.005)
+
+    return asyncio.run(run())
+
+
+def test_failed_job_is_retried_with_exponential_backoff():
+    backend = RecordingBackend()
+    attempts = []
+
+    async def handler(payload):
+        attempts.append(payload["n"])
+        if len(attempts) < 3:
+            raise RuntimeError("LLM down")
+
+    work_queue = WorkQueue(backend, handler, workers=1, max_attempts=5, retry_delay=0.01, max_retry_delay=1.0,
+                           poll_interval=0.005, rng=lambda: 1.0)
+    assert run_queue(work_queue, [{"n": 1}])
+    assert attempts == [1, 1, 1]
+    assert backend.delays == [0.01, 0.02]
+    assert backend.acked == [1]
+
+
+def test_backoff_is_capped_and_the_job_dropped_after_max_attempts():
+    backend = RecordingBackend()
+    attempts = []
+
+    async def handler(payload):
+        attempts.append(1)
+        raise RuntimeError("LLM down")
+
+    work_queue = WorkQueue(backend, handler, workers=1, max_attempts=4, retry_delay=0.01, max_retry_delay=0.015,
+                           poll_interval=0.005, rng=lambda: 1.0)
+    assert run_queue(work_queue, [{"n": 1}])
+    assert len(attempts) == 4
+    assert backend.delays == [0.01, 0.015, 0.015]
+    assert backend.acked == [1]
+
+
+def test_jitter_scales_the_delay():
+    backend = RecordingBackend()
+
+    async def handler(payload):
+        if not backend.delays:
+            raise RuntimeError("LLM down")
+
+    work_queue = WorkQueue(backend, handler, workers=1, retry_delay=0.04, poll_interval=0.005, rng=lambda: 0.25)
+    assert run_queue(work_queue, [{"n": 1}])
+    assert backend.delays == [0.01]
+
+
+def test_permanent_error_is_not_retried():
+    backend = RecordingBackend()
+    attempts = []
+
+    async def handler(payload):
+        attempts.append(1)
+        raise PermanentError("reply already partly posted")
+
+    work_queue = WorkQueue(backend, handler, workers=1, poll_interval=0.005)
+    assert run_queue(work_queue, [{"n": 1}])
+    assert attempts == [1]
+    assert backend.delays == []
+    assert backend.acked == [1]
+
+
+def test_full_queue_refuses_the_payload():
+    work_queue = WorkQueue(MemoryQueueBackend(maxsize=1), lambda payload: asyncio.sleep(1), workers=1)
+
+    async def run():
+        # Submitted before a worker could take the first one
+        accepted = [await work_queue.submit({"n": 1}), await work_queue.submit({"n": 2})]
+        work_queue.stop()
+        return accepted
+
+    assert asyncio.run(run()) == [True, False]
+
+
+@pytest.mark.parametrize("failures", [0, 1])
+def test_sqlite_backend_runs_and_retries_jobs(tmp_path, failures):
+    handled = []
+
+    async def handler(payload):
+        handled.append(payload["n"])
+        if len(handled) <= failures:
+            raise RuntimeError("LLM down")
+
+    backend = SqliteQueueBackend(os.path.join(tmp_path, "queue.db"), poll_interval=0.005)
+    work_queue = WorkQueue(backend, handler, workers=2, retry_delay=0.01, poll_interval=0.005)
+
+    async def run():
+        for n in range(3):
+            assert await work_queue.submit({"n": n})
+        # A durable backend's queued jobs are left for the next process: wait for them here
+        for _ in range(400):
+            if backend.size() == 0 and len(handled) == 3 + failures:
+                break
+            await asyncio.sleep(0.005)
+        await work_queue.drain(5)
+
+    asyncio.run(run())
+    assert sorted(set(handled)) == [0, 1, 2]
+    assert len(handled) == 3 + failures
+    assert backend.size() == 0